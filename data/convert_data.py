@@ -0,0 +1,44 @@
+import os
+import sys
+import pickle
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from utils.mmap_store import get_mmap_store_path, save_mmap_store, load_mmap_store
+
+# Convert the pickled datasets saved by download_data.py to the memory-mapped ".npystore" format
+# used by generate_data.import_real_data. Run from the root of the repo: python data/convert_data.py
+
+dirs = [("data/numerical_only/regression", True),
+        ("data/numerical_only/balanced", False),
+        ("data/num_and_cat/regression", True),
+        ("data/num_and_cat/balanced", False)]
+
+
+def convert_dataset(pickle_path, regression, overwrite=False):
+    store_path = get_mmap_store_path(pickle_path)
+    if os.path.isdir(store_path) and not overwrite:
+        print("{} already converted".format(pickle_path))
+        return
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+    if len(data) == 3:
+        X, y, categorical_indicator = data
+    else:
+        X, y = data
+        categorical_indicator = None
+    meta = save_mmap_store(X, y, categorical_indicator, store_path, regression=regression)
+    # Check that the conversion didn't change anything
+    X_new, y_new, _ = load_mmap_store(store_path, verify=True)
+    assert np.array_equal(np.array(X, dtype=np.float32), X_new, equal_nan=True)
+    assert np.array_equal(np.array(y).reshape(-1), np.array(y_new).reshape(-1))
+    print("Converted {} ({} rows, {} features)".format(pickle_path, meta["n_rows"], meta["n_features"]))
+
+
+if __name__ == "__main__":
+    overwrite = "--overwrite" in sys.argv
+    for dir_name, regression in dirs:
+        if not os.path.isdir(dir_name):
+            continue
+        for file_name in sorted(os.listdir(dir_name)):
+            if file_name.startswith("data_") and not file_name.endswith(".npystore"):
+                convert_dataset(os.path.join(dir_name, file_name), regression, overwrite=overwrite)
@@ -1,5 +1,6 @@
-from utils import create_sweep
+from utils import create_sweep, LOCAL_SWEEPS_DIR
 import pandas as pd
+import sys
 
 # We use one project per benchmark to avoid WandB getting super slow
 WANDB_PROJECT_NAMES = ["thesis-5", "thesis-5", "thesis-5", "thesis-5",
@@ -125,6 +126,8 @@ models = ["gbt", "rf", "xgb", "hgbt",
           "ft_transformer", "resnet", "mlp", "saint"]
 
 if __name__ == "__main__":
+    # With --local, the sweeps are saved as json files to be run with src/local_sweep.py instead of wandb
+    local = "--local" in sys.argv
     sweep_ids = []
     names = []
     projects = []
@@ -146,7 +149,8 @@ if __name__ == "__main__":
                              datasets = benchmark["datasets"],
                              default=default,
                              project=WANDB_PROJECT_NAMES[i],
-                             name=name)
+                             name=name,
+                             local=local)
                 sweep_ids.append(sweep_id)
                 names.append(name)
                 projects.append(WANDB_PROJECT_NAMES[i])
@@ -155,7 +159,8 @@ if __name__ == "__main__":
                 print(f"In project {WANDB_PROJECT_NAMES[i]}")
 
     df = pd.DataFrame({"sweep_id": sweep_ids, "name": names, "project":projects})
-    df.to_csv("launch_config/sweeps/benchmark_sweeps.csv", index=False)
-    print("Check the sweeps id saved at sweeps/benchmark_sweeps.csv")
+    sweeps_dir = LOCAL_SWEEPS_DIR if local else "launch_config/sweeps"
+    df.to_csv(f"{sweeps_dir}/benchmark_sweeps.csv", index=False)
+    print(f"Check the sweeps id saved at {sweeps_dir}/benchmark_sweeps.csv")
 
 
@@ -1,5 +1,6 @@
-from utils import create_sweep
+from utils import create_sweep, LOCAL_SWEEPS_DIR
 import pandas as pd
+import sys
 
 # We use one project per xp to avoid WandB getting super slow
 WANDB_PROJECT_NAMES = ["thesis-5", "thesis-5", "thesis-5", "thesis-5"]
@@ -113,6 +114,8 @@ datasets = ["electricity",
              "wine"]
 
 if __name__ == "__main__":
+    # With --local, the sweeps are saved as json files to be run with src/local_sweep.py instead of wandb
+    local = "--local" in sys.argv
     sweep_ids = []
     names = []
     projects = []
@@ -139,6 +142,7 @@ if __name__ == "__main__":
                              default=default,
                              project=WANDB_PROJECT_NAMES[i],
                              name=name,
+                             local=local,
                             remove_tranforms_from_model_config=True) #overwrite transforms in model config
                 sweep_ids.append(sweep_id)
                 names.append(name)
@@ -149,7 +153,8 @@ if __name__ == "__main__":
 
     df = pd.DataFrame({"sweep_id": sweep_ids, "name": names,
                        "project": projects})
-    df.to_csv("launch_config/sweeps/xps_sweeps.csv", index=False)
-    print("Check the sweeps id saved at sweeps/xps_sweeps.csv")
+    sweeps_dir = LOCAL_SWEEPS_DIR if local else "launch_config/sweeps"
+    df.to_csv(f"{sweeps_dir}/xps_sweeps.csv", index=False)
+    print(f"Check the sweeps id saved at {sweeps_dir}/xps_sweeps.csv")
 
 
@@ -1,9 +1,17 @@
-import wandb
+import json
+import os
 from model_configs import config_dic
 
+LOCAL_SWEEPS_DIR = "launch_config/sweeps/local"
+
 
 def create_sweep(data_transform_config, model_name, regression, default, project, name,
-                 dataset_size, categorical, datasets, remove_tranforms_from_model_config=False):
+                 dataset_size, categorical, datasets, remove_tranforms_from_model_config=False, local=False):
+    """
+    Create a sweep for model_name on the given datasets.
+    If local, the sweep config is saved to a json file (to be run with src/local_sweep.py)
+    and its path is returned instead of a wandb sweep id.
+    """
     # Use the appropriate model config
     model_config = config_dic[model_name]["regression" if regression else "classif"]["default" if default else "random"]
     if remove_tranforms_from_model_config:  # prevent conflicts with data_transform_config
@@ -49,6 +57,14 @@ def create_sweep(data_transform_config, model_name, regression, default, project
         "parameters": dict(model_config, **data_transform_config)
     }
 
+    if local:
+        os.makedirs(LOCAL_SWEEPS_DIR, exist_ok=True)
+        sweep_path = os.path.join(LOCAL_SWEEPS_DIR, "{}.json".format(name))
+        with open(sweep_path, "w") as f:
+            json.dump(sweep_config, f, indent=2)
+        return sweep_path
+
+    import wandb
     sweep_id = wandb.sweep(sweep_config, project=project)
 
     return sweep_id
@@ -9,6 +9,7 @@ import numpy as np
 
 from TabSurvey.utils.io_utils import get_output_path
 import os
+import uuid
 
 
 class BaseModelTorch(BaseModel):
@@ -17,6 +18,7 @@ class BaseModelTorch(BaseModel):
         super().__init__(params, args)
         self.device = self.get_device()
         self.gpus = args.gpu_ids if args.use_gpu and torch.cuda.is_available() and args.data_parallel else None
+        self.best_state = None
 
     def to_device(self):
         if self.args.data_parallel:
@@ -60,43 +62,36 @@ class BaseModelTorch(BaseModel):
         train_loader = DataLoader(dataset=train_dataset, batch_size=self.args.batch_size, shuffle=True,
                                   num_workers=4)
 
-        val_dataset = TensorDataset(X_val, y_val)
-        val_loader = DataLoader(dataset=val_dataset, batch_size=self.args.val_batch_size, shuffle=True)
-
         min_val_loss = float("inf")
         min_val_loss_idx = 0
 
         loss_history = []
         val_loss_history = []
 
-        for epoch in range(self.args.epochs):
-            for i, (batch_X, batch_y) in enumerate(train_loader):
+        def forward(batch):
+            batch_X, batch_y = batch
+            out = self.model(batch_X.to(self.device))
 
-                out = self.model(batch_X.to(self.device))
+            if self.args.objective == "regression" or self.args.objective == "binary":
+                out = out.squeeze()
+            return out, batch_y.to(self.device)
 
-                if self.args.objective == "regression" or self.args.objective == "binary":
-                    out = out.squeeze()
+        for epoch in range(self.args.epochs):
+            epoch_losses = []
+            for i, batch in enumerate(train_loader):
+                out, batch_y = forward(batch)
 
-                loss = loss_func(out, batch_y.to(self.device))
-                loss_history.append(loss.item())
+                loss = loss_func(out, batch_y)
+                epoch_losses.append(loss.detach())
 
                 optimizer.zero_grad()
                 loss.backward()
                 optimizer.step()
+            self.extend_loss_history(loss_history, epoch_losses)
 
             # Early Stopping
-            val_loss = 0.0
-            val_dim = 0
-            for val_i, (batch_val_X, batch_val_y) in enumerate(val_loader):
-                out = self.model(batch_val_X.to(self.device))
-
-                if self.args.objective == "regression" or self.args.objective == "binary":
-                    out = out.squeeze()
-
-                val_loss += loss_func(out, batch_val_y.to(self.device))
-                val_dim += 1
-
-            val_loss /= val_dim
+            batch_size = self.get_eval_batch_size()
+            val_loss = self.evaluate_loss(loss_func, forward, zip(X_val.split(batch_size), y_val.split(batch_size)))
             val_loss_history.append(val_loss.item())
 
             print("Epoch %d, Val Loss: %.5f" % (epoch, val_loss))
@@ -106,7 +101,7 @@ class BaseModelTorch(BaseModel):
                 min_val_loss_idx = epoch
 
                 # Save the currently best model
-                self.save_model(filename_extension="best", directory="tmp")
+                self.save_best_state()
 
             if min_val_loss_idx + self.args.early_stopping_rounds < epoch:
                 print("Validation loss has not improved for %d steps!" % self.args.early_stopping_rounds)
@@ -114,9 +109,38 @@ class BaseModelTorch(BaseModel):
                 break
 
         # Load best model
-        self.load_model(filename_extension="best", directory="tmp")
+        self.load_best_state()
         return loss_history, val_loss_history
 
+    def get_eval_batch_size(self):
+        # no activations are kept for the backward pass during the evaluation, so larger batches than
+        # val_batch_size usually fit in memory, but they are opt-in (args.eval_batch_size)
+        return getattr(self.args, "eval_batch_size", None) or self.args.val_batch_size
+
+    def evaluate_loss(self, loss_func, forward, batches):
+        """
+        Mean loss over the samples of the batches, computed without gradients and accumulated on the device,
+        so that the host and the device only synchronize once, when the result is read
+        :param forward: function mapping a batch (tuple of tensors, the first one having a row per sample)
+        to (model outputs, targets on the device)
+        :return: 0-dim tensor on the device
+        """
+        total_loss = torch.zeros((), device=self.device)
+        n_samples = 0
+        with torch.no_grad():
+            for batch in batches:
+                out, targets = forward(batch)
+                total_loss += loss_func(out, targets) * len(batch[0])
+                n_samples += len(batch[0])
+        return total_loss / n_samples
+
+    @staticmethod
+    def extend_loss_history(loss_history, epoch_losses):
+        # the training losses are kept on the device during the epoch and read all at once at the end,
+        # instead of synchronizing at each step with loss.item()
+        if len(epoch_losses) > 0:
+            loss_history.extend(torch.stack(epoch_losses).tolist())
+
     def predict(self, X):
         if self.args.objective == "regression":
             self.predictions = self.predict_helper(X)
@@ -170,6 +194,38 @@ class BaseModelTorch(BaseModel):
         os.remove(filename)
         self.model.load_state_dict(state_dict)
 
+    def get_best_checkpoint_extension(self):
+        # unique per run, so that concurrent runs on the same dataset don't overwrite each other's checkpoint
+        if getattr(self.args, "model_id", None) is not None:
+            return "{}_best".format(self.args.model_id)
+        if not hasattr(self, "_best_checkpoint_id"):
+            self._best_checkpoint_id = uuid.uuid4().hex
+        return "{}_best".format(self._best_checkpoint_id)
+
+    def save_best_state(self):
+        """
+        Keep the weights of the best epoch, by default as a copy of the state dict on cpu (reusing the same
+        tensors at each improvement), or in output/<model>/<dataset>/tmp if args.checkpoint_to_file
+        """
+        if getattr(self.args, "checkpoint_to_file", False):
+            self.save_model(filename_extension=self.get_best_checkpoint_extension(), directory="tmp")
+            return
+        state_dict = self.model.state_dict()
+        if self.best_state is None:
+            self.best_state = {name: tensor.detach().to("cpu", copy=True) for name, tensor in state_dict.items()}
+        else:
+            for name, tensor in state_dict.items():
+                self.best_state[name].copy_(tensor)
+
+    def load_best_state(self):
+        """
+        Load the weights saved by save_best_state (and remove the checkpoint file)
+        """
+        if getattr(self.args, "checkpoint_to_file", False):
+            self.load_model(filename_extension=self.get_best_checkpoint_extension(), directory="tmp")
+        elif self.best_state is not None:
+            self.model.load_state_dict(self.best_state)
+
     def get_model_size(self):
         model_size = sum(t.numel() for t in self.model.parameters() if t.requires_grad)
         return model_size
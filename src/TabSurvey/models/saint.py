@@ -5,14 +5,13 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
-from torch.utils.data import DataLoader
 
 import numpy as np
 from torch import einsum
 from einops import rearrange
 
 from TabSurvey.models.saint_lib.models.pretrainmodel import SAINT as SAINTModel
-from TabSurvey.models.saint_lib.data_openml import DataSetCatCon
+from TabSurvey.models.saint_lib.data_openml import DataSetCatCon, CatConBatchLoader
 from TabSurvey.models.saint_lib.augmentations import embed_data_mask
 
 '''
@@ -86,10 +85,10 @@ class SAINT(BaseModelTorch):
         y_val = {'data': y_val.reshape(-1, 1)}
 
         train_ds = DataSetCatCon(X, y, self.args.cat_idx, self.args.objective)
-        trainloader = DataLoader(train_ds, batch_size=self.batch_size, shuffle=True, num_workers=4)
+        trainloader = CatConBatchLoader(train_ds, batch_size=self.batch_size, shuffle=True)
 
         val_ds = DataSetCatCon(X_val, y_val, self.args.cat_idx, self.args.objective)
-        valloader = DataLoader(val_ds, batch_size=self.args.val_batch_size, shuffle=True, num_workers=4)
+        valloader = CatConBatchLoader(val_ds, batch_size=self.args.val_batch_size)
 
         min_val_loss = float("inf")
         min_val_loss_idx = 0
@@ -97,75 +96,57 @@ class SAINT(BaseModelTorch):
         loss_history = []
         val_loss_history = []
 
-        for epoch in range(self.args.epochs):
-            self.model.train()
+        def forward(data):
+            # x_categ is the the categorical data,
+            # x_cont has continuous data,
+            # y_gts has ground truth ys.
+            # cat_mask is an array of ones same shape as x_categ and an additional column(corresponding to CLS
+            # token) set to 0s.
+            # con_mask is an array of ones same shape as x_cont.
+            x_categ, x_cont, y_gts, cat_mask, con_mask = data
 
-            for i, data in enumerate(trainloader, 0):
-                optimizer.zero_grad()
+            x_categ, x_cont = x_categ.to(self.device), x_cont.to(self.device)
+            cat_mask, con_mask = cat_mask.to(self.device), con_mask.to(self.device)
 
-                # x_categ is the the categorical data,
-                # x_cont has continuous data,
-                # y_gts has ground truth ys.
-                # cat_mask is an array of ones same shape as x_categ and an additional column(corresponding to CLS
-                # token) set to 0s.
-                # con_mask is an array of ones same shape as x_cont.
-                x_categ, x_cont, y_gts, cat_mask, con_mask = data
+            # We are converting the data to embeddings in the next step
+            _, x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, self.model)
 
-                x_categ, x_cont = x_categ.to(self.device), x_cont.to(self.device)
-                cat_mask, con_mask = cat_mask.to(self.device), con_mask.to(self.device)
+            reps = self.model.transformer(x_categ_enc, x_cont_enc)
 
-                # We are converting the data to embeddings in the next step
-                _, x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, self.model)
+            # select only the representations corresponding to CLS token
+            # and apply mlp on it in the next step to get the predictions.
+            y_reps = reps[:, 0, :]
 
-                reps = self.model.transformer(x_categ_enc, x_cont_enc)
+            y_outs = self.model.mlpfory(y_reps)
 
-                # select only the representations corresponding to CLS token
-                # and apply mlp on it in the next step to get the predictions.
-                y_reps = reps[:, 0, :]
+            if self.args.objective == "regression":
+                y_gts = y_gts.to(self.device)
+            elif self.args.objective == "classification":
+                y_gts = y_gts.to(self.device).squeeze()
+            else:
+                y_gts = y_gts.to(self.device).float()
+            return y_outs, y_gts
 
-                y_outs = self.model.mlpfory(y_reps)
+        for epoch in range(self.args.epochs):
+            self.model.train()
 
-                if self.args.objective == "regression":
-                    y_gts = y_gts.to(self.device)
-                elif self.args.objective == "classification":
-                    y_gts = y_gts.to(self.device).squeeze()
-                else:
-                    y_gts = y_gts.to(self.device).float()
+            epoch_losses = []
+            for i, data in enumerate(trainloader, 0):
+                optimizer.zero_grad()
+
+                y_outs, y_gts = forward(data)
 
                 loss = criterion(y_outs, y_gts)
                 loss.backward()
                 optimizer.step()
 
-                loss_history.append(loss.item())
-
-                # print("Loss", loss.item())
+                epoch_losses.append(loss.detach())
+            self.extend_loss_history(loss_history, epoch_losses)
 
             # Early Stopping
-            val_loss = 0.0
-            val_dim = 0
+            # (with val_batch_size, as the intersample attention makes the outputs depend on the batch)
             self.model.eval()
-            with torch.no_grad():
-                for data in valloader:
-                    x_categ, x_cont, y_gts, cat_mask, con_mask = data
-
-                    x_categ, x_cont = x_categ.to(self.device), x_cont.to(self.device)
-                    cat_mask, con_mask = cat_mask.to(self.device), con_mask.to(self.device)
-
-                    _, x_categ_enc, x_cont_enc = embed_data_mask(x_categ, x_cont, cat_mask, con_mask, self.model)
-                    reps = self.model.transformer(x_categ_enc, x_cont_enc)
-                    y_reps = reps[:, 0, :]
-                    y_outs = self.model.mlpfory(y_reps)
-
-                    if self.args.objective == "regression":
-                        y_gts = y_gts.to(self.device)
-                    elif self.args.objective == "classification":
-                        y_gts = y_gts.to(self.device).squeeze()
-                    else:
-                        y_gts = y_gts.to(self.device).float()
-
-                    val_loss += criterion(y_outs, y_gts)
-                    val_dim += 1
-            val_loss /= val_dim
+            val_loss = self.evaluate_loss(criterion, forward, valloader)
 
             val_loss_history.append(val_loss.item())
 
@@ -176,14 +157,14 @@ class SAINT(BaseModelTorch):
                 min_val_loss_idx = epoch
 
                 # Save the currently best model
-                self.save_model(filename_extension="{}_best".format(self.model_id), directory="tmp")
+                self.save_best_state()
 
             if min_val_loss_idx + self.args.early_stopping_rounds < epoch:
                 print("Validation loss has not improved for %d steps!" % self.args.early_stopping_rounds)
                 print("Early stopping applies.")
                 break
 
-        self.load_model(filename_extension="{}_best".format(self.model_id), directory="tmp")
+        self.load_best_state()
         return loss_history, val_loss_history
 
     def predict_helper(self, X):
@@ -191,7 +172,7 @@ class SAINT(BaseModelTorch):
         y = {'data': np.ones((X['data'].shape[0], 1))}
 
         test_ds = DataSetCatCon(X, y, self.args.cat_idx, self.args.objective)
-        testloader = DataLoader(test_ds, batch_size=self.args.val_batch_size, shuffle=False, num_workers=4)
+        testloader = CatConBatchLoader(test_ds, batch_size=self.args.val_batch_size)
 
         self.model.eval()
 
@@ -231,7 +212,7 @@ class SAINT(BaseModelTorch):
         y = {'data': np.ones((X['data'].shape[0], 1))}
 
         test_ds = DataSetCatCon(X, y, self.args.cat_idx, self.args.objective)
-        testloader = DataLoader(test_ds, batch_size=self.args.val_batch_size, shuffle=False, num_workers=4)
+        testloader = CatConBatchLoader(test_ds, batch_size=self.args.val_batch_size)
 
         self.model.eval()
         # print(self.model)
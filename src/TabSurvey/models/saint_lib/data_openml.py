@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+import torch
 from torch.utils.data import Dataset
 
 
@@ -52,11 +53,37 @@ class DataSetCatCon(Dataset):
         if continuous_mean_std is not None:
             mean, std = continuous_mean_std
             self.X2 = (self.X2 - mean) / std
+        # [cls|X1] and [cls_mask|X1_mask], built once instead of for each row
+        self.X1_cls = np.concatenate((self.cls, self.X1), axis=1)
+        self.X1_cls_mask = np.concatenate((self.cls_mask, self.X1_mask), axis=1)
 
     def __len__(self):
         return len(self.y)
 
     def __getitem__(self, idx):
         # X1 has categorical data, X2 has continuous
-        return np.concatenate((self.cls[idx], self.X1[idx])), self.X2[idx], self.y[idx], np.concatenate(
-            (self.cls_mask[idx], self.X1_mask[idx])), self.X2_mask[idx]
+        return self.X1_cls[idx], self.X2[idx], self.y[idx], self.X1_cls_mask[idx], self.X2_mask[idx]
+
+
+class CatConBatchLoader:
+    """
+    Iterate over the batches of a DataSetCatCon, as a DataLoader with the default collate function would,
+    but slicing whole tensors instead of collating rows (no worker processes needed for in-memory data)
+    """
+    def __init__(self, dataset, batch_size, shuffle=False):
+        self.tensors = [torch.from_numpy(np.ascontiguousarray(array)) for array in
+                        (dataset.X1_cls, dataset.X2, dataset.y, dataset.X1_cls_mask, dataset.X2_mask)]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return (len(self.tensors[0]) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        tensors = self.tensors
+        if self.shuffle:
+            # one gather per epoch, then each batch is a view
+            permutation = torch.randperm(len(tensors[0]))
+            tensors = [tensor[permutation] for tensor in tensors]
+        for start in range(0, len(tensors[0]), self.batch_size):
+            yield tuple(tensor[start:start + self.batch_size] for tensor in tensors)
@@ -80,57 +80,43 @@ class TabTransformer(BaseModelTorch):
         train_loader = DataLoader(dataset=train_dataset, batch_size=self.batch_size, shuffle=True,
                                   num_workers=2)
 
-        val_dataset = TensorDataset(X_val, y_val)
-        val_loader = DataLoader(dataset=val_dataset, batch_size=self.args.val_batch_size, shuffle=True)
-
         min_val_loss = float("inf")
         min_val_loss_idx = 0
 
         loss_history = []
         val_loss_history = []
 
-        for epoch in range(self.args.epochs):
-            for i, (batch_X, batch_y) in enumerate(train_loader):
+        def forward(batch):
+            batch_X, batch_y = batch
+            if self.args.cat_idx:
+                x_categ = batch_X[:, self.args.cat_idx].int().to(self.device)
+            else:
+                x_categ = None
 
-                if self.args.cat_idx:
-                    x_categ = batch_X[:, self.args.cat_idx].int().to(self.device)
-                else:
-                    x_categ = None
+            x_cont = batch_X[:, self.num_idx].to(self.device)
 
-                x_cont = batch_X[:, self.num_idx].to(self.device)
+            out = self.model(x_categ, x_cont)
 
-                out = self.model(x_categ, x_cont)
+            if self.args.objective == "regression" or self.args.objective == "binary":
+                out = out.squeeze()
+            return out, batch_y.to(self.device)
 
-                if self.args.objective == "regression" or self.args.objective == "binary":
-                    out = out.squeeze()
+        for epoch in range(self.args.epochs):
+            epoch_losses = []
+            for i, batch in enumerate(train_loader):
+                out, batch_y = forward(batch)
 
-                loss = loss_func(out, batch_y.to(self.device))
-                loss_history.append(loss.item())
+                loss = loss_func(out, batch_y)
+                epoch_losses.append(loss.detach())
 
                 optimizer.zero_grad()
                 loss.backward()
                 optimizer.step()
+            self.extend_loss_history(loss_history, epoch_losses)
 
             # Early Stopping
-            val_loss = 0.0
-            val_dim = 0
-            for val_i, (batch_val_X, batch_val_y) in enumerate(val_loader):
-
-                if self.args.cat_idx:
-                    x_categ = batch_val_X[:, self.args.cat_idx].int().to(self.device)
-                else:
-                    x_categ = None
-
-                x_cont = batch_val_X[:, self.num_idx].to(self.device)
-
-                out = self.model(x_categ, x_cont)
-
-                if self.args.objective == "regression" or self.args.objective == "binary":
-                    out = out.squeeze()
-
-                val_loss += loss_func(out, batch_val_y.to(self.device))
-                val_dim += 1
-            val_loss /= val_dim
+            batch_size = self.get_eval_batch_size()
+            val_loss = self.evaluate_loss(loss_func, forward, zip(X_val.split(batch_size), y_val.split(batch_size)))
             val_loss_history.append(val_loss.item())
 
             print("Epoch %d: Val Loss %.5f" % (epoch, val_loss))
@@ -140,14 +126,14 @@ class TabTransformer(BaseModelTorch):
                 min_val_loss_idx = epoch
 
                 # Save the currently best model
-                self.save_model(filename_extension="best", directory="tmp")
+                self.save_best_state()
 
             if min_val_loss_idx + self.args.early_stopping_rounds < epoch:
                 print("Validation loss has not improved for %d steps!" % self.args.early_stopping_rounds)
                 print("Early stopping applies.")
                 break
 
-        self.load_model(filename_extension="best", directory="tmp")
+        self.load_best_state()
         return loss_history, val_loss_history
 
     def predict_helper(self, X):
@@ -9,27 +9,25 @@ from utils.scorer import get_scorer
 from utils.timer import Timer
 from utils.io_utils import save_results_to_file, save_hyperparameters_to_file, save_loss_to_file
 from utils.parser import get_parser, get_given_parameters_parser
+from utils.fold_cache import get_folds, materialize_folds
 
-from sklearn.model_selection import KFold, StratifiedKFold  # , train_test_split
 
-
-def cross_validation(model, X, y, args, save_model=False):
+def cross_validation(model, X, y, args, save_model=False, folds=None, save_artifacts=None):
+    """ folds: (X_train, X_test, y_train, y_test) of each fold, as returned by materialize_folds (split here if None)
+        save_artifacts: save the model and predictions of each fold (default: only with save_model or
+        args.save_fold_artifacts)
+    """
     # Record some statistics and metrics
     sc = get_scorer(args)
     train_timer = Timer()
     test_timer = Timer()
 
-    if args.objective == "regression":
-        kf = KFold(n_splits=args.num_splits, shuffle=args.shuffle, random_state=args.seed)
-    elif args.objective == "classification" or args.objective == "binary":
-        kf = StratifiedKFold(n_splits=args.num_splits, shuffle=args.shuffle, random_state=args.seed)
-    else:
-        raise NotImplementedError("Objective" + args.objective + "is not yet implemented.")
-
-    for i, (train_index, test_index) in enumerate(kf.split(X, y)):
+    if folds is None:
+        folds = get_folds(X, y, args)
+    if save_artifacts is None:
+        save_artifacts = save_model or getattr(args, "save_fold_artifacts", False)
 
-        X_train, X_test = X[train_index], X[test_index]
-        y_train, y_test = y[train_index], y[test_index]
+    for i, (X_train, X_test, y_train, y_test) in enumerate(folds):
 
         # X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=0.05, random_state=args.seed)
 
@@ -47,7 +45,8 @@ def cross_validation(model, X, y, args, save_model=False):
         test_timer.end()
 
         # Save model weights and the truth/prediction pairs for traceability
-        curr_model.save_model_and_predictions(y_test, i)
+        if save_artifacts:
+            curr_model.save_model_and_predictions(y_test, i)
 
         if save_model:
             save_loss_to_file(args, loss_history, "loss", extension=i)
@@ -74,13 +73,14 @@ def cross_validation(model, X, y, args, save_model=False):
 
 
 class Objective(object):
-    def __init__(self, args, model_name, X, y):
+    def __init__(self, args, model_name, X, y, folds=None):
         # Save the model that will be trained
         self.model_name = model_name
 
-        # Save the trainings data
+        # Save the trainings data, and its cross validation folds (shared by all trials)
         self.X = X
         self.y = y
+        self.folds = folds if folds is not None else get_folds(X, y, args)
 
         self.args = args
 
@@ -92,7 +92,7 @@ class Objective(object):
         model = self.model_name(trial_params, self.args)
 
         # Cross validate the chosen hyperparameters
-        sc, time = cross_validation(model, self.X, self.y, self.args)
+        sc, time = cross_validation(model, self.X, self.y, self.args, folds=self.folds)
 
         save_hyperparameters_to_file(self.args, trial_params, sc.get_results(), time)
 
@@ -113,12 +113,13 @@ def main(args):
                                 study_name=study_name,
                                 storage=storage_name,
                                 load_if_exists=True)
-    study.optimize(Objective(args, model_name, X, y), n_trials=args.n_trials)
+    folds = materialize_folds(X, y, args)
+    study.optimize(Objective(args, model_name, X, y, folds), n_trials=args.n_trials)
     print("Best parameters:", study.best_trial.params)
 
     # Run best trial again and save it!
     model = model_name(study.best_trial.params, args)
-    cross_validation(model, X, y, args, save_model=True)
+    cross_validation(model, X, y, args, save_model=True, folds=folds)
 
 
 def main_once(args):
@@ -130,7 +131,7 @@ def main_once(args):
     parameters = args.parameters[args.dataset][args.model_name]
     model = model_name(parameters, args)
 
-    sc, time = cross_validation(model, X, y, args)
+    sc, time = cross_validation(model, X, y, args, save_artifacts=True)
     print(sc.get_results())
     print(time)
 
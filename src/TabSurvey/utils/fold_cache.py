@@ -0,0 +1,104 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+import numpy as np
+from sklearn.model_selection import KFold, StratifiedKFold
+
+from utils.io_utils import get_output_path
+
+FOLD_ARRAYS = ["X_train", "X_test", "y_train", "y_test"]
+
+
+def get_fold_indices(X, y, args):
+    """ Split the data in the cross validation folds.
+        return: list of (train_index, test_index)
+    """
+    if args.objective == "regression":
+        kf = KFold(n_splits=args.num_splits, shuffle=args.shuffle, random_state=args.seed)
+    elif args.objective == "classification" or args.objective == "binary":
+        kf = StratifiedKFold(n_splits=args.num_splits, shuffle=args.shuffle, random_state=args.seed)
+    else:
+        raise NotImplementedError("Objective" + args.objective + "is not yet implemented.")
+    return list(kf.split(X, y))
+
+
+def get_folds(X, y, args):
+    """ Split the data once in the cross validation folds, kept in memory.
+        return: list of (X_train, X_test, y_train, y_test)
+    """
+    return [(X[train_index], X[test_index], y[train_index], y[test_index])
+            for train_index, test_index in get_fold_indices(X, y, args)]
+
+
+def get_folds_key(X, y, args):
+    # Everything which determines the folds
+    h = hashlib.sha256()
+    h.update(str((args.objective, args.num_splits, args.shuffle, args.seed)).encode())
+    for array in [X, y]:
+        array = np.ascontiguousarray(array)
+        h.update(str((array.shape, array.dtype.str)).encode())
+        h.update(array.data)
+    return h.hexdigest()[:16]
+
+
+def materialize_folds(X, y, args):
+    """ Split the data once in the cross validation folds, and save the arrays of each fold in
+        output/<model>/<dataset>/folds/<key>, where key identifies the data and the split parameters.
+        The arrays are memory-mapped (copy-on-write) when loaded, so that all the trials of a study
+        (and the processes running the same study) share them instead of indexing X and y again.
+        Only the args.max_cached_folds most recently used keys are kept (see evict_folds).
+        Object arrays can't be memory-mapped, the folds are then only kept in memory.
+        return: list of (X_train, X_test, y_train, y_test)
+    """
+    if X.dtype == object or y.dtype == object:
+        return get_folds(X, y, args)
+
+    key = get_folds_key(X, y, args)
+    directory = os.path.join("folds", key)
+    paths = [[get_output_path(args, directory=directory, filename=name, extension=i, file_type="npy")
+              for name in FOLD_ARRAYS] for i in range(args.num_splits)]
+    key_dir = os.path.dirname(paths[0][0])
+
+    if not all(os.path.exists(path) for fold_paths in paths for path in fold_paths):
+        print("Saving the cross validation folds in", key_dir)
+        for fold_paths, fold in zip(paths, get_folds(X, y, args)):
+            for path, array in zip(fold_paths, fold):
+                # Write then rename, so that concurrent processes never load a partial file
+                tmp_path = path + ".tmp_" + uuid.uuid4().hex
+                with open(tmp_path, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp_path, path)
+
+    try:
+        folds = [tuple(np.load(path, mmap_mode="c") for path in fold_paths) for fold_paths in paths]
+    except OSError:  # evicted by another process in the meantime
+        return get_folds(X, y, args)
+    os.utime(key_dir)  # used for LRU eviction
+    evict_folds(os.path.dirname(key_dir), key, getattr(args, "max_cached_folds", 2))
+    return folds
+
+
+def evict_folds(folds_dir, keep, max_cached_folds):
+    """ Remove the least recently used folds of folds_dir (output/<model>/<dataset>/folds), so that at most
+        max_cached_folds keys are kept. The folds already loaded by a study stay readable, as they are memory-mapped.
+        keep: key of the folds which should never be removed (those of the current study)
+    """
+    entries = []
+    for name in os.listdir(folds_dir):
+        path = os.path.join(folds_dir, name)
+        try:
+            entries.append((os.path.getmtime(path), name))
+        except OSError:  # removed by another process
+            continue
+    entries = sorted(entries, reverse=True)
+    n_kept = 1
+    for _, name in entries:
+        if name == keep:
+            continue
+        if n_kept < max_cached_folds:
+            n_kept += 1
+            continue
+        print("Removing the cross validation folds", name)
+        shutil.rmtree(os.path.join(folds_dir, name), ignore_errors=True)
@@ -29,6 +29,10 @@ def get_parser():
     parser.add('--num_splits', type=int, default=5, help="Number of splits done for cross validation")
     parser.add('--shuffle', action="store_true", help="Shuffle data during cross-validation")
     parser.add('--seed', type=int, default=123, help="Seed for KFold initialization.")
+    parser.add('--save_fold_artifacts', action="store_true",
+               help="Save the model and predictions of each fold for all the trials (not only the final one)")
+    parser.add('--max_cached_folds', type=int, default=2,
+               help="Number of saved cross validation splits (of different data or split parameters) kept on disk")
 
     parser.add('--scale', action="store_true", help="Normalize input data.")
     parser.add('--target_encode', action="store_true", help="Encode the targets that they start at 0. (0, 1, 2,...)")
@@ -36,6 +40,8 @@ def get_parser():
 
     parser.add('--batch_size', type=int, default=128, help="Batch size used for training")
     parser.add('--val_batch_size', type=int, default=128, help="Batch size used for training and testing")
+    parser.add('--eval_batch_size', type=int, default=None,
+               help="Batch size of the validation loss (default: val_batch_size)")
     parser.add('--early_stopping_rounds', type=int, default=20, help="Number of rounds before early stopping applies.")
     parser.add('--epochs', type=int, default=1000, help="Max number of epochs to train.")
     parser.add('--logging_period', type=int, default=100, help="Number of iteration after which validation is printed.")
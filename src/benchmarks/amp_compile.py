@@ -0,0 +1,98 @@
+import argparse
+import ast
+import os
+import sys
+import numpy as np
+import torch
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(SRC_DIR)
+sys.path.append(os.path.join(SRC_DIR, ".."))
+from run_experiment import CONFIG_DEFAULT, prepare_config
+from generate_dataset_pipeline import generate_dataset
+from train import train_model, evaluate_model_metrics, get_skorch_net
+from launch_config.model_configs import config_dic
+
+# Epoch time and score drift of the skorch models with model__amp (bfloat16 autocast) and model__compile
+# (torch.compile), on the datasets of a benchmark of launch_config/launch_benchmarks.py.
+# Run from the src folder, after downloading the datasets:
+# python benchmarks/amp_compile.py --model ft_transformer --task classif --dataset_size medium --max_epochs 20
+
+OPTIONS = [(False, False), (True, False), (False, True), (True, True)]
+
+
+def load_benchmarks():
+    # launch_benchmarks.py can't be imported from here (its utils module conflicts with src/utils)
+    with open(os.path.join(SRC_DIR, "..", "launch_config", "launch_benchmarks.py"), "r") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "benchmarks" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError("No benchmarks found in launch_benchmarks.py")
+
+
+def get_config(model_name, benchmark, dataset, max_epochs, max_train_samples):
+    regression = benchmark["task"] == "regression"
+    model_config = config_dic[model_name]["regression" if regression else "classif"]["default"]
+    # Translate from wandb config to config, i.e {"value": a} --> a (first value for {"values": [...]})
+    config = {}
+    for key in model_config.keys():
+        value = list(model_config[key].values())[0]
+        config[key] = value[0] if type(value) == list else value
+    config.update(CONFIG_DEFAULT)
+    config.update({"data__method_name": "real_data",
+                   "data__keyword": dataset,
+                   "data__categorical": benchmark["categorical"],
+                   "data__regression": regression,
+                   "regression": regression,
+                   "max_train_samples": max_train_samples,
+                   "model__max_epochs": max_epochs,
+                   "model__device": "cpu",
+                   "log_training": False})
+    return prepare_config(config)
+
+
+def run(config, data, amp, compile):
+    x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator = data
+    config = dict(config, model__amp=amp, model__compile=compile)
+    torch.manual_seed(0)
+    model, _ = train_model(0, x_train, y_train, categorical_indicator, config)
+    durations = [epoch["dur"] for epoch in get_skorch_net(model, config).history]
+    metrics = evaluate_model_metrics(model, x_train, y_train, x_val, y_val, x_test, y_test, config)
+    score = metrics["test"]["rmse" if config["regression"] else "accuracy"]
+    # the first epoch includes the compilation
+    return durations[0], np.mean(durations[1:]) if len(durations) > 1 else np.nan, score
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="ft_transformer", choices=["ft_transformer", "resnet", "mlp"])
+    parser.add_argument("--task", default="classif", choices=["classif", "regression"])
+    parser.add_argument("--dataset_size", default="medium", choices=["medium", "large"])
+    parser.add_argument("--categorical", action="store_true")
+    parser.add_argument("--datasets", nargs="+", default=None, help="default: all the datasets of the benchmark")
+    parser.add_argument("--max_epochs", type=int, default=20)
+    parser.add_argument("--max_train_samples", type=int, default=10000)
+    args = parser.parse_args()
+
+    benchmark = [b for b in load_benchmarks() if b["task"] == args.task and b["dataset_size"] == args.dataset_size
+                 and b["categorical"] == args.categorical][0]
+    datasets = args.datasets if args.datasets is not None else benchmark["datasets"]
+    rows = []
+    for dataset in datasets:
+        config = get_config(args.model, benchmark, dataset, args.max_epochs, args.max_train_samples)
+        data = list(generate_dataset(config, np.random.RandomState(0)))
+        # same dtypes as in run_experiment.run_iteration
+        for i in range(3):
+            data[i] = data[i].astype(np.float32, copy=False)
+        for i in range(3, 6):
+            data[i] = data[i].reshape(-1, 1).astype(np.float32) if config["regression"] else data[i].reshape(-1)
+        results = {options: run(config, data, *options) for options in OPTIONS}
+        _, baseline_epoch, baseline_score = results[(False, False)]
+        for (amp, compile), (first_epoch, epoch, score) in results.items():
+            rows.append((dataset, str(amp), str(compile), first_epoch, epoch, baseline_epoch / epoch, score,
+                         score - baseline_score))
+
+    print("{:>30} {:>5} {:>7} {:>12} {:>10} {:>8} {:>10} {:>10}".format(
+        "dataset", "amp", "compile", "1st epoch s", "epoch s", "speedup", "score", "drift"))
+    for row in rows:
+        print("{:>30} {:>5} {:>7} {:>12.2f} {:>10.3f} {:>7.2f}x {:>10.4f} {:>+10.4f}".format(*row))
@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import time
+import torch
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tabular.bin.ft_transformer import MultiheadAttention
+
+# Microbenchmark of one FT-Transformer attention layer, with the original implementation and with the fast path
+# (fused projections + scaled_dot_product_attention). Run from the src folder:
+# python benchmarks/attention.py --n_tokens 8 32 128 --d_token 64 192 --batch_size 512
+
+
+def time_layer(attention, x, n_repeats, backward):
+    def step():
+        if backward:
+            attention(x, x, None, None).sum().backward()
+        else:
+            with torch.no_grad():
+                attention(x, x, None, None)
+
+    for _ in range(3):  # warmup
+        step()
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        step()
+    return (time.perf_counter() - start) / n_repeats
+
+
+def benchmark(n_tokens, d_token, n_heads, batch_size, dropout, n_repeats):
+    attention = MultiheadAttention(d_token, n_heads, dropout, "kaiming")
+    x = torch.randn(batch_size, n_tokens, d_token, requires_grad=True)
+    results = {}
+    for fast in [False, True]:
+        attention.fast = fast
+        attention.eval()
+        results[(fast, "forward")] = time_layer(attention, x, n_repeats, backward=False)
+        attention.train()
+        results[(fast, "forward+backward")] = time_layer(attention, x, n_repeats, backward=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_tokens", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--d_token", type=int, nargs="+", default=[64, 192])
+    parser.add_argument("--n_heads", type=int, default=8)
+    parser.add_argument("--batch_size", type=int, default=512)
+    parser.add_argument("--dropout", type=float, default=0.2)
+    parser.add_argument("--n_repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    print("{:>8} {:>8} {:>18} {:>12} {:>12} {:>8}".format("n_tokens", "d_token", "pass", "original ms", "fast ms",
+                                                          "speedup"))
+    for n_tokens in args.n_tokens:
+        for d_token in args.d_token:
+            results = benchmark(n_tokens, d_token, args.n_heads, args.batch_size, args.dropout, args.n_repeats)
+            for mode in ["forward", "forward+backward"]:
+                original, fast = results[(False, mode)], results[(True, mode)]
+                print("{:>8} {:>8} {:>18} {:>12.2f} {:>12.2f} {:>7.2f}x".format(n_tokens, d_token, mode,
+                                                                              original * 1000, fast * 1000,
+                                                                              original / fast))
@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import torch
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from create_models import AttrDict
+from TabSurvey.models.saint import SAINT
+
+# Time spent keeping the best epoch of SAINT (BaseModelTorch.save_best_state), in memory (default) or in a file of
+# output/saint/<dataset>/tmp (model__args__checkpoint_to_file), with the default hyperparameters of
+# launch_config/model_configs.py.
+# Run from the src folder: python benchmarks/tabsurvey_checkpoint.py --num_features 10 50
+
+
+def get_model(num_features, checkpoint_to_file):
+    args = AttrDict(model_name="saint", dataset="checkpoint_benchmark", model_id="benchmark",
+                    num_features=num_features, cat_idx=[0, 1], cat_dims=[5, 5], num_classes=1, objective="binary",
+                    use_gpu=False, data_parallel=False, batch_size=128, val_batch_size=128,
+                    checkpoint_to_file=checkpoint_to_file)
+    return SAINT(params=AttrDict(dim=128, depth=3, heads=4, dropout=0.1), args=args)
+
+
+def time_checkpoint(model, n_improvements):
+    """:return: time of a save_best_state (improving epoch), time of the final load_best_state"""
+    model.save_best_state()  # first allocation
+    start = time.perf_counter()
+    for _ in range(n_improvements):
+        model.save_best_state()
+    save_time = (time.perf_counter() - start) / n_improvements
+    start = time.perf_counter()
+    model.load_best_state()
+    return save_time, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_features", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--n_improvements", type=int, default=20)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    rows = []
+    for num_features in args.num_features:
+        times = [time_checkpoint(get_model(num_features, to_file), args.n_improvements) for to_file in [True, False]]
+        rows.append((num_features, get_model(num_features, False).get_model_size(), *(1000 * np.array(times).reshape(-1))))
+
+    print("{:>12} {:>10} {:>14} {:>14} {:>16} {:>16}".format(
+        "n_features", "params", "file save ms", "file load ms", "memory save ms", "memory load ms"))
+    for row in rows:
+        print("{:>12} {:>10} {:>14.2f} {:>14.2f} {:>16.2f} {:>16.2f}".format(*row))
@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import TensorDataset, DataLoader
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from create_models import AttrDict
+from TabSurvey.models.basemodel_torch import BaseModelTorch
+
+# Validation time per epoch of the TabSurvey training loops (BaseModelTorch.evaluate_loss), compared to the previous
+# loop which summed the loss of shuffled val_batch_size batches with gradients enabled (one sync per batch),
+# for an MLP trained by BaseModelTorch.fit. The validation batches have val_batch_size rows, or eval_batch_size if given.
+# Run from the src folder: python benchmarks/tabsurvey_validation.py --n_val 10000 100000 --eval_batch_size 4096
+
+
+class MLPModel(BaseModelTorch):
+    def __init__(self, params, args):
+        super().__init__(params, args)
+        self.model = nn.Sequential(nn.Linear(args.num_features, params["width"]), nn.ReLU(),
+                                   nn.Linear(params["width"], params["width"]), nn.ReLU(),
+                                   nn.Linear(params["width"], args.num_classes))
+        self.to_device()
+
+
+def original_validation_loss(model, X_val, y_val, loss_func):
+    val_loader = DataLoader(dataset=TensorDataset(X_val, y_val), batch_size=model.args.val_batch_size, shuffle=True)
+    val_loss = 0.0
+    val_dim = 0
+    for val_i, (batch_val_X, batch_val_y) in enumerate(val_loader):
+        out = model.model(batch_val_X.to(model.device))
+        val_loss += loss_func(out, batch_val_y.to(model.device))
+        val_dim += 1
+    val_loss /= val_dim
+    return val_loss.item()
+
+
+def validation_loss(model, X_val, y_val, loss_func):
+    batch_size = model.get_eval_batch_size()
+    forward = lambda batch: (model.model(batch[0].to(model.device)), batch[1].to(model.device))
+    return model.evaluate_loss(loss_func, forward, zip(X_val.split(batch_size), y_val.split(batch_size))).item()
+
+
+def time_function(function, n_repeats, *args):
+    function(*args)  # warmup
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        function(*args)
+    return (time.perf_counter() - start) / n_repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_val", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--num_features", type=int, default=20)
+    parser.add_argument("--width", type=int, default=256)
+    parser.add_argument("--n_repeats", type=int, default=5)
+    parser.add_argument("--val_batch_size", type=int, default=128)
+    parser.add_argument("--eval_batch_size", type=int, default=None)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model_args = AttrDict(num_features=args.num_features, num_classes=2, use_gpu=torch.cuda.is_available(),
+                          data_parallel=False, gpu_ids=[0], val_batch_size=args.val_batch_size,
+                          eval_batch_size=args.eval_batch_size, objective="classification")
+    model = MLPModel(params=AttrDict(width=args.width), args=model_args)
+    loss_func = nn.CrossEntropyLoss()
+    rows = []
+    for n_val in args.n_val:
+        X_val = torch.randn(n_val, args.num_features)
+        y_val = torch.randint(0, 2, (n_val,))
+        original_time = time_function(original_validation_loss, args.n_repeats, model, X_val, y_val, loss_func)
+        new_time = time_function(validation_loss, args.n_repeats, model, X_val, y_val, loss_func)
+        rows.append((n_val, original_time * 1000, new_time * 1000, original_time / new_time,
+                     original_validation_loss(model, X_val, y_val, loss_func), validation_loss(model, X_val, y_val,
+                                                                                               loss_func)))
+
+    print("{:>10} {:>14} {:>10} {:>8} {:>14} {:>10}".format("n_val", "original ms", "new ms", "speedup",
+                                                           "original loss", "new loss"))
+    for row in rows:
+        print("{:>10} {:>14.1f} {:>10.1f} {:>7.2f}x {:>14.5f} {:>10.5f}".format(*row))
@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import time
+import types
+import torch
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tabular.bin.ft_transformer import Tokenizer
+
+# Small-batch inference latency of the FT-Transformer tokenizer, compared to the previous implementation
+# (which concatenated a ones column, the category embeddings and a zero-padded bias at each call).
+# Run from the src folder: python benchmarks/tokenizer.py --batch_size 1 16 256
+
+
+def original_forward(self, x_num, x_cat, add_category_offsets=True, reuse_output=False):
+    x_some = x_num if x_cat is None else x_cat
+    x_num = torch.cat([torch.ones(len(x_some), 1, device=x_some.device)] + ([] if x_num is None else [x_num]), dim=1)
+    x = self.weight[None] * x_num[:, :, None]
+    if x_cat is not None:
+        x = torch.cat([x, self.category_embeddings(x_cat + self.category_offsets[None]
+                                                   if add_category_offsets else x_cat)], dim=1)
+    if self.bias is not None:
+        bias = torch.cat([torch.zeros(1, self.bias.shape[1], device=x.device), self.bias])
+        x = x + bias[None]
+    return x
+
+
+def time_tokenizer(tokenizer, x_num, x_cat, n_repeats):
+    with torch.inference_mode():
+        for _ in range(10):  # warmup
+            tokenizer(x_num, x_cat, reuse_output=True)
+        start = time.perf_counter()
+        for _ in range(n_repeats):
+            tokenizer(x_num, x_cat, reuse_output=True)
+    return (time.perf_counter() - start) / n_repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, nargs="+", default=[1, 16, 256])
+    parser.add_argument("--d_numerical", type=int, default=20)
+    parser.add_argument("--n_categories", type=int, default=5)
+    parser.add_argument("--d_token", type=int, default=192)
+    parser.add_argument("--n_repeats", type=int, default=2000)
+    args = parser.parse_args()
+
+    categories = [10] * args.n_categories if args.n_categories else None
+    tokenizer = Tokenizer(args.d_numerical, categories, args.d_token, True)
+    original = Tokenizer(args.d_numerical, categories, args.d_token, True)
+    original.load_state_dict(tokenizer.state_dict())
+    original.forward = types.MethodType(original_forward, original)
+
+    print("{:>10} {:>12} {:>12} {:>8}".format("batch_size", "original us", "new us", "speedup"))
+    for batch_size in args.batch_size:
+        x_num = torch.randn(batch_size, args.d_numerical)
+        x_cat = torch.randint(0, 10, (batch_size, args.n_categories)) if args.n_categories else None
+        with torch.inference_mode():
+            assert torch.equal(original(x_num, x_cat), tokenizer(x_num, x_cat))
+        time_original = time_tokenizer(original, x_num, x_cat, args.n_repeats)
+        time_new = time_tokenizer(tokenizer, x_num, x_cat, args.n_repeats)
+        print("{:>10} {:>12.1f} {:>12.1f} {:>7.2f}x".format(batch_size, time_original * 1e6, time_new * 1e6,
+                                                           time_original / time_new))
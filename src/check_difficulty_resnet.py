@@ -192,7 +192,7 @@ for index, row in df.iterrows():
                     categorical_indicator = None
                     model, model_id = train_model(iter, X_train, y_train, categorical_indicator, resnet_config)
                     train_score, val_score, score_resnet = evaluate_model(model, X_train, y_train, None, None, X_test,
-                                                                        y_test, resnet_config, model_id)
+                                                                        y_test, resnet_config)
                     score_resnet = -score_resnet #we want high = good so we take -RMSE
                     #if regression:
                     #    score_resnet = -mean_squared_error(y_test, resnet.predict(X_test), squared=False)  # rsme
@@ -2,12 +2,13 @@ import numpy as np
 from scipy.stats import special_ortho_group
 from sklearn.preprocessing import QuantileTransformer, PowerTransformer, StandardScaler, RobustScaler, OneHotEncoder
 from sklearn.cluster import KMeans
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, HistGradientBoostingClassifier
 from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
 from sklearn.model_selection import train_test_split
 import utils.keyword_to_function_conversion
 from scipy.stats import multivariate_normal
 from sklearn.covariance import EmpiricalCovariance, MinCovDet
+from joblib import Parallel, delayed, effective_n_jobs
 
 
 def marginal_transformations(x, y, function, vectorized=False, rng=None):
@@ -53,12 +54,15 @@ def add_noise(x, y, noise_type="white", scale=1, rng=None):
     return x, y
 
 
-def add_uninformative_features(x_train, x_val, x_test, y_train, y_val, y_test, multiplier=2, rng=None):
+def add_uninformative_features(x_train, x_val, x_test, y_train, y_val, y_test, multiplier=2, rng=None, legacy_rng=True):
     """
     Add num_uninformatives uninformative gaussian columns to x, imitating the mean and interquartile range of
     a randomly chosen subset of x columns
     :param x: data to which the features are added
     :param num_uninformatives: number of uninformative columns to add
+    :param legacy_rng: if True, sample with rng.multivariate_normal as in previous versions, which gives exactly the
+    same features for a given rng (but does an SVD of the covariance). If False, the features are sampled directly
+    with rng.normal and returned as float32.
     :return: x with uninformative features added
     """
     # TODO add correlations
@@ -69,30 +73,27 @@ def add_uninformative_features(x_train, x_val, x_test, y_train, y_val, y_test, m
     num_samples_train, num_features = x_train.shape
     cols_to_imitate = rng.choice(range(num_features),
                                  num_uninformatives)  # columns whose mean and interquartile we'll imitate in the uninformative columns
-    new_features_train = rng.multivariate_normal(mean=np.mean(x_train, axis=0)[cols_to_imitate],
-                                                 cov=np.diag(((np.quantile(x_train, 0.75, axis=0) - np.quantile(x_train,
-                                                                                                                0.25,
-                                                                                                                axis=0))[
-                                                                  cols_to_imitate] / 1.349) ** 2),
-                                                 size=num_samples_train)  # for a gaussian, interquartile range is 1.349σ
-    num_samples_val = x_val.shape[0]
-    new_features_val = rng.multivariate_normal(mean=np.mean(x_train, axis=0)[cols_to_imitate],
-                                               cov=np.diag(((np.quantile(x_train, 0.75, axis=0) - np.quantile(x_train,
-                                                                                                              0.25,
-                                                                                                              axis=0))[
-                                                                cols_to_imitate] / 1.349) ** 2),
-                                               size=num_samples_val)
-    num_samples_test = x_test.shape[0]
-    new_features_test = rng.multivariate_normal(mean=np.mean(x_train, axis=0)[cols_to_imitate],
-                                                cov=np.diag(((np.quantile(x_train, 0.75, axis=0) - np.quantile(x_train,
-                                                                                                               0.25,
-                                                                                                               axis=0))[
-                                                                 cols_to_imitate] / 1.349) ** 2),
-                                                size=num_samples_test)
-
-    return np.concatenate((x_train, new_features_train), axis=1), np.concatenate((x_val, new_features_val),
-                                                                                 axis=1), np.concatenate(
-        (x_test, new_features_test), axis=1), y_train, y_val, y_test
+    # statistics of the imitated columns, computed once for the train, val and test features
+    unique_cols, inverse = np.unique(cols_to_imitate, return_inverse=True)
+    x_cols = x_train[:, unique_cols]
+    mean = np.mean(x_train, axis=0)[cols_to_imitate]  # not on x_cols, whose summation order differs slightly
+    std = ((np.quantile(x_cols, 0.75, axis=0) - np.quantile(x_cols, 0.25, axis=0))[inverse] / 1.349)  # for a gaussian, interquartile range is 1.349σ
+    if legacy_rng:
+        dtype = np.result_type(x_train, np.float64)
+    else:
+        dtype = np.float32
+    res = []
+    for x in [x_train, x_val, x_test]:
+        # write the original and new features in a preallocated array instead of concatenating
+        x_new = np.empty((x.shape[0], num_features + num_uninformatives), dtype=dtype)
+        x_new[:, :num_features] = x
+        if legacy_rng:
+            x_new[:, num_features:] = rng.multivariate_normal(mean=mean, cov=np.diag(std ** 2), size=x.shape[0])
+        else:
+            x_new[:, num_features:] = rng.normal(loc=mean, scale=std, size=(x.shape[0], num_uninformatives))
+        res.append(x_new)
+
+    return res[0], res[1], res[2], y_train, y_val, y_test
 
 
 def gaussienize(x_train, x_val, x_test, y_train, y_val, y_test, type="standard", rng=None):
@@ -105,16 +106,17 @@ def gaussienize(x_train, x_val, x_test, y_train, y_val, y_test, type="standard",
     print("Gaussienizing")
     if type == "identity":
         return x_train, x_val, x_test, y_train, y_val, y_test
+    # the splits are copies made by data_to_train_test, so they can be transformed in place
     if type == "standard":
-        t = StandardScaler()
+        t = StandardScaler(copy=False)
     elif type == "robust":
-        t = RobustScaler()
+        t = RobustScaler(copy=False)
     elif type == "quantile":
-        t = QuantileTransformer(output_distribution="normal", random_state=rng)
+        t = QuantileTransformer(output_distribution="normal", random_state=rng, copy=False)
     elif type == "quantile_uniform":
-        t = QuantileTransformer(output_distribution="uniform", random_state=rng)
+        t = QuantileTransformer(output_distribution="uniform", random_state=rng, copy=False)
     elif type == "power":
-        t = PowerTransformer(random_state=rng)
+        t = PowerTransformer(copy=False)
 
     x_train = t.fit_transform(x_train)
     x_val = t.transform(x_val)
@@ -136,11 +138,40 @@ def cluster_1d(x, y, type="kmeans", rng=None, **kwargs):
     return x, y
 
 
-def remove_useless_features(x_train, x_val, x_test, y_train, y_val, y_test, max_rel_decrease=0.01, n_iter=3, rng=None):
-    # TODO test
+def _score_without_features(x, y, features_to_remove, splits, model, random_state):
+    """Mean test accuracy over the splits of a GBT trained without features_to_remove"""
+    if model == "hist_gbt":
+        gbt = HistGradientBoostingClassifier(random_state=random_state)
+    else:
+        gbt = GradientBoostingClassifier(random_state=random_state)
+    kept_features = np.setdiff1d(np.arange(x.shape[1]), features_to_remove)
+    scores = []
+    for train_indices, test_indices in splits:
+        gbt.fit(x[np.ix_(train_indices, kept_features)], y[train_indices])
+        scores.append(gbt.score(x[np.ix_(test_indices, kept_features)], y[test_indices]))
+    return np.mean(scores)
+
+
+def remove_useless_features(x_train, x_val, x_test, y_train, y_val, y_test, max_rel_decrease=0.01, n_iter=3, rng=None,
+                            search="linear", model="gbt", n_jobs=1):
+    """
+    Remove the features in order of increasing RF importance, as long as the GBT accuracy
+    doesn't decrease by more than max_rel_decrease
+    :param search: {"linear", "binary", "galloping"}
+    "linear" tries to remove the features one at a time (the original behaviour).
+    "binary" and "galloping" search for the number of features to remove, assuming the accuracy decrease
+    grows with the number of removed features. The same n_iter train / test splits are used for all the fits.
+    "galloping" tries 1, 2, 4... removed features before the binary search, which is faster when few features
+    are removed.
+    :param model: {"gbt", "hist_gbt"} model used to compute the accuracy decrease ("binary" and "galloping" only)
+    :param n_jobs: number of cutoffs evaluated in parallel at each step of the search ("binary" and "galloping" only)
+    """
     if max_rel_decrease == 0:
         return x_train, x_val, x_test, y_train, y_val, y_test
     print("Removing useless_features...")
+    if search != "linear":
+        return _remove_useless_features_search(x_train, x_val, x_test, y_train, y_val, y_test, max_rel_decrease,
+                                               n_iter, rng, search, model, n_jobs)
     rf = RandomForestClassifier(random_state=rng)  # used to compute features importance
     gbt = GradientBoostingClassifier(random_state=rng)  # used to compute accuracy decrease
     rf.fit(x_train, y_train)
@@ -174,6 +205,63 @@ def remove_useless_features(x_train, x_val, x_test, y_train, y_val, y_test, max_
         x_test, features_to_remove, axis=1), y_train, y_val, y_test
 
 
+def _remove_useless_features_search(x_train, x_val, x_test, y_train, y_val, y_test, max_rel_decrease, n_iter, rng,
+                                    search, model, n_jobs):
+    if search not in ["binary", "galloping"]:
+        raise ValueError("Unknown search {}".format(search))
+    rf = RandomForestClassifier(random_state=rng)  # used to compute features importance
+    rf.fit(x_train, y_train)
+    sorted_features = np.argsort(rf.feature_importances_)  # in order of increasing importance
+    n_features = x_train.shape[1]
+    # the same splits and model seed are used for all the cutoffs, so that the scores are comparable
+    splits = [train_test_split(np.arange(x_train.shape[0]), test_size=0.5, random_state=rng) for _ in range(n_iter)]
+    random_state = rng.randint(np.iinfo(np.int32).max) if rng is not None else None
+    n_candidates_per_step = effective_n_jobs(n_jobs)
+    scores = {}
+
+    def evaluate(n_removed_list):
+        # scores of the cutoffs (number of removed features) which haven't been evaluated yet, in parallel
+        n_removed_list = [n for n in n_removed_list if n not in scores]
+        new_scores = Parallel(n_jobs=n_jobs)(delayed(_score_without_features)(
+            x_train, y_train, sorted_features[:n], splits, model, random_state) for n in n_removed_list)
+        scores.update(zip(n_removed_list, new_scores))
+
+    def is_too_bad(n_removed):
+        return (scores[0] - scores[n_removed]) / scores[0] > max_rel_decrease
+
+    def update_bounds(candidates, low, high):
+        # the first candidate which is too bad becomes the new upper bound, the last one before it the lower bound
+        for n_removed in sorted(candidates):
+            if is_too_bad(n_removed):
+                return low, n_removed
+            low = n_removed
+        return low, high
+
+    evaluate([0])
+    # we remove at most n_features - 1 features. low is a number of removed features which is fine,
+    # high the smallest one known to decrease the accuracy too much (n_features if none is known)
+    low, high = 0, n_features
+    if search == "galloping":
+        step = 1
+        while high == n_features and low < n_features - 1:
+            candidates = [min(low + step * 2 ** j, n_features - 1) for j in range(n_candidates_per_step)]
+            candidates = sorted(set(candidates))
+            evaluate(candidates)
+            low, high = update_bounds(candidates, low, high)
+            step *= 2 ** n_candidates_per_step
+    while high - low > 1:
+        # split [low, high] in n_jobs + 1 intervals (bisection for n_jobs=1)
+        n_candidates = min(n_candidates_per_step, high - low - 1)
+        candidates = sorted(set(low + (high - low) * (j + 1) // (n_candidates + 1) for j in range(n_candidates)))
+        evaluate(candidates)
+        low, high = update_bounds(candidates, low, high)
+    features_to_remove = sorted_features[:low]
+    print("Removing {} features ({} fits)".format(low, len(scores) * n_iter))
+
+    return np.delete(x_train, features_to_remove, axis=1), np.delete(x_val, features_to_remove, axis=1), np.delete(
+        x_test, features_to_remove, axis=1), y_train, y_val, y_test
+
+
 def select_features_rf(x_train, x_val, x_test, y_train, y_val, y_test, rng, num_features=None, importance_cutoff=None,
                        return_features=False):
     assert (num_features is None) + (importance_cutoff is None) == 1  # xor
@@ -305,11 +393,60 @@ def limit_size(x, y, n_samples, rng):
     return x[chosen_indices], y[chosen_indices]
 
 
+def _gaussian_kernel_smoothing(z, y, block_size=None):
+    """
+    Nadaraya-Watson smoothing of y with an isotropic gaussian kernel of variance 1,
+    computed exactly, by blocks of rows to bound the memory
+    :param z: whitened features, shape (n_samples, n_features)
+    :param block_size: number of rows per block (default: blocks of ~10M kernel entries)
+    """
+    n = z.shape[0]
+    if block_size is None:
+        block_size = max(1, int(1e7 // n))
+    sq_norms = np.sum(z ** 2, axis=1)
+    y_new = np.zeros(n)
+    for start in range(0, n, block_size):
+        z_block = z[start:start + block_size]
+        # weights = exp(-0.5 * ||z_i - z_j||^2), computed in place to avoid temporary (block_size, n) arrays.
+        # The normalization constant of the gaussian cancels out. The distance of each point to itself is 0,
+        # so the denominator is always >= 1 and can't underflow
+        weights = z_block @ z.T
+        weights *= -2
+        weights += sq_norms[start:start + block_size, None]
+        weights += sq_norms[None, :]
+        np.maximum(weights, 0, out=weights)
+        weights *= -0.5
+        np.exp(weights, out=weights)
+        y_new[start:start + block_size] = (weights @ y) / np.sum(weights, axis=1)
+    return y_new
+
+
+def _gaussian_kernel_smoothing_neighbors(z, y, kernel_tol=1e-8):
+    """
+    Approximate version of _gaussian_kernel_smoothing, only summing over the points for which
+    the kernel is bigger than kernel_tol (found with a KD-tree)
+    """
+    from sklearn.neighbors import KDTree
+    radius = np.sqrt(-2 * np.log(kernel_tol))
+    neighbors, distances = KDTree(z).query_radius(z, r=radius, return_distance=True)
+    y_new = np.zeros(z.shape[0])
+    for i in range(z.shape[0]):
+        weights = np.exp(-0.5 * distances[i] ** 2)
+        y_new[i] = np.dot(y[neighbors[i]], weights) / np.sum(weights)
+    return y_new
+
+
 def remove_high_frequency_from_train(x_train, x_val, x_test, y_train, y_val, y_test, rng=None, cov_mult=0.001,
-                                     covariance_estimation="classic", classif=True):
+                                     covariance_estimation="classic", classif=True, approximate=False,
+                                     block_size=None, kernel_tol=1e-8):
+    """
+    Smooth the train target with a gaussian kernel of covariance cov_mult * (covariance of x_train)
+    :param approximate: if True, only the neighbors for which the kernel is bigger than kernel_tol are used
+    (found with a KD-tree), which is much faster for a large number of samples when cov_mult is small
+    :param block_size: number of rows of the kernel matrix computed at once for the exact computation
+    """
     if cov_mult == 0:
         return x_train, x_val, x_test, y_train, y_val, y_test
-    y_train_new = np.zeros(y_train.shape)
     # empirical_cov = np.cov(x_train, rowvar=False)
     # empirical_cov = MinCovDet(support_fraction=1.0,
     #                          assume_centered=True).fit(x_train).covariance_
@@ -323,20 +460,24 @@ def remove_high_frequency_from_train(x_train, x_val, x_test, y_train, y_val, y_t
     empirical_cov = cov_method.fit(x_train).covariance_
     print(np.diag(empirical_cov))
     empirical_cov = cov_mult * empirical_cov
-    for i in range(x_train.shape[0]):
-        try:
-            gaussian_kernel = multivariate_normal(mean=x_train[i], cov=empirical_cov)
-        except:
-            assert covariance_estimation == "robust"
-            print("Issue with robust covaraince estimation, going for classic empirical estimation")
-            cov_method = EmpiricalCovariance()
-            empirical_cov = cov_method.fit(x_train).covariance_
-            gaussian_kernel = multivariate_normal(mean=x_train[i], cov=empirical_cov)
-
-        gaussian_densities = gaussian_kernel.pdf(x_train)
-        #print(sorted(gaussian_densities)[-10:][::-1] / np.sum(gaussian_densities))
-        y_train_new[i] = np.dot(y_train, gaussian_densities) / np.sum(gaussian_densities)
-        #y_train_new[i] = (- y_train[i] * gaussian_densities[i] + np.dot(y_train, gaussian_densities)) / (np.sum(gaussian_densities) - gaussian_densities[i])
+    try:
+        # the same check as building scipy's multivariate_normal (the covariance should be non-singular)
+        multivariate_normal(mean=x_train[0], cov=empirical_cov)
+    except:
+        assert covariance_estimation == "robust"
+        print("Issue with robust covaraince estimation, going for classic empirical estimation")
+        cov_method = EmpiricalCovariance()
+        empirical_cov = cov_method.fit(x_train).covariance_
+    # whiten once: the kernel between x_i and x_j only depends on the mahalanobis distance, ie the euclidean
+    # distance between the whitened points
+    eigenvalues, eigenvectors = np.linalg.eigh(empirical_cov)
+    z = (x_train - np.mean(x_train, axis=0)) @ (eigenvectors / np.sqrt(eigenvalues))
+    y = np.asarray(y_train, dtype=np.float64)
+    if approximate:
+        y_train_new = _gaussian_kernel_smoothing_neighbors(z, y, kernel_tol)
+    else:
+        y_train_new = _gaussian_kernel_smoothing(z, y, block_size)
+    y_train_new = y_train_new.reshape(y_train.shape)
     if classif:
         y_train_new = (y_train_new > 0.5).astype(int)
         print(np.unique(y_train_new, return_counts=True))
@@ -6,6 +6,9 @@ from sklearn.datasets import make_spd_matrix, make_sparse_spd_matrix
 from sklearn.preprocessing import LabelEncoder, QuantileTransformer
 import openml
 import pickle
+import os
+from utils.mmap_store import get_mmap_store_path, load_mmap_store
+from target_function_classif import periodic_triangle_kernel
 
 
 def import_open_ml_data(openml_task_id=None, path_to_dir="openML_data", max_num_samples=None, rng=None) -> pd.DataFrame:
@@ -65,6 +68,19 @@ def import_open_ml_data(openml_task_id=None, path_to_dir="openML_data", max_num_
 
 def import_real_data(keyword=None, balanced=True, path_to_dir="../data", max_num_samples=None, regression=False, categorical=False, dim=[],
                      rng=None):
+    # Use the memory-mapped version of the dataset if it has been created (see data/convert_data.py)
+    if not categorical:
+        pickle_path = "{}/numerical_only/{}/data_{}".format(path_to_dir, "regression" if regression else "balanced",
+                                                            keyword)
+    else:
+        pickle_path = "{}/num_and_cat/{}/data_{}".format(path_to_dir, "regression" if regression else "balanced",
+                                                         keyword)
+    if os.path.isdir(get_mmap_store_path(pickle_path)):
+        X, y, categorical_indicator = load_mmap_store(get_mmap_store_path(pickle_path))
+        if not categorical:
+            categorical_indicator = None
+        return X, y, categorical_indicator
+
     if not categorical:
         if regression:
             with open("{}/numerical_only/regression/data_{}".format(path_to_dir, keyword), "rb") as f:
@@ -86,7 +102,7 @@ def import_real_data(keyword=None, balanced=True, path_to_dir="../data", max_num
             y = np.array(y).astype(np.int64)
         categorical_indicator = np.array(categorical_indicator).astype(np.bool)
 
-    return np.array(X), np.array(y), categorical_indicator
+    return np.asarray(X), np.asarray(y), categorical_indicator
 
 
 def generate_synthetic_data(num_samples,
@@ -189,14 +205,7 @@ def generate_periodic_triangles_uniform(num_samples, period=None, offset=None, p
                                                                    high=-2 + offset + (i + 1) * period_size,
                                                                    size=num_samples_per_period)
 
-    res = np.zeros(x.shape[0])
-    for i in range(x.shape[0]):
-        if x[i] < -2 + offset or x[i] > 2 - offset:
-            res[i] = 0
-        else:
-            res[i] = 2 * np.abs(np.abs(x[i]) / period_size - int(np.abs(x[i]) / period_size + 1 / 2))
-            # res[i] = np.sin(x[i] * (2 * np.pi) / (4 - 2 * offset) * period)
-    # res = np.sin(x.reshape(-1) * np.pi / period).astype(np.float32)
+    res = periodic_triangle_kernel(x, offset, period_size)
     if noise:
         res += rng.normal(0, 0.1, x.shape[0])
     return x.reshape(-1, 1), res
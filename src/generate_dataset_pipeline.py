@@ -1,6 +1,9 @@
 import os
+import time
+import tracemalloc
 import numpy as np
 from utils.keyword_to_function_conversion import convert_keyword_to_function
+from utils.dataset_cache import get_cache_key, load_from_cache, save_to_cache
 from sklearn.model_selection import train_test_split
 
 #There are three steps to generate a dataset:
@@ -29,9 +32,50 @@ def generate_target(x, config, rng):
     data = method(x, **target_config, rng=rng)
     return data
 
+def get_rss():
+    """Current resident set size of the process in bytes (None if /proc isn't available)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def start_stage():
+    """
+    Start measuring a stage of the data pipeline (see log_stage)
+    :return: (start time, rss, traced memory)
+    """
+    traced = None
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        traced = tracemalloc.get_traced_memory()[0]
+    return time.time(), get_rss(), traced
+
+
+def log_stage(stage, stage_start):
+    """
+    Print the time taken by a stage of the data pipeline and the memory it kept (RSS delta).
+    When tracemalloc is running (python -X tracemalloc), also print the peak memory allocated during the stage,
+    which includes its temporary copies.
+    :param stage_start: returned by start_stage
+    """
+    start_time, start_rss, start_traced = stage_start
+    message = "{}: {:.2f}s".format(stage, time.time() - start_time)
+    rss = get_rss()
+    if rss is not None and start_rss is not None:
+        message += ", RSS {:+.0f} MB".format((rss - start_rss) / 2 ** 20)
+    if start_traced is not None and tracemalloc.is_tracing():
+        message += ", peak allocated {:.0f} MB".format((tracemalloc.get_traced_memory()[1] - start_traced) / 2 ** 20)
+    print(message)
+
+
 def transform_data(x_train, x_val, x_test, y_train, y_val, y_test, config, rng, categorical_indicator=None):
     i = 0
     print("transforming data...")
+    if categorical_indicator is not None:
+        numerical_columns = np.flatnonzero(~categorical_indicator)
+        categorical_columns = np.flatnonzero(categorical_indicator)
     while True:
         if f"transform__{i}__method_name" in config.keys():
             print("transform", i)
@@ -44,53 +88,95 @@ def transform_data(x_train, x_val, x_test, y_train, y_val, y_test, config, rng,
             for key in config.keys():
                 if key.startswith(f"transform__{i}__") and key != f"transform__{i}__method_name" and key != f"transform__{i}__apply_on":
                     target_config[key[len(f"transform__{i}__"):]] = config[key]
+            if apply_on == "numerical" and len(categorical_columns) == 0 or \
+                    apply_on == "categorical" and len(numerical_columns) == 0:
+                # the transform applies to all the columns, no need to gather and scatter them
+                apply_on = "all"
             if apply_on == "all":
                 x_train, x_val, x_test, y_train, y_val, y_test = method(x_train, x_val, x_test, y_train, y_val, y_test, **target_config, rng=rng)
             elif apply_on == "numerical":
-                if not np.all(categorical_indicator):
-                    x_train[:, ~categorical_indicator], x_val[:, ~categorical_indicator], x_test[:, ~categorical_indicator], y_train, y_val, y_test = method(x_train[:, ~categorical_indicator], x_val[:, ~categorical_indicator], x_test[:, ~categorical_indicator], y_train, y_val, y_test, **target_config, rng=rng)
+                if len(numerical_columns) > 0:
+                    x_train[:, numerical_columns], x_val[:, numerical_columns], x_test[:, numerical_columns], y_train, y_val, y_test = method(x_train[:, numerical_columns], x_val[:, numerical_columns], x_test[:, numerical_columns], y_train, y_val, y_test, **target_config, rng=rng)
             elif apply_on == "categorical":
-                if np.any(categorical_indicator):
-                    x_train[:, categorical_indicator], x_val[:, categorical_indicator], x_test[:, categorical_indicator], y_train, y_val, y_test = method(x_train[:, categorical_indicator], x_val[:, categorical_indicator], x_test[:, categorical_indicator], y_train, y_val, y_test, **target_config, rng=rng)
+                if len(categorical_columns) > 0:
+                    x_train[:, categorical_columns], x_val[:, categorical_columns], x_test[:, categorical_columns], y_train, y_val, y_test = method(x_train[:, categorical_columns], x_val[:, categorical_columns], x_test[:, categorical_columns], y_train, y_val, y_test, **target_config, rng=rng)
         else:
             break
         i += 1
 
     return x_train, x_val, x_test, y_train, y_val, y_test
 
+
+def take_rows(x, indices):
+    """
+    Gather the rows of x in a new array, converted to float32 if x is numerical
+    (x can be a read-only memory-mapped array, the result is always writable)
+    """
+    x = np.asarray(x)
+    dtype = np.float32 if np.issubdtype(x.dtype, np.number) and x.ndim == 2 else x.dtype
+    out = np.empty((len(indices),) + x.shape[1:], dtype=dtype)
+    # mode="clip" avoids buffering the output, the indices are always valid
+    np.take(x, indices, axis=0, out=out, mode="clip")
+    return out
+
+
 def data_to_train_test(x, y, config, rng=None):
+    """
+    Split x and y in train, validation and test sets.
+    The splits are computed on the row indices (drawing the same permutations as splitting the arrays
+    directly), so that each row is copied only once, to a float32 array, and the validation and test rows
+    above max_val_samples / max_test_samples are never copied.
+    """
     n_rows = x.shape[0]
     if "data__keyword" in config.keys() and config["data__keyword"] == "year":
         if config["max_train_samples"] < 463715:
             indices_train = rng.choice(list(range(463715)), config["max_train_samples"],
                                              replace=False)
-            x_train = x[indices_train]
-            y_train = y[indices_train]
         else:
-            x_train = x[:463715]
-            y_train = y[:463715]
+            indices_train = np.arange(463715)
 
-        x_val_test = x[463715:]
-        y_val_test = y[463715:]
-        x_val, x_test, y_val, y_test = train_test_split(x_val_test, y_val_test, train_size=config["val_test_prop"],
-                                                        random_state=rng)
+        indices_val_test = np.arange(463715, n_rows)
+        indices_val, indices_test = train_test_split(indices_val_test, train_size=config["val_test_prop"],
+                                                     random_state=rng)
     else:
         if not config["max_train_samples"] is None:
             train_set_prop = min(config["max_train_samples"] / n_rows, config["train_prop"])
         else:
             train_set_prop = config["train_prop"]
-        x_train, x_val_test, y_train, y_val_test = train_test_split(x, y, train_size= train_set_prop, random_state=rng)
-        x_val, x_test, y_val, y_test = train_test_split(x_val_test, y_val_test, train_size= config["val_test_prop"], random_state=rng)
-    if not config["max_val_samples"] is None and x_val.shape[0] > config["max_val_samples"]:
-        x_val = x_val[:config["max_val_samples"]]
-        y_val = y_val[:config["max_val_samples"]]
-    if not config["max_test_samples"] is None and x_test.shape[0] > config["max_test_samples"]:
-        x_test = x_test[:config["max_test_samples"]]
-        y_test = y_test[:config["max_test_samples"]]
+        indices_train, indices_val_test = train_test_split(np.arange(n_rows), train_size= train_set_prop, random_state=rng)
+        indices_val, indices_test = train_test_split(indices_val_test, train_size= config["val_test_prop"], random_state=rng)
+    if not config["max_val_samples"] is None and len(indices_val) > config["max_val_samples"]:
+        indices_val = indices_val[:config["max_val_samples"]]
+    if not config["max_test_samples"] is None and len(indices_test) > config["max_test_samples"]:
+        indices_test = indices_test[:config["max_test_samples"]]
+    x_train, x_val, x_test = take_rows(x, indices_train), take_rows(x, indices_val), take_rows(x, indices_test)
+    y = np.asarray(y)
+    y_train, y_val, y_test = y[indices_train], y[indices_val], y[indices_test]
     return x_train, x_val, x_test, y_train, y_val, y_test
 
 
 def generate_dataset(config, rng):
+    # If "dataset_cache_dir" is in the config, the generated splits are cached on disk,
+    # keyed on the data / target / transform / split config and the rng state
+    if "dataset_cache_dir" in config.keys() and config["dataset_cache_dir"] is not None:
+        cache_dir = config["dataset_cache_dir"]
+        if "dataset_cache_max_size_gb" in config.keys() and config["dataset_cache_max_size_gb"] is not None:
+            max_size = int(config["dataset_cache_max_size_gb"] * 1e9)
+        else:
+            max_size = None
+        key = get_cache_key(config, rng)
+        dataset = load_from_cache(cache_dir, key, rng)
+        if dataset is not None:
+            return dataset
+        dataset = _generate_dataset(config, rng)
+        if dataset is not None and not any(array.dtype == object for array in dataset[:6]):
+            save_to_cache(cache_dir, key, dataset, rng, max_size=max_size)
+        return dataset
+    return _generate_dataset(config, rng)
+
+
+def _generate_dataset(config, rng):
+    stage_start = start_stage()
     data = generate_data(config, rng)
     if data is None:
         return None
@@ -101,14 +187,19 @@ def generate_dataset(config, rng):
     #    x, y, categorical_indicator = data
     elif len(data) == 2: #if generate data returns x, y #TODO something cleaner
         x, y = data
-        x = x.astype(np.float32) #FIXME
+        x = x.astype(np.float32, copy=False) #FIXME
     else:
         x = data
-        x = x.astype(np.float32)
+        x = x.astype(np.float32, copy=False)
         y = generate_target(x, config, rng)
+    log_stage("Data loading", stage_start)
 
+    stage_start = start_stage()
     x_train, x_val, x_test, y_train, y_val, y_test = data_to_train_test(x, y, config, rng=rng)
+    log_stage("Train / val / test split", stage_start)
 
+    stage_start = start_stage()
     x_train, x_val, x_test, y_train, y_val, y_test = transform_data(x_train, x_val, x_test, y_train, y_val, y_test, config, rng,
                                                                     categorical_indicator=categorical_indicator)
+    log_stage("Transforms", stage_start)
     return x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator
@@ -0,0 +1,280 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+# Run a sweep locally, without wandb.
+# The sweeps are created by launch_config/launch_benchmarks.py --local (or launch_xps.py --local), which saves
+# the wandb-like sweep configs as json files. Configs are sampled here from the search spaces of
+# launch_config/model_configs.py, run in a local process pool, and the results are saved in a SQLite database.
+# Run from the src folder, like run_experiment.py:
+# python local_sweep.py ../launch_config/sweeps/local/resnet_classif_medium_numerical.json --n_runs 100 --n_workers 8
+
+
+def _q_round(x, q):
+    x = np.round(x / q) * q
+    if isinstance(q, int):
+        return int(x)
+    return float(x)
+
+
+def sample_parameter(spec, rng):
+    """
+    Sample a value from a wandb parameter specification
+    :param spec: dictionary with either "value", "values" (with optional "probabilities") or a "distribution"
+    :param rng: np.random.RandomState
+    """
+    if "value" in spec:
+        return spec["value"]
+    if "values" in spec:
+        values = spec["values"]
+        p = spec["probabilities"] if "probabilities" in spec else None
+        return values[rng.choice(len(values), p=p)]
+    distribution = spec["distribution"]
+    if distribution == "uniform":
+        return float(rng.uniform(spec["min"], spec["max"]))
+    elif distribution == "q_uniform":
+        q = spec["q"] if "q" in spec else 1
+        return _q_round(rng.uniform(spec["min"], spec["max"]), q)
+    elif distribution == "int_uniform":
+        return int(rng.randint(spec["min"], spec["max"] + 1))
+    elif distribution == "log_uniform_values":
+        return float(np.exp(rng.uniform(np.log(spec["min"]), np.log(spec["max"]))))
+    elif distribution == "q_log_uniform_values":
+        q = spec["q"] if "q" in spec else 1
+        return _q_round(np.exp(rng.uniform(np.log(spec["min"]), np.log(spec["max"]))), q)
+    elif distribution == "normal":
+        return float(rng.normal(spec["mu"], spec["sigma"]))
+    elif distribution == "q_normal":
+        q = spec["q"] if "q" in spec else 1
+        return _q_round(rng.normal(spec["mu"], spec["sigma"]), q)
+    elif distribution == "log_normal":
+        return float(np.exp(rng.normal(spec["mu"], spec["sigma"])))
+    else:
+        raise ValueError("Unknown distribution {}".format(distribution))
+
+
+def sample_config(parameters, rng):
+    return {key: sample_parameter(spec, rng) for key, spec in parameters.items()}
+
+
+def grid_configs(parameters):
+    """All the combinations of the "values" of the parameters (as in a wandb grid search)"""
+    keys = list(parameters.keys())
+    choices = []
+    for key in keys:
+        spec = parameters[key]
+        if "value" in spec:
+            choices.append([spec["value"]])
+        elif "values" in spec:
+            choices.append(spec["values"])
+        else:
+            raise ValueError("Grid search needs values for each parameter, got a distribution for {}".format(key))
+    for combination in itertools.product(*choices):
+        yield dict(zip(keys, combination))
+
+
+def get_configs(sweep_config, n_runs=None, seed=0, start=0):
+    """
+    Generate the configs (run index, config) of the sweep, starting at run index start.
+    Random search configs only depend on (seed, run index), so that an interrupted sweep can be resumed.
+    """
+    parameters = sweep_config["parameters"]
+    if sweep_config["method"] == "grid":
+        configs = enumerate(grid_configs(parameters))
+        configs = itertools.islice(configs, start, n_runs)
+    elif sweep_config["method"] == "random":
+        if n_runs is None:
+            raise ValueError("n_runs should be given for a random search")
+        configs = ((i, sample_config(parameters, np.random.RandomState([seed, i]))) for i in range(start, n_runs))
+    else:
+        raise ValueError("Only random and grid search can be run locally, not {}".format(sweep_config["method"]))
+    return configs
+
+
+def _run_config(config):
+    # Imported here so that the parent process doesn't need to import torch, skorch...
+    from run_experiment import CONFIG_DEFAULT, prepare_config, get_run_results
+    config = prepare_config(dict(CONFIG_DEFAULT, **config))
+    start_time = time.time()
+    try:
+        results = get_run_results(config)
+        state = "finished"
+    except:
+        print("ERROR")
+        print(traceback.format_exc())
+        results = {"error": traceback.format_exc()}
+        state = "crashed"
+    results["_runtime"] = time.time() - start_time
+    return state, results
+
+
+def _run_config_bank(configs):
+    # Configs trained together in a model bank (see model_bank.py)
+    from run_experiment import CONFIG_DEFAULT, prepare_config
+    from model_bank import get_model_bank_run_results
+    configs = [prepare_config(dict(CONFIG_DEFAULT, **config)) for config in configs]
+    start_time = time.time()
+    try:
+        results = get_model_bank_run_results(configs)
+        state = "finished"
+    except:
+        print("ERROR")
+        print(traceback.format_exc())
+        results = [{"error": traceback.format_exc()} for _ in configs]
+        state = "crashed"
+    for result in results:
+        result["_runtime"] = (time.time() - start_time) / len(configs)
+    return [(state, result) for result in results]
+
+
+def get_config_groups(configs, model_bank, max_padding=None):
+    """
+    Group the (run index, config) of a sweep which can be trained in the same model bank, by at most model_bank
+    :param max_padding: see model_bank.group_configs
+    """
+    from run_experiment import CONFIG_DEFAULT, prepare_config
+    from model_bank import group_configs
+    groups = group_configs([prepare_config(dict(CONFIG_DEFAULT, **config)) for _, config in configs], model_bank,
+                           max_padding)
+    sizes = sorted((len(group) for group in groups), reverse=True)
+    print("{} configs in {} model banks, of sizes {}".format(len(configs), len(groups), sizes))
+    return [[configs[i] for i in group] for group in groups]
+
+
+def _init_worker(n_threads):
+    from run_experiment import _init_iteration_worker
+    _init_iteration_worker(n_threads)
+
+
+def _to_json(x):
+    return json.dumps(x, default=lambda o: o.item() if isinstance(o, np.generic) else str(o))
+
+
+def open_db(db_path):
+    db = sqlite3.connect(db_path, timeout=60)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("""CREATE TABLE IF NOT EXISTS runs (
+                    sweep TEXT,
+                    run_index INTEGER,
+                    state TEXT,
+                    config TEXT,
+                    summary TEXT,
+                    PRIMARY KEY (sweep, run_index))""")
+    return db
+
+
+def get_done_runs(db, sweep_name, retry_crashed=False):
+    """Indices of the runs of the sweep already in the database (only the finished ones if retry_crashed)"""
+    query = "SELECT run_index FROM runs WHERE sweep = ?"
+    if retry_crashed:
+        query += " AND state = 'finished'"
+    return {row[0] for row in db.execute(query, (sweep_name,))}
+
+
+def run_local_sweep(sweep_config, n_runs=None, n_workers=1, n_threads=None, db_path="local_sweeps.db", seed=0,
+                    model_bank=None, model_bank_max_padding=None, retry_crashed=False):
+    """
+    Run a sweep in a local process pool, saving the results in a SQLite database.
+    Runs already in the database for this sweep are skipped.
+    :param sweep_config: sweep config as created by launch_config/utils.create_sweep
+    :param n_runs: number of runs for a random search (for a grid search, default to the whole grid)
+    :param n_workers: number of processes
+    :param n_threads: threads per process (default: the cpus are split between the processes)
+    :param model_bank: if not None, train up to model_bank compatible MLP / ResNet configs together in the same
+    process (see model_bank.py)
+    :param model_bank_max_padding: maximum padding ratio of the models of a bank (see model_bank.group_configs)
+    :param retry_crashed: if True, the crashed runs in the database are run again (and replaced if they finish)
+    """
+    if n_threads is None:
+        n_threads = max(1, os.cpu_count() // n_workers)
+    sweep_name = sweep_config["name"]
+    db = open_db(db_path)
+    done = get_done_runs(db, sweep_name, retry_crashed)
+    configs = [(i, config) for i, config in get_configs(sweep_config, n_runs, seed) if i not in done]
+    print("Running {} configs of sweep {} ({} already done)".format(len(configs), sweep_name, len(done)))
+    # spawn rather than fork, as forking a process which has already initialized torch / OpenMP can hang
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(n_threads,)) as executor:
+        if model_bank is None:
+            futures = {executor.submit(_run_config, config): [(i, config)] for i, config in configs}
+        else:
+            futures = {}
+            for group in get_config_groups(configs, model_bank, model_bank_max_padding):
+                if len(group) == 1:
+                    futures[executor.submit(_run_config, group[0][1])] = group
+                else:
+                    futures[executor.submit(_run_config_bank, [config for _, config in group])] = group
+        n_done = 0
+        for future in as_completed(futures):
+            group = futures[future]
+            group_results = future.result() if len(group) > 1 else [future.result()]
+            for (i, config), (state, results) in zip(group, group_results):
+                db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)",
+                           (sweep_name, i, state, _to_json(config), _to_json(results)))
+            db.commit()
+            n_done += len(group)
+            print("{}/{} runs done".format(n_done, len(configs)))
+    db.close()
+
+
+def load_results(db_path="local_sweeps.db", sweeps=None):
+    """
+    Load the results of local sweeps as a pandas DataFrame, with one row per run and
+    the config and summary as columns (like launch_config/download_data.py for wandb runs).
+    """
+    import pandas as pd
+    db = open_db(db_path)
+    rows = db.execute("SELECT sweep, run_index, state, config, summary FROM runs").fetchall()
+    db.close()
+    records = []
+    for sweep, run_index, state, config, summary in rows:
+        if sweeps is not None and sweep not in sweeps:
+            continue
+        records.append({**json.loads(config), **json.loads(summary),
+                        "sweep_name": sweep, "run_index": run_index, "State": state})
+    return pd.DataFrame(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run sweeps locally")
+    parser.add_argument("sweeps", nargs="+", help="json sweep config files, or csv files listing them")
+    parser.add_argument("--n_runs", type=int, default=None, help="number of runs per sweep for random search")
+    parser.add_argument("--n_workers", type=int, default=1)
+    parser.add_argument("--n_threads", type=int, default=None)
+    parser.add_argument("--db", default="local_sweeps.db", help="SQLite file where the results are saved")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="csv file where all results are exported at the end")
+    parser.add_argument("--model_bank", type=int, default=None,
+                        help="train up to this number of compatible MLP / ResNet configs together (see model_bank.py)")
+    parser.add_argument("--model_bank_max_padding", type=float, default=None,
+                        help="maximum cost of the padded models of a bank, relative to the unpadded models")
+    parser.add_argument("--retry_crashed", action="store_true",
+                        help="run again the runs which crashed in a previous launch")
+    args = parser.parse_args()
+
+    sweep_paths = []
+    for path in args.sweeps:
+        if path.endswith(".csv"):
+            import pandas as pd
+            # paths in the csv are relative to the root of the repo
+            root = os.path.join(os.path.dirname(os.path.abspath(path)), "..", "..", "..")
+            sweep_paths.extend(os.path.join(root, p) for p in pd.read_csv(path)["sweep_id"])
+        else:
+            sweep_paths.append(path)
+
+    for sweep_path in sweep_paths:
+        with open(sweep_path, "r") as f:
+            sweep_config = json.load(f)
+        run_local_sweep(sweep_config, n_runs=args.n_runs, n_workers=args.n_workers, n_threads=args.n_threads,
+                        db_path=args.db, seed=args.seed, model_bank=args.model_bank,
+                        model_bank_max_padding=args.model_bank_max_padding, retry_crashed=args.retry_crashed)
+
+    if args.output is not None:
+        load_results(args.db).to_csv(args.output)
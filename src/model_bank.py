@@ -0,0 +1,618 @@
+from run_experiment import load_iteration_data, get_n_iter, summarize_results
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.func import vmap
+from sklearn.preprocessing import QuantileTransformer
+from skorch.dataset import Dataset, ValidSplit
+from tabular.bin.mlp import MLP
+from tabular.bin.resnet import ResNet
+import tabular.lib as lib
+from train import compute_metrics
+from utils.preprocessing_cache import fit_transform_cached, get_cache_params
+from utils.skorch_utils import split_numerical_categorical
+
+# Train many small skorch models (MLP, ResNet) of a random search on the same data in one process.
+# The models of a "bank" are stacked and trained together with torch.func.vmap on the same batches,
+# each with its own size, dropout, learning rate, weight decay, lr schedule, early stopping and best epoch,
+# which is what they would do if they were trained separately with skorch_models.py.
+
+MODULES = {"rtdl_mlp": MLP,
+           "rtdl_mlp_regressor": MLP,
+           "rtdl_resnet": ResNet,
+           "rtdl_resnet_regressor": ResNet}
+INPUT_SIZE_PARAMETER = {MLP: "d_in", ResNet: "d_numerical"}
+# Module parameters which can differ between the models of a bank. The weights of the smaller models are
+# zero-padded to the shapes of the largest ones (depth, width, hidden size, embedding size), which doesn't change
+# the functions they compute: the blocks after the last one of a model are skipped and the LayerNorm statistics
+# are computed on its unpadded features. The dropout rates are tensors with one value per model.
+PER_MODEL_MODULE_PARAMETERS = {MLP: ["n_layers", "d_layers", "dropout", "d_embedding"],
+                               ResNet: ["n_layers", "d", "d_hidden_factor", "hidden_dropout", "residual_dropout",
+                                        "d_embedding"]}
+# Config keys which can differ between the models of a bank
+PER_MODEL_KEYS = ["model__lr", "model__optimizer__weight_decay", "model__lr_scheduler", "model__es_patience",
+                  "model__lr_patience", "model__use_checkpoints"]
+EARLY_STOPPING_THRESHOLD = 1e-4  # skorch EarlyStopping and ReduceLROnPlateau defaults
+LR_FACTOR = 0.2
+MIN_LR = 2e-5
+NORM_EPS = 1e-5  # nn.LayerNorm and nn.BatchNorm1d defaults
+BATCHNORM_MOMENTUM = 0.1
+
+
+def _get(config, key, default):
+    return config[key] if key in config.keys() else default
+
+
+def can_use_model_bank(config):
+    return config["model_type"] == "skorch" and config["model_name"] in MODULES.keys() \
+           and config["model__optimizer"] in ["adam", "adamw"] \
+           and not _get(config, "model__amp", False) and not _get(config, "model__compile", False)
+
+
+def get_bank_key(config):
+    """Configs with the same key can be trained in the same bank"""
+    per_model = ["model__module__" + name for name in PER_MODEL_MODULE_PARAMETERS[MODULES[config["model_name"]]]]
+    if not config["regression"]:
+        # sampled by the random searches, but only used for regression
+        per_model.append("transformed_target")
+    return tuple(sorted((key, repr(config[key])) for key in config.keys()
+                        if key not in PER_MODEL_KEYS and key not in per_model))
+
+
+def get_model_dims(config):
+    """Sizes of the hidden layers of a model, which are padded to their maximum in a bank"""
+    if MODULES[config["model_name"]] is MLP:
+        return {"n_layers": config["model__module__n_layers"], "d": config["model__module__d_layers"]}
+    d_hidden = int(config["model__module__d"] * config["model__module__d_hidden_factor"])
+    return {"n_layers": config["model__module__n_layers"], "d": config["model__module__d"],
+            "d_hidden": d_hidden * (2 if config["model__module__activation"].endswith("glu") else 1)}
+
+
+def get_model_cost(dims):
+    """Number of weights of the hidden layers, roughly proportional to the training time of a model"""
+    if "d_hidden" in dims:
+        # linear0 (d -> d_hidden) and linear1 (d_hidden / 2 -> d for the glu activations)
+        return dims["n_layers"] * dims["d"] * dims["d_hidden"] * 3 / 2
+    return dims["n_layers"] * dims["d"] ** 2
+
+
+def get_padding_ratio(configs):
+    """Cost of training configs padded in the same bank, relative to the cost of their unpadded models"""
+    dims = [get_model_dims(config) for config in configs]
+    padded_dims = {name: max(d[name] for d in dims) for name in dims[0].keys()}
+    return len(configs) * get_model_cost(padded_dims) / sum(get_model_cost(d) for d in dims)
+
+
+def group_configs(configs, max_size=None, max_padding=None):
+    """
+    Group the configs which can be trained in the same bank. Configs with the same key are sorted by cost,
+    so that the models of a group have similar sizes.
+    :param max_size: maximum number of configs in a group
+    :param max_padding: maximum padding ratio of a group (see get_padding_ratio), e.g 2 to spend at most twice
+    the compute of the unpadded models
+    :return: list of lists of indices of configs. Configs which can't use a model bank are alone in their group.
+    """
+    groups = {}
+    for i, config in enumerate(configs):
+        key = get_bank_key(config) if can_use_model_bank(config) else ("single", i)
+        groups.setdefault(key, []).append(i)
+    res = []
+    for key, indices in groups.items():
+        if key[0] == "single":
+            res.append(indices)
+            continue
+        group = []
+        for i in sorted(indices, key=lambda i: get_model_cost(get_model_dims(configs[i]))):
+            if group and ((max_size is not None and len(group) >= max_size) or (
+                    max_padding is not None and get_padding_ratio([configs[j] for j in group + [i]]) > max_padding)):
+                res.append(group)
+                group = []
+            group.append(i)
+        res.append(group)
+    return res
+
+
+def _pad_and_stack(tensors, padding=None):
+    """Stack tensors of different shapes, zero-padding them to the largest shape. Also return a mask of the values
+    which aren't padding (None if there is no padding).
+    :param padding: which tensors are only padding (by default none)"""
+    padding = [False] * len(tensors) if padding is None else padding
+    shape = tuple(max(sizes) for sizes in zip(*[t.shape for t in tensors]))
+    if not any(padding) and all(t.shape == shape for t in tensors):
+        return torch.stack(tensors), None
+    stacked = tensors[0].new_zeros((len(tensors),) + shape)
+    mask = torch.zeros(stacked.shape, dtype=torch.bool, device=stacked.device)
+    for k, t in enumerate(tensors):
+        corner = (k,) + tuple(slice(0, size) for size in t.shape)
+        stacked[corner] = t
+        mask[corner] = not padding[k]
+    return stacked, mask
+
+
+def _per_model(values, tensor):
+    """Reshape a (K,) tensor to be broadcast with a stacked (K, ...) tensor"""
+    return values.view((-1,) + (1,) * (tensor.dim() - 1))
+
+
+def _first_layer_state(weight, bias, embeddings, d_numerical, n_categories):
+    # the columns of the embeddings of each category are split, so that a smaller d_embedding is padded
+    # at the end of each category
+    state = {"first.weight_num": weight[:, :d_numerical], "first.bias": bias}
+    if n_categories:
+        state["embeddings.weight"] = embeddings
+        state["first.weight_cat"] = weight[:, d_numerical:].reshape(len(weight), n_categories, -1)
+    return state
+
+
+def _mlp_state(module, d_numerical, n_categories, n_layers):
+    """
+    Weights of an MLP, as used by ModelBank._mlp_forward
+    :param n_layers: number of layers of the bank. The missing layers of the module are zeros.
+    :return: weights, buffers, names of the missing weights
+    """
+    p = {name: value.detach() for name, value in module.named_parameters()}
+    module_n_layers = len(module.layers) - 1
+    state = _first_layer_state(p["layers.0.weight"], p["layers.0.bias"], p.get("category_embeddings.weight"),
+                               d_numerical, n_categories)
+    d = len(p["layers.0.bias"])
+    missing = set()
+    for i in range(1, n_layers):
+        weight, bias = "hidden.{}.weight".format(i), "hidden.{}.bias".format(i)
+        if i < module_n_layers:
+            state[weight], state[bias] = p["layers.{}.weight".format(i)], p["layers.{}.bias".format(i)]
+        else:
+            state[weight], state[bias] = p["layers.0.bias"].new_zeros((d, d)), p["layers.0.bias"].new_zeros(d)
+            missing.update([weight, bias])
+    # the last layer of MLP.layers has d_out units
+    state["last.weight"] = p["layers.{}.weight".format(module_n_layers)]
+    state["last.bias"] = p["layers.{}.bias".format(module_n_layers)]
+    state["head.weight"], state["head.bias"] = p["head.weight"], p["head.bias"]
+    return state, {}, missing
+
+
+def _resnet_state(module, d_numerical, n_categories, n_layers):
+    """
+    Weights and batchnorm statistics of a ResNet, as used by ModelBank._resnet_forward
+    :param n_layers: number of blocks of the bank. The missing blocks of the module are zeros.
+    :return: weights, buffers, names of the missing weights
+    """
+    p = {name: value.detach() for name, value in module.named_parameters()}
+    b = dict(module.named_buffers())
+    state = _first_layer_state(p["first_layer.weight"], p["first_layer.bias"], p.get("category_embeddings.weight"),
+                               d_numerical, n_categories)
+    buffers, missing = {}, set()
+    n_groups = 2 if module.main_activation in [lib.reglu, lib.geglu] else 1
+    for i in range(n_layers):
+        # the missing blocks have the shapes of the first one
+        prefix, new_prefix = "layers.{}.".format(min(i, len(module.layers) - 1)), "blocks.{}.".format(i)
+        block = {"norm.weight": p[prefix + "norm.weight"],
+                 "norm.bias": p[prefix + "norm.bias"],
+                 # halves of the glu activations, so that a smaller hidden size is padded at the end of each half
+                 "linear0.weight": p[prefix + "linear0.weight"].reshape(n_groups, -1, module.head.in_features),
+                 "linear0.bias": p[prefix + "linear0.bias"].reshape(n_groups, -1),
+                 "linear1.weight": p[prefix + "linear1.weight"],
+                 "linear1.bias": p[prefix + "linear1.bias"]}
+        block_buffers = {name: b[prefix + name] for name in ["norm.running_mean", "norm.running_var"]
+                         if prefix + name in b.keys()}
+        if i >= len(module.layers):
+            block = {name: torch.zeros_like(value) for name, value in block.items()}
+            block_buffers = {name: torch.zeros_like(value) for name, value in block_buffers.items()}
+            missing.update(new_prefix + name for name in block.keys())
+        state.update({new_prefix + name: value for name, value in block.items()})
+        buffers.update({new_prefix + name: value for name, value in block_buffers.items()})
+    state["last_norm.weight"] = p["last_normalization.weight"]
+    state["last_norm.bias"] = p["last_normalization.bias"]
+    if "last_normalization.running_mean" in b.keys():
+        buffers["last_norm.running_mean"] = b["last_normalization.running_mean"]
+        buffers["last_norm.running_var"] = b["last_normalization.running_var"]
+    state["head.weight"], state["head.bias"] = p["head.weight"], p["head.bias"]
+    return state, buffers, missing
+
+
+def _dropout(x, p, training):
+    # F.dropout with a rate which can be a (vmapped) tensor
+    if not training:
+        return x
+    return x * (torch.rand_like(x) >= p) / (1 - p)
+
+
+class ModelBank:
+    """
+    K models of the same architecture (up to PER_MODEL_MODULE_PARAMETERS), trained together.
+    :param configs: run configs of the models, with the same keys except for PER_MODEL_KEYS and the per model
+    module parameters (see group_configs)
+    """
+    def __init__(self, configs, categorical_indicator=None):
+        self.configs = configs
+        config = configs[0]
+        self.module_class = MODULES[config["model_name"]]
+        self.regression = config["regression"]
+        self.transformed_target = self.regression and config["transformed_target"]
+        self.categorical_indicator = categorical_indicator
+        self.device = _get(config, "model__device", "cpu")
+        self.batch_size = config["model__batch_size"]
+        self.max_epochs = config["model__max_epochs"]
+        self.optimizer = config["model__optimizer"]
+        self.training = False
+        if self.module_class is ResNet:
+            self.normalization = config["model__module__normalization"]
+            self.main_activation = lib.get_activation_fn(config["model__module__activation"])
+            self.last_activation = lib.get_nonglu_activation_fn(config["model__module__activation"])
+        # per model hyperparameters, with the defaults of the skorch factories
+        default_weight_decay = 0.01 if self.optimizer == "adamw" else 0.
+        self.lr = self._per_model_values("model__lr", 0.01)
+        self.weight_decay = self._per_model_values("model__optimizer__weight_decay", default_weight_decay)
+        self.es_patience = self._per_model_values("model__es_patience", 40)
+        self.lr_scheduler = self._per_model_values("model__lr_scheduler", False).bool()
+        self.lr_patience = self._per_model_values("model__lr_patience", 30)
+        self.use_checkpoints = self._per_model_values("model__use_checkpoints", True).bool()
+        # per model module parameters used in the forward (vmapped with the weights)
+        names = ["n_layers", "dropout"] if self.module_class is MLP \
+            else ["n_layers", "d", "hidden_dropout", "residual_dropout"]
+        self.module_hyperparameters = {name: self._per_model_values("model__module__" + name, None)
+                                       for name in names}
+        self.max_n_layers = int(self.module_hyperparameters["n_layers"].max())
+
+    def _per_model_values(self, key, default):
+        return torch.tensor([float(_get(config, key, default)) for config in self.configs], device=self.device)
+
+    def _module_kwargs(self, config, d_input, categories):
+        kwargs = {key[len("model__module__"):]: config[key] for key in config.keys()
+                  if key.startswith("model__module__")}
+        kwargs.update({INPUT_SIZE_PARAMETER[self.module_class]: d_input,
+                       "categories": categories,
+                       "d_out": 1 if self.regression else 2,
+                       "regression": self.regression,
+                       "categorical_indicator": None if self.categorical_indicator is None
+                       else torch.BoolTensor(self.categorical_indicator)})
+        return kwargs
+
+    def _get_input_shape(self, X):
+        # as InputShapeSetterMLP / InputShapeSetterResnet
+        if self.categorical_indicator is None:
+            return X.shape[1], None
+        d_input = X.shape[1] - sum(self.categorical_indicator)
+        return d_input, list((X[:, self.categorical_indicator].max(0) + 1).astype(int))
+
+    def _create_modules(self, X):
+        """Modules of the configs, initialized as skorch would initialize them"""
+        d_input, categories = self._get_input_shape(X)
+        return [self.module_class(**self._module_kwargs(config, d_input, categories)).to(self.device)
+                for config in self.configs]
+
+    def _init_modules(self, X):
+        d_input, categories = self._get_input_shape(X)
+        modules = self._create_modules(X)
+        self.category_offsets = getattr(modules[0], "category_offsets", None)
+        get_state = _mlp_state if self.module_class is MLP else _resnet_state
+        states, buffers, missing = zip(*[get_state(module, d_input, 0 if categories is None else len(categories),
+                                                   self.max_n_layers) for module in modules])
+        self.params, self.masks = {}, {}
+        for name in states[0].keys():
+            stacked, mask = _pad_and_stack([state[name] for state in states], [name in m for m in missing])
+            self.params[name] = stacked.requires_grad_()
+            self.masks[name] = mask
+        self.buffers = {name: _pad_and_stack([b[name] for b in buffers])[0] for name in buffers[0].keys()}
+        self.exp_avg = {name: torch.zeros_like(p) for name, p in self.params.items()}
+        self.exp_avg_sq = {name: torch.zeros_like(p) for name, p in self.params.items()}
+        self.n_steps = 0
+
+    def _to_tensors(self, X, y=None):
+        if self.categorical_indicator is None:
+            X = {"x_num": np.ascontiguousarray(X, dtype=np.float32)}
+        else:
+            X = split_numerical_categorical(X, self.categorical_indicator, self.category_offsets)
+        X = {key: torch.as_tensor(value, device=self.device) for key, value in X.items()}
+        if y is None:
+            return X
+        if self.regression:
+            y = torch.as_tensor(np.asarray(y, dtype=np.float32).reshape(-1, 1), device=self.device)
+        else:
+            y = torch.as_tensor(np.asarray(y).reshape(-1), dtype=torch.int64, device=self.device)
+        return X, y
+
+    def _first_layer(self, params, x_num, x_cat):
+        x = F.linear(x_num, params["first.weight_num"], params["first.bias"])
+        if x_cat is not None:
+            embeddings = F.embedding(x_cat, params["embeddings.weight"])
+            x = x + torch.einsum("nce,dce->nd", embeddings, params["first.weight_cat"])
+        return x
+
+    def _mlp_forward(self, params, buffers, hyperparameters, x_num, x_cat):
+        # MLP.forward of one model
+        dropout = hyperparameters["dropout"]
+        x = _dropout(F.relu(self._first_layer(params, x_num, x_cat)), dropout, self.training)
+        for i in range(1, self.max_n_layers):
+            z = F.relu(F.linear(x, params["hidden.{}.weight".format(i)], params["hidden.{}.bias".format(i)]))
+            x = torch.where(i < hyperparameters["n_layers"], _dropout(z, dropout, self.training), x)
+        x = _dropout(F.relu(F.linear(x, params["last.weight"], params["last.bias"])), dropout, self.training)
+        return F.linear(x, params["head.weight"], params["head.bias"]), {}
+
+    def _normalize(self, x, params, buffers, name, d):
+        """
+        nn.LayerNorm or nn.BatchNorm1d of the first d features of x (the others are padding)
+        :return: output, updated batchnorm statistics (when training)
+        """
+        weight, bias = params[name + ".weight"], params[name + ".bias"]
+        if self.normalization == "layernorm":
+            mask = torch.arange(x.shape[-1], device=x.device) < d
+            mean = (x * mask).sum(-1, keepdim=True) / d
+            var = ((x - mean) * mask).pow(2).sum(-1, keepdim=True) / d
+            return (x - mean) / torch.sqrt(var + NORM_EPS) * weight + bias, {}
+        # the batchnorm statistics are computed per feature, so they aren't changed by the padding
+        running_mean, running_var = buffers[name + ".running_mean"], buffers[name + ".running_var"]
+        if not self.training:
+            return (x - running_mean) / torch.sqrt(running_var + NORM_EPS) * weight + bias, {}
+        mean, var = x.mean(0), x.var(0, unbiased=False)
+        n = x.shape[0]
+        new_buffers = {name + ".running_mean": torch.lerp(running_mean, mean, BATCHNORM_MOMENTUM),
+                       name + ".running_var": torch.lerp(running_var, var * n / (n - 1), BATCHNORM_MOMENTUM)}
+        return (x - mean) / torch.sqrt(var + NORM_EPS) * weight + bias, new_buffers
+
+    def _resnet_forward(self, params, buffers, hyperparameters, x_num, x_cat):
+        # ResNet.forward of one model
+        d = hyperparameters["d"]
+        new_buffers = {}
+        x = self._first_layer(params, x_num, x_cat)
+        for i in range(self.max_n_layers):
+            prefix = "blocks.{}.".format(i)
+            z, updated = self._normalize(x, params, buffers, prefix + "norm", d)
+            new_buffers.update(updated)
+            z = torch.einsum("nd,ghd->ngh", z, params[prefix + "linear0.weight"]) + params[prefix + "linear0.bias"]
+            z = self.main_activation(z.flatten(1))
+            z = _dropout(z, hyperparameters["hidden_dropout"], self.training)
+            z = F.linear(z, params[prefix + "linear1.weight"], params[prefix + "linear1.bias"])
+            z = _dropout(z, hyperparameters["residual_dropout"], self.training)
+            # the blocks after the last one of the model are skipped
+            x = x + z * (i < hyperparameters["n_layers"])
+        x, updated = self._normalize(x, params, buffers, "last_norm", d)
+        new_buffers.update(updated)
+        x = self.last_activation(x)
+        return F.linear(x, params["head.weight"], params["head.bias"]), new_buffers
+
+    def _forward(self, params, buffers, X, indices):
+        """:return: outputs (K, batch_size, d_out), updated batchnorm statistics (when training)"""
+        x_num = X["x_num"][indices]
+        x_cat = X["x_cat"][indices] if "x_cat" in X else None
+        forward = self._mlp_forward if self.module_class is MLP else self._resnet_forward
+        # different dropout masks for each model
+        return vmap(forward, in_dims=(0, 0, 0, None, None), randomness="different")(
+            params, buffers, self.module_hyperparameters, x_num, x_cat)
+
+    def _losses(self, y_pred, y):
+        # (K,) losses: CrossEntropyLoss or MSELoss (mean over the batch) of each model
+        if self.regression:
+            return ((y_pred - y[None]) ** 2).mean(dim=(1, 2))
+        n_models, batch_size, n_classes = y_pred.shape
+        losses = F.cross_entropy(y_pred.reshape(-1, n_classes), y.repeat(n_models), reduction="none")
+        return losses.view(n_models, batch_size).mean(1)
+
+    def _n_correct(self, y_pred, y):
+        # (K,) number of correct predictions of each model (classification)
+        return (y_pred.argmax(-1) == y[None]).sum(1)
+
+    @torch.no_grad()
+    def _optimizer_step(self, active, betas=(0.9, 0.999), eps=1e-8):
+        # Adam / AdamW (as in torch.optim) with a learning rate and a weight decay per model.
+        # Stopped models and padding are not updated.
+        self.n_steps += 1
+        bias_correction1 = 1 - betas[0] ** self.n_steps
+        bias_correction2 = 1 - betas[1] ** self.n_steps
+        for name, p in self.params.items():
+            grad, mask = p.grad, self.masks[name]
+            update_mask = _per_model(active, p) if mask is None else mask & _per_model(active, p)
+            lr, weight_decay = _per_model(self.lr, p), _per_model(self.weight_decay, p)
+            if self.optimizer == "adam":
+                grad = grad + weight_decay * p
+            grad = torch.where(update_mask, grad, 0.)
+            self.exp_avg[name].lerp_(grad, 1 - betas[0])
+            self.exp_avg_sq[name].mul_(betas[1]).addcmul_(grad, grad, value=1 - betas[1])
+            denom = (self.exp_avg_sq[name].sqrt() / np.sqrt(bias_correction2)).add_(eps)
+            update = lr / bias_correction1 * self.exp_avg[name] / denom
+            if self.optimizer == "adamw":
+                update += lr * weight_decay * p
+            p.sub_(torch.where(update_mask, update, 0.))
+
+    @torch.no_grad()
+    def _validation_scores(self, X, y):
+        """:return: (K,) losses and accuracies (None for regression) on the validation data"""
+        self.training = False
+        losses = torch.zeros(len(self.configs), device=self.device)
+        n_correct = torch.zeros(len(self.configs), device=self.device)
+        for start in range(0, len(y), self.batch_size):
+            indices = slice(start, start + self.batch_size)
+            y_pred, _ = self._forward(self.params, self.buffers, X, indices)
+            losses += self._losses(y_pred, y[indices]) * len(y[indices])
+            if not self.regression:
+                n_correct += self._n_correct(y_pred, y[indices])
+        return losses / len(y), None if self.regression else n_correct / len(y)
+
+    def fit(self, X, y):
+        """
+        Train the models on X, y, with the train / valid split of skorch (ValidSplit(5))
+        """
+        if self.transformed_target:
+            # as TransformedTargetRegressor in train.train_model
+            self.target_transformer = QuantileTransformer(output_distribution="normal")
+            cache_dir, max_size = get_cache_params(self.configs[0])
+            if cache_dir is not None:
+                self.target_transformer, y = fit_transform_cached(self.target_transformer, np.asarray(y).reshape(-1, 1),
+                                                                  cache_dir, max_size)
+            else:
+                y = self.target_transformer.fit_transform(np.asarray(y).reshape(-1, 1))
+        dataset_train, dataset_valid = ValidSplit(5, stratified=not self.regression)(Dataset(X, y), y)
+        self._init_modules(X)
+        X_train, y_train = self._to_tensors(X[dataset_train.indices], np.asarray(y)[dataset_train.indices])
+        X_valid, y_valid = self._to_tensors(X[dataset_valid.indices], np.asarray(y)[dataset_valid.indices])
+
+        n_models = len(self.configs)
+        active = torch.ones(n_models, dtype=torch.bool, device=self.device)
+        best_loss = torch.full((n_models,), np.inf, device=self.device)
+        es_best_loss, es_misses = best_loss.clone(), torch.zeros_like(best_loss)
+        lr_best_loss, lr_misses = best_loss.clone(), torch.zeros_like(best_loss)
+        self.best_params = {name: p.detach().clone() for name, p in self.params.items()}
+        self.best_buffers = {name: b.clone() for name, b in self.buffers.items()}
+        self.n_epochs = np.zeros(n_models, dtype=int)
+        self.history = []
+        for epoch in range(self.max_epochs):
+            self.training = True
+            order = torch.randperm(len(y_train), device=self.device)
+            train_losses = torch.zeros(n_models, device=self.device)
+            train_correct = torch.zeros(n_models, device=self.device)
+            for start in range(0, len(y_train), self.batch_size):
+                indices = order[start:start + self.batch_size]
+                y_pred, new_buffers = self._forward(self.params, self.buffers, X_train, indices)
+                losses = self._losses(y_pred, y_train[indices])
+                for p in self.params.values():
+                    p.grad = None
+                losses.sum().backward()
+                self._optimizer_step(active)
+                with torch.no_grad():
+                    for name, b in new_buffers.items():
+                        self.buffers[name] = torch.where(_per_model(active, b), b, self.buffers[name])
+                    train_losses += losses * len(indices)
+                    if not self.regression:
+                        train_correct += self._n_correct(y_pred, y_train[indices])
+            valid_losses, valid_accuracies = self._validation_scores(X_valid, y_valid)
+            train_losses /= len(y_train)
+            # as the train_accuracy scoring of the skorch models: accuracy for classification, negative RMSE
+            # for regression, on the predictions of the training batches
+            train_scores = -train_losses.sqrt() if self.regression else train_correct / len(y_train)
+            self.history.append({"train_loss": train_losses.cpu().numpy(),
+                                 "train_accuracy": train_scores.cpu().numpy(),
+                                 "valid_loss": valid_losses.cpu().numpy(),
+                                 "valid_acc": None if self.regression else valid_accuracies.cpu().numpy()})
+            self.n_epochs[active.cpu().numpy()] += 1
+
+            # best epoch (skorch Checkpoint)
+            improved = active & (valid_losses < best_loss)
+            best_loss = torch.where(improved, valid_losses, best_loss)
+            with torch.no_grad():
+                for name, p in self.params.items():
+                    self.best_params[name] = torch.where(_per_model(improved, p), p, self.best_params[name])
+                for name, b in self.buffers.items():
+                    self.best_buffers[name] = torch.where(_per_model(improved, b), b, self.best_buffers[name])
+            # lr schedule (ReduceLROnPlateau)
+            lr_improved = valid_losses < lr_best_loss * (1 - EARLY_STOPPING_THRESHOLD)
+            lr_best_loss = torch.where(lr_improved, valid_losses, lr_best_loss)
+            lr_misses = torch.where(lr_improved, 0., lr_misses + 1)
+            reduce = active & self.lr_scheduler & (lr_misses > self.lr_patience)
+            self.lr = torch.where(reduce, torch.clamp(self.lr * LR_FACTOR, min=MIN_LR), self.lr)
+            lr_misses = torch.where(reduce, 0., lr_misses)
+            # early stopping
+            es_improved = valid_losses < es_best_loss * (1 - EARLY_STOPPING_THRESHOLD)
+            es_best_loss = torch.where(es_improved, valid_losses, es_best_loss)
+            es_misses = torch.where(es_improved, 0., es_misses + 1)
+            stopped = active & (es_misses >= self.es_patience)
+            if stopped.any():
+                self._keep_last_state(stopped)
+                active &= ~stopped
+                print("Model bank: {} models stopped at epoch {}, {} still training".format(
+                    int(stopped.sum()), epoch + 1, int(active.sum())))
+            if not active.any():
+                break
+        self._keep_last_state(active)
+        self.training = False
+        return self
+
+    @torch.no_grad()
+    def _keep_last_state(self, models):
+        # the models without checkpoints use their last weights instead of the best ones
+        models = models & ~self.use_checkpoints
+        for name, p in self.params.items():
+            self.best_params[name] = torch.where(_per_model(models, p), p, self.best_params[name])
+        for name, b in self.buffers.items():
+            self.best_buffers[name] = torch.where(_per_model(models, b), b, self.best_buffers[name])
+
+    @torch.no_grad()
+    def predict_raw(self, X):
+        """Outputs of the modules, shape (K, n_samples, d_out)"""
+        self.training = False
+        X = self._to_tensors(X)
+        n = len(X["x_num"])
+        outputs = [self._forward(self.best_params, self.best_buffers, X, slice(start, start + self.batch_size))[0]
+                   for start in range(0, n, self.batch_size)]
+        return torch.cat(outputs, dim=1).cpu().numpy()
+
+    def predict(self, X):
+        """
+        :return: predictions of each model, shape (K, n_samples) for classification and (K, n_samples, 1)
+        for regression (as the skorch regressors)
+        """
+        outputs = self.predict_raw(X)
+        if not self.regression:
+            return outputs.argmax(-1)
+        if self.transformed_target:
+            outputs = np.stack([self.target_transformer.inverse_transform(o) for o in outputs])
+        return outputs
+
+    def predict_proba(self, X):
+        """:return: probabilities of each model, shape (K, n_samples, n_classes)"""
+        return torch.softmax(torch.as_tensor(self.predict_raw(X)), dim=-1).numpy()
+
+    def get_history_log(self, k):
+        """History of model k, logged as run_experiment.run_iteration logs the history of the skorch models"""
+        n_epochs = int(self.n_epochs[k])
+        history = self.history[:n_epochs]
+        history_log = {"num_epochs": n_epochs,
+                       "train_accuracy_vector": [float(history[i * 10]["train_accuracy"][k])
+                                                 for i in range(n_epochs // 10)]}
+        if self.regression:
+            history_log["valid_loss_vector"] = [float(history[i * 10]["valid_loss"][k])
+                                                for i in range(n_epochs // 10)]
+        else:
+            history_log["valid_accuracy_vector"] = [float(history[i * 10]["valid_acc"][k])
+                                                    for i in range(n_epochs // 10)]
+        return history_log
+
+
+def run_model_bank_iteration(configs, i):
+    """
+    As run_experiment.run_iteration for several configs trained in the same bank
+    :return: list of the results of each config
+    """
+    data, data_generation_time = load_iteration_data(configs[0], i)
+    x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator = data
+    regression = configs[0]["regression"]
+    start_time = time.time()
+    torch.manual_seed(i)
+    bank = ModelBank(configs, categorical_indicator).fit(x_train, y_train)
+    predictions = {}
+    for split, x in [("train", x_train), ("val", x_val), ("test", x_test)]:
+        if regression:
+            predictions[split] = (bank.predict(x), [None] * len(configs))
+        else:
+            proba = bank.predict_proba(x)
+            predictions[split] = (proba.argmax(-1), proba)
+    bank_time = time.time() - start_time
+
+    results = []
+    score_name = "rmse" if regression else "accuracy"
+    for k, config in enumerate(configs):
+        metrics = {split: compute_metrics(y, predictions[split][0][k], predictions[split][1][k], regression)
+                   for split, y in [("train", y_train), ("val", y_val), ("test", y_test)]}
+        result = {"{}_score".format(split): metrics[split][score_name] for split in ["train", "val", "test"]}
+        for split in ["train", "val", "test"]:
+            result["r2_{}".format(split)] = metrics[split]["r2"] if regression else np.nan
+        result.update({"metrics": metrics,
+                       # the models are trained together, so each gets an equal share of the training time
+                       "time": bank_time / len(configs),
+                       "history_log": bank.get_history_log(k),
+                       "data_generation_time": data_generation_time,
+                       "n_train": x_train.shape[0],
+                       "n_test": x_test.shape[0],
+                       "n_features": x_train.shape[1]})
+        results.append(result)
+    return results
+
+
+def get_model_bank_run_results(configs):
+    """
+    As run_experiment.get_run_results for configs which can be trained in the same bank (see group_configs)
+    :return: list of the dictionaries to log for each config
+    """
+    n_iter = get_n_iter(configs[0])
+    iteration_results = [run_model_bank_iteration(configs, i) for i in range(n_iter)]
+    return [summarize_results(config, [results[k] for results in iteration_results])
+            for k, config in enumerate(configs)]
@@ -3,10 +3,12 @@ os.environ["PROJECT_DIR"] = "test"
 from generate_dataset_pipeline import generate_dataset
 import traceback  # Needed for pulling out your full stackframe info
 from train import *
-import wandb
 import platform
+import sys
 import time
-import torch
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threadpoolctl import threadpool_limits
 
 #os.environ["WANDB_MODE"] = "offline"
 
@@ -22,193 +24,312 @@ import torch
 #         dic["model__gamma"] = config["model__gamma"] - 0.0001
 #         dic["model__reg_alpha"] = config["model__reg_alpha"] - 0.0001
 #     return dic
+def remove_checkpoint_files(config, model_id):
+    # the best states of skorch and TabSurvey models are kept in memory (and their files removed) by
+    # BestStateCheckpoint and BaseModelTorch.load_best_state, except with model__args__checkpoint_to_file
+    if config["model_type"] == "tab_survey" and "model__args__checkpoint_to_file" in config.keys() \
+            and config["model__args__checkpoint_to_file"]:
+        try:
+            os.remove(r"output/{}/{}/tmp/m_{}_best.pt".format(config["model__args__model_name"],
+                                                               config["data__keyword"], model_id))
+        except:
+            print("could not remove params file")
+
+
+def get_iteration_rng(i):
+    """
+    Rng used to generate the data of iteration i. get_n_iter uses the same state as iteration 0,
+    so that with a dataset cache the dataset it generates is the one iteration 0 loads.
+    """
+    rng = np.random.RandomState(i)
+    print(rng.randn(1))
+    return rng
+
+
+def load_iteration_data(config, i):
+    """
+    Generate the data of iteration i, with the dtypes and shapes expected by the models
+    :return: (x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator), data generation time
+    """
+    rng = get_iteration_rng(i)
+    # TODO: separate numeric and categorical features
+    t = time.time()
+    x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator = generate_dataset(config, rng)
+    data_generation_time = time.time() - t
+    print("Data generation time:", data_generation_time)
+    # print(y_train)
+    print(x_train.shape)
+
+    if config["model_type"] == "skorch" and config["regression"]:
+        print("YES")
+        y_train, y_val, y_test = y_train.reshape(-1, 1), y_val.reshape(-1, 1), y_test.reshape(-1, 1)
+        y_train, y_val, y_test = y_train.astype(np.float32, copy=False), y_val.astype(np.float32, copy=False), y_test.astype(
+            np.float32, copy=False)
+    else:
+        y_train, y_val, y_test = y_train.reshape(-1), y_val.reshape(-1), y_test.reshape(-1)
+        # y_train, y_val, y_test = y_train.astype(np.float32), y_val.astype(np.float32), y_test.astype(np.float32)
+    # no copy if the data pipeline already returned float32 arrays
+    x_train, x_val, x_test = x_train.astype(np.float32, copy=False), x_val.astype(np.float32, copy=False), x_test.astype(
+        np.float32, copy=False)
+
+    return (x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator), data_generation_time
+
+
+def run_iteration(config, i):
+    """
+    Generate the data with seed i, train the model and evaluate it.
+    :return: a dictionary with the scores, the training time and the information to log
+    """
+    # if config["log_training"]: #FIXME
+    #    config["model__wandb_run"] = run
+    data, data_generation_time = load_iteration_data(config, i)
+    x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator = data
+
+    start_time = time.time()
+    print(y_train.shape)
+    model_id = None
+    try:
+        model, model_id = train_model(i, x_train, y_train, categorical_indicator, config)
+        metrics = evaluate_model_metrics(model, x_train, y_train, x_val, y_val, x_test, y_test, config)
+    except:
+        remove_checkpoint_files(config, model_id)
+        raise
+    score_name = "rmse" if config["regression"] else "accuracy"
+    train_score, val_score, test_score = (metrics[split][score_name] for split in ["train", "val", "test"])
+    if config["regression"]:
+        r2_train, r2_val, r2_test = (metrics[split]["r2"] for split in ["train", "val", "test"])
+    else:
+        r2_train, r2_val, r2_test = np.nan, np.nan, np.nan
+
+    end_time = time.time()
+    print("Train score:", train_score)
+    print("Val score:", val_score)
+    print("Test score:", test_score)
+    history_log = None
+    if config["model_type"] == "skorch":
+        if config["regression"]:
+            if config["transformed_target"]:
+                history = model.regressor_.history
+            else:
+                history = model.history
+            history_log = {"num_epochs": len(history),
+                           "train_accuracy_vector": [history[i * 10]["train_accuracy"] for i in
+                                                     range(len(history) // 10)],
+                           "valid_loss_vector": [history[i * 10]["valid_loss"] for i in
+                                                 range(len(history) // 10)]}
+        else:
+            history = model.history
+            history_log = {"num_epochs": len(history),
+                           "train_accuracy_vector": [history[i * 10]["train_accuracy"] for i in
+                                                     range(len(history) // 10)],
+                           "valid_accuracy_vector": [history[i * 10]["valid_acc"] for i in
+                                                     range(len(history) // 10)]}
+
+    return {"train_score": train_score,
+            "val_score": val_score,
+            "test_score": test_score,
+            "r2_train": r2_train,
+            "r2_val": r2_val,
+            "r2_test": r2_test,
+            "metrics": metrics,
+            "time": end_time - start_time,
+            "history_log": history_log,
+            "data_generation_time": data_generation_time,
+            "n_train": x_train.shape[0],
+            "n_test": x_test.shape[0],
+            "n_features": x_train.shape[1]}
+
+
+def _init_iteration_worker(n_threads):
+    # Cap the threads used by BLAS / OpenMP (sklearn, xgboost) and torch in each worker
+    # so that n_workers * n_threads doesn't oversubscribe the machine
+    global _thread_limiter
+    _thread_limiter = threadpool_limits(limits=n_threads)
+    # torch is only imported by the runs which need it, and reads OMP_NUM_THREADS when it is imported
+    os.environ["OMP_NUM_THREADS"] = str(n_threads)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(n_threads)
+
+
+def run_iterations_in_parallel(config, n_iter, n_workers, n_threads=None):
+    """
+    Run the n_iter (independent) iterations in a process pool.
+    The results are returned in the order of the iterations, as when running them sequentially.
+    :param n_workers: number of processes
+    :param n_threads: number of threads per process. If None, the cpus are split between the workers.
+    """
+    n_workers = min(n_workers, n_iter)
+    if n_threads is None:
+        n_threads = max(1, os.cpu_count() // n_workers)
+    # wandb config can't be sent to other processes
+    config = {key: config[key] for key in config.keys()}
+    if config["model_name"] in ["rf_c", "rf_r", "xgb_c", "xgb_r"] and "model__n_jobs" not in config.keys():
+        config["model__n_jobs"] = n_threads
+    print("Running {} iterations on {} workers with {} threads each".format(n_iter, n_workers, n_threads))
+    # spawn rather than fork, as forking a process which has already initialized torch / OpenMP can hang
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_iteration_worker, initargs=(n_threads,)) as executor:
+        results = list(executor.map(run_iteration, [config] * n_iter, range(n_iter)))
+    return results
+
+
+CONFIG_DEFAULT = {"train_prop": 0.70,
+                  "val_test_prop": 0.3,
+                  "max_val_samples": 50000,
+                  "max_test_samples": 50000}
+# "model__use_checkpoints": True} #TODO
+
+
+def prepare_config(config):
+    # Modify the config in certain cases
+    if config["model_name"] == "ft_transformer" or config["model_name"] == "ft_transformer_regressor":
+        config["model__module__d_token"] = (config["d_token"] // config["model__module__n_heads"]) * config[
+            "model__module__n_heads"]
+    # config = modify_config(config)
+    return config
+
+
+def get_n_iter(config):
+    if config["n_iter"] == "auto":
+        x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator = generate_dataset(config, get_iteration_rng(0))
+        if x_test.shape[0] > 6000:
+            n_iter = 1
+        elif x_test.shape[0] > 3000:
+            n_iter = 2
+        elif x_test.shape[0] > 1000:
+            n_iter = 3
+        else:
+            n_iter = 5
+    else:
+        n_iter = config["n_iter"]
+    return n_iter
+
+
+def get_run_results(config):
+    """
+    Train and evaluate the model described by config on n_iter splits
+    :return: a dictionary with everything to log for this run
+    """
+    n_iter = get_n_iter(config)
+    # The iterations are independent, so they can be run in parallel
+    # with "n_iter_workers" processes using "n_iter_threads" threads each
+    if "n_iter_workers" in config.keys() and config["n_iter_workers"] is not None \
+            and config["n_iter_workers"] > 1 and n_iter > 1:
+        n_threads = config["n_iter_threads"] if "n_iter_threads" in config.keys() else None
+        results = run_iterations_in_parallel(config, n_iter, config["n_iter_workers"], n_threads)
+    else:
+        results = [run_iteration(config, i) for i in range(n_iter)]
+    return summarize_results(config, results)
+
+
+def summarize_results(config, results):
+    """
+    Aggregate the results of the iterations of a run
+    :param results: list of the dictionaries returned by run_iteration
+    :return: a dictionary with everything to log for this run
+    """
+    n_iter = len(results)
+    train_scores = []
+    val_scores = []
+    test_scores = []
+    r2_train_scores = []
+    r2_val_scores = []
+    r2_test_scores = []
+    times = []
+    run_results = {}
+    for result in results:
+        if result["history_log"] is not None:
+            run_results.update(result["history_log"])
+        times.append(result["time"])
+        train_scores.append(result["train_score"])
+        val_scores.append(result["val_score"])
+        test_scores.append(result["test_score"])
+        r2_train_scores.append(result["r2_train"])
+        r2_val_scores.append(result["r2_val"])
+        r2_test_scores.append(result["r2_test"])
+
+    if "model__device" in config.keys():
+        if config["model__device"] == "cpu":
+            processor = platform.processor()
+        elif config["model__device"] == "cuda":
+            import torch
+            processor = torch.cuda.get_device_name(torch.cuda.current_device())
+    else:
+        processor = platform.processor()
+
+    if n_iter > 1:
+        run_results.update({"train_scores": train_scores,
+                            "val_scores": val_scores,
+                            "test_scores": test_scores,
+                            "mean_train_score": np.mean(train_scores),
+                            "mean_val_score": np.mean(val_scores),
+                            "mean_test_score": np.mean(test_scores),
+                            "std_train_score": np.std(train_scores),
+                            "std_val_score": np.std(val_scores),
+                            "std_test_score": np.std(test_scores),
+                            "max_train_score": np.max(train_scores),
+                            "max_val_score": np.max(val_scores),
+                            "max_test_score": np.max(test_scores),
+                            "min_train_score": np.min(train_scores),
+                            "min_val_score": np.min(val_scores),
+                            "min_test_score": np.min(test_scores),
+                            "mean_r2_train": np.mean(r2_train_scores),
+                            "mean_r2_val": np.mean(r2_val_scores),
+                            "mean_r2_test": np.mean(r2_test_scores),
+                            "std_r2_train": np.std(r2_train_scores),
+                            "std_r2_val": np.std(r2_val_scores),
+                            "std_r2_test": np.std(r2_test_scores),
+                            "mean_time": np.mean(times),
+                            "std_time": np.std(times),
+                            "times": times,
+                            "processor": processor})
+    else:
+        run_results.update({"mean_train_score": train_scores[-1],
+                            "mean_val_score": val_scores[-1],
+                            "mean_test_score": test_scores[-1],
+                            "mean_r2_train": r2_train_scores[-1],
+                            "mean_r2_val": r2_val_scores[-1],
+                            "mean_r2_test": r2_test_scores[-1],
+                            "mean_time": times[-1],
+                            "processor": processor})
+
+    if not config["regression"]:
+        for metric in ["log_loss", "auc"]:
+            for split in ["train", "val", "test"]:
+                run_results["mean_{}_{}".format(metric, split)] = np.mean([result["metrics"][split][metric]
+                                                                           for result in results])
+
+    run_results.update({"n_train": results[-1]["n_train"], "n_test": results[-1]["n_test"],
+                        "n_features": results[-1]["n_features"],
+                        "data_generation_time": results[-1]["data_generation_time"]})
+    return run_results
+
+
 def train_model_on_config(config=None):
+    import torch
+    import wandb
     print("GPU?")
     print(torch.cuda.device_count())
     print(torch.cuda.is_available())
     #    print(torch.cuda.current_device())
     #    print(torch.cuda.get_device_name(torch.cuda.current_device()))
     print("#####")
-    CONFIG_DEFAULT = {"train_prop": 0.70,
-                      "val_test_prop": 0.3,
-                      "max_val_samples": 50000,
-                      "max_test_samples": 50000}
-    # "model__use_checkpoints": True} #TODO
     # Initialize a new wandb run
     with wandb.init(config=config) as run:
         run.config.update(CONFIG_DEFAULT)
         config = wandb.config
         print(config)
-        # Modify the config in certain cases
-        if config["model_name"] == "ft_transformer" or config["model_name"] == "ft_transformer_regressor":
-            config["model__module__d_token"] = (config["d_token"] // config["model__module__n_heads"]) * config[
-                "model__module__n_heads"]
-        # config = modify_config(config)
+        config = prepare_config(config)
 
         # print(config)
         try:
-            train_scores = []
-            val_scores = []
-            test_scores = []
-            r2_train_scores = []
-            r2_val_scores = []
-            r2_test_scores = []
-            times = []
-            if config["n_iter"] == "auto":
-                x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator = generate_dataset(config, np.random.RandomState(0))
-                if x_test.shape[0] > 6000:
-                    n_iter = 1
-                elif x_test.shape[0] > 3000:
-                    n_iter = 2
-                elif x_test.shape[0] > 1000:
-                    n_iter = 3
-                else:
-                    n_iter = 5
-            else:
-                n_iter = config["n_iter"]
-            for i in range(n_iter):
-                # if config["log_training"]: #FIXME
-                #    config["model__wandb_run"] = run
-                rng = np.random.RandomState(i)
-                print(rng.randn(1))
-                # TODO: separate numeric and categorical features
-                t = time.time()
-                x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator = generate_dataset(config, rng)
-                data_generation_time = time.time() - t
-                print("Data generation time:", data_generation_time)
-                # print(y_train)
-                print(x_train.shape)
-
-                if config["model_type"] == "skorch" and config["regression"]:
-                    print("YES")
-                    y_train, y_val, y_test = y_train.reshape(-1, 1), y_val.reshape(-1, 1), y_test.reshape(-1, 1)
-                    y_train, y_val, y_test = y_train.astype(np.float32), y_val.astype(np.float32), y_test.astype(
-                        np.float32)
-                else:
-                    y_train, y_val, y_test = y_train.reshape(-1), y_val.reshape(-1), y_test.reshape(-1)
-                    # y_train, y_val, y_test = y_train.astype(np.float32), y_val.astype(np.float32), y_test.astype(np.float32)
-                x_train, x_val, x_test = x_train.astype(np.float32), x_val.astype(np.float32), x_test.astype(
-                    np.float32)
-
-                start_time = time.time()
-                print(y_train.shape)
-                model, model_id = train_model(i, x_train, y_train, categorical_indicator, config)
-                if config["regression"]:
-                    try:
-                        r2_train, r2_val, r2_test = evaluate_model(model, x_train, y_train, x_val, y_val, x_test,
-                                                                   y_test, config, model_id, return_r2=True)
-                    except:
-                        print("R2 score cannot be computed")
-                        print(np.any(np.isnan(y_train)))
-                        r2_train, r2_val, r2_test = np.nan, np.nan, np.nan
-                    r2_train_scores.append(r2_train)
-                    r2_val_scores.append(r2_val)
-                    r2_test_scores.append(r2_test)
-                else:
-                    r2_train, r2_val, r2_test = np.nan, np.nan, np.nan
-                    r2_train_scores.append(r2_train)
-                    r2_val_scores.append(r2_val)
-                    r2_test_scores.append(r2_test)
-                train_score, val_score, test_score = evaluate_model(model, x_train, y_train, x_val, y_val, x_test,
-                                                                    y_test, config, model_id)
-
-                end_time = time.time()
-                print("Train score:", train_score)
-                print("Val score:", val_score)
-                print("Test score:", test_score)
-                if config["model_type"] == "skorch":
-                    if config["regression"]:
-                        if config["transformed_target"]:
-                            history = model.regressor_.history
-                        else:
-                            history = model.history
-                        wandb.log({"num_epochs": len(history),
-                                   "train_accuracy_vector": [history[i * 10]["train_accuracy"] for i in
-                                                             range(len(history) // 10)],
-                                   "valid_loss_vector": [history[i * 10]["valid_loss"] for i in
-                                                         range(len(history) // 10)]},
-                                  commit=False)
-                    else:
-                        history = model.history
-                        wandb.log({"num_epochs": len(history),
-                                   "train_accuracy_vector": [history[i * 10]["train_accuracy"] for i in
-                                                             range(len(history) // 10)],
-                                   "valid_accuracy_vector": [history[i * 10]["valid_acc"] for i in
-                                                             range(len(history) // 10)]},
-                                  commit=False)
-
-                times.append(end_time - start_time)
-                # wandb.log({"train_score": train_score})
-                # wandb.log({"test_score": test_score})
-                train_scores.append(train_score)
-                val_scores.append(val_score)
-                test_scores.append(test_score)
-
-            if "model__device" in config.keys():
-                if config["model__device"] == "cpu":
-                    processor = platform.processor()
-                elif config["model__device"] == "cuda":
-                    processor = torch.cuda.get_device_name(torch.cuda.current_device())
-            else:
-                processor = platform.processor()
-
-            if n_iter > 1:
-                wandb.log({"train_scores": train_scores,
-                           "val_scores": val_scores,
-                           "test_scores": test_scores,
-                           "mean_train_score": np.mean(train_scores),
-                           "mean_val_score": np.mean(val_scores),
-                           "mean_test_score": np.mean(test_scores),
-                           "std_train_score": np.std(train_scores),
-                           "std_val_score": np.std(val_scores),
-                           "std_test_score": np.std(test_scores),
-                           "max_train_score": np.max(train_scores),
-                           "max_val_score": np.max(val_scores),
-                           "max_test_score": np.max(test_scores),
-                           "min_train_score": np.min(train_scores),
-                           "min_val_score": np.min(val_scores),
-                           "min_test_score": np.min(test_scores),
-                           "mean_r2_train": np.mean(r2_train_scores),
-                           "mean_r2_val": np.mean(r2_val_scores),
-                           "mean_r2_test": np.mean(r2_test_scores),
-                           "std_r2_train": np.std(r2_train_scores),
-                           "std_r2_val": np.std(r2_val_scores),
-                           "std_r2_test": np.std(r2_test_scores),
-                           "mean_time": np.mean(times),
-                           "std_time": np.std(times),
-                           "times": times,
-                           "processor": processor}, commit=False)
-            else:
-                wandb.log({"mean_train_score": train_score,
-                           "mean_val_score": val_score,
-                           "mean_test_score": test_score,
-                           "mean_r2_train": r2_train,
-                           "mean_r2_val": r2_val,
-                           "mean_r2_test": r2_test,
-                           "mean_time": end_time - start_time,
-                           "processor": processor}, commit=False)
-
-            wandb.log({"n_train": x_train.shape[0], "n_test": x_test.shape[0],
-                       "n_features": x_train.shape[1],
-                       "data_generation_time": data_generation_time})
-
+            wandb.log(get_run_results(config))
         except:
             # Print to the console
             print("ERROR")
             # To get the traceback information
             print(traceback.format_exc())
             print(config)
-            if config["model_type"] == "skorch" and config["model__use_checkpoints"]:
-                print("crashed, trying to remove checkpoint files")
-                try:
-                    os.remove(r"skorch_cp/params_{}.pt".format(model_id))
-                except:
-                    print("could not remove params file")
-            if config["model_type"] == "tab_survey":
-                try:
-                    os.remove(r"output/saint/{}/tmp/m_{}_best.pt".format(config["data__keyword"], model_id))
-                except:
-                    print("could not remove params file")
             return -1
     return 0
 
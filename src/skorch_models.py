@@ -1,17 +1,21 @@
 import torch.nn
-from skorch.callbacks import Checkpoint, EarlyStopping, LRScheduler
+from skorch.callbacks import EarlyStopping, LRScheduler
 from skorch import NeuralNetClassifier
 from skorch.callbacks import EpochScoring
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 from torch.optim import AdamW, Adam, SGD
 from skorch.callbacks import WandbLogger
-from utils.skorch_utils import LearningRateLogger
+from utils.skorch_utils import LearningRateLogger, AmpMixin, VirtualBatchMixin, SplitInputMixin, TensorBatchIterator, BestStateCheckpoint
 from tabular.bin.resnet import ResNet, InputShapeSetterResnet
 from tabular.bin.mlp import MLP, InputShapeSetterMLP
 from tabular.bin.ft_transformer import Transformer
 
 
-def create_resnet_skorch(id, wandb_run=None, use_checkpoints=True,
+class NeuralNetClassifierBis(AmpMixin, VirtualBatchMixin, SplitInputMixin, NeuralNetClassifier):
+    pass
+
+
+def create_resnet_skorch(id, wandb_run=None, use_checkpoints=True, checkpoint_dir=None,
                          categorical_indicator=None, **kwargs):
     if "verbose" not in kwargs:
         verbose = 0
@@ -46,8 +50,7 @@ def create_resnet_skorch(id, wandb_run=None, use_checkpoints=True,
         callbacks.append(LRScheduler(policy=ReduceLROnPlateau, patience=lr_patience, min_lr=2e-5,
                                      factor=0.2))  # FIXME make customizable
     if use_checkpoints:
-        callbacks.append(Checkpoint(dirname="skorch_cp", f_params=r"params_{}.pt".format(id), f_optimizer=None,
-                                    f_criterion=None))
+        callbacks.append(BestStateCheckpoint(dirname=checkpoint_dir, f_params="params_{}.pt".format(id)))
     if not wandb_run is None:
         callbacks.append(WandbLogger(wandb_run, save_model=False))
         callbacks.append(LearningRateLogger())
@@ -55,12 +58,14 @@ def create_resnet_skorch(id, wandb_run=None, use_checkpoints=True,
     if not categorical_indicator is None:
         categorical_indicator = torch.BoolTensor(categorical_indicator)
 
-    mlp_skorch = NeuralNetClassifier(
+    mlp_skorch = NeuralNetClassifierBis(
         ResNet,
         # Shuffle training data on each epoch
         criterion=torch.nn.CrossEntropyLoss,
         optimizer=optimizer,
         batch_size=max(batch_size, 1),  # if batch size is float, it will be reset during fit
+        iterator_train=TensorBatchIterator,
+        iterator_valid=TensorBatchIterator,
         iterator_train__shuffle=True,
         module__d_numerical=1,  # will be change when fitted
         module__categories=None,  # will be change when fitted
@@ -75,7 +80,7 @@ def create_resnet_skorch(id, wandb_run=None, use_checkpoints=True,
     return mlp_skorch
 
 
-def create_rtdl_mlp_skorch(id, wandb_run=None, use_checkpoints=True,
+def create_rtdl_mlp_skorch(id, wandb_run=None, use_checkpoints=True, checkpoint_dir=None,
                            categorical_indicator=None, **kwargs):
     if "lr_scheduler" not in kwargs:
         lr_scheduler = False
@@ -105,8 +110,7 @@ def create_rtdl_mlp_skorch(id, wandb_run=None, use_checkpoints=True,
         callbacks.append(LRScheduler(policy=ReduceLROnPlateau, patience=lr_patience, min_lr=2e-5,
                                      factor=0.2))  # FIXME make customizable
     if use_checkpoints:
-        callbacks.append(Checkpoint(dirname="skorch_cp", f_params=r"params_{}.pt".format(id), f_optimizer=None,
-                                    f_criterion=None))
+        callbacks.append(BestStateCheckpoint(dirname=checkpoint_dir, f_params="params_{}.pt".format(id)))
     if not wandb_run is None:
         callbacks.append(WandbLogger(wandb_run, save_model=False))
         callbacks.append(LearningRateLogger())
@@ -114,12 +118,14 @@ def create_rtdl_mlp_skorch(id, wandb_run=None, use_checkpoints=True,
     if not categorical_indicator is None:
         categorical_indicator = torch.BoolTensor(categorical_indicator)
 
-    mlp_skorch = NeuralNetClassifier(
+    mlp_skorch = NeuralNetClassifierBis(
         MLP,
         # Shuffle training data on each epoch
         criterion=torch.nn.CrossEntropyLoss,
         optimizer=optimizer,
         batch_size=max(batch_size, 1),  # if batch size is float, it will be reset during fit
+        iterator_train=TensorBatchIterator,
+        iterator_valid=TensorBatchIterator,
         iterator_train__shuffle=True,
         module__d_in=1,  # will be change when fitted
         module__categories=None,  # will be change when fitted
@@ -134,7 +140,7 @@ def create_rtdl_mlp_skorch(id, wandb_run=None, use_checkpoints=True,
     return mlp_skorch
 
 
-def create_ft_transformer_skorch(id, wandb_run=None, use_checkpoints=True,
+def create_ft_transformer_skorch(id, wandb_run=None, use_checkpoints=True, checkpoint_dir=None,
                                  categorical_indicator=None, **kwargs):
     if "lr_scheduler" not in kwargs:
         lr_scheduler = False
@@ -164,8 +170,7 @@ def create_ft_transformer_skorch(id, wandb_run=None, use_checkpoints=True,
         callbacks.append(LRScheduler(policy=ReduceLROnPlateau, patience=lr_patience, min_lr=2e-5,
                                      factor=0.2))  # FIXME make customizable
     if use_checkpoints:
-        callbacks.append(Checkpoint(dirname="skorch_cp", f_params=r"params_{}.pt".format(id), f_optimizer=None,
-                                    f_criterion=None))
+        callbacks.append(BestStateCheckpoint(dirname=checkpoint_dir, f_params="params_{}.pt".format(id)))
     if not wandb_run is None:
         callbacks.append(WandbLogger(wandb_run, save_model=False))
         callbacks.append(LearningRateLogger())
@@ -174,12 +179,14 @@ def create_ft_transformer_skorch(id, wandb_run=None, use_checkpoints=True,
         categorical_indicator = torch.BoolTensor(categorical_indicator)
 
 
-    model_skorch = NeuralNetClassifier(
+    model_skorch = NeuralNetClassifierBis(
         Transformer,
         # Shuffle training data on each epoch
         criterion=torch.nn.CrossEntropyLoss,
         optimizer=optimizer,
         batch_size=max(batch_size, 1),  # if batch size is float, it will be reset during fit
+        iterator_train=TensorBatchIterator,
+        iterator_valid=TensorBatchIterator,
         iterator_train__shuffle=True,
         module__d_numerical=1,  # will be change when fitted
         module__categories=None,  # will be change when fitted
@@ -1,22 +1,22 @@
 import torch.nn
-from skorch.callbacks import Checkpoint, EarlyStopping, LRScheduler
+from skorch.callbacks import EarlyStopping, LRScheduler
 from skorch import NeuralNetRegressor
 from skorch.callbacks import EpochScoring
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 from torch.optim import AdamW, Adam, SGD
 from skorch.callbacks import WandbLogger
-from utils.skorch_utils import LearningRateLogger
+from utils.skorch_utils import LearningRateLogger, AmpMixin, VirtualBatchMixin, SplitInputMixin, TensorBatchIterator, BestStateCheckpoint
 from tabular.bin.resnet import ResNet, InputShapeSetterResnet
 from tabular.bin.mlp import MLP, InputShapeSetterMLP
 from tabular.bin.ft_transformer import Transformer
 
-class NeuralNetRegressorBis(NeuralNetRegressor):
+class NeuralNetRegressorBis(AmpMixin, VirtualBatchMixin, SplitInputMixin, NeuralNetRegressor):
     def fit(self, X, y):
         if y.ndim == 1:
             y = y.reshape(-1, 1)
         return super().fit(X, y)
 
-def create_resnet_regressor_skorch(id, wandb_run=None, use_checkpoints=True,
+def create_resnet_regressor_skorch(id, wandb_run=None, use_checkpoints=True, checkpoint_dir=None,
                                    categorical_indicator=None, **kwargs):
     print("resnet regressor")
     if "lr_scheduler" not in kwargs:
@@ -47,8 +47,7 @@ def create_resnet_regressor_skorch(id, wandb_run=None, use_checkpoints=True,
     if lr_scheduler:
         callbacks.append(LRScheduler(policy=ReduceLROnPlateau, patience=lr_patience, min_lr=2e-5, factor=0.2)) #FIXME make customizable
     if use_checkpoints:
-        callbacks.append(Checkpoint(dirname="skorch_cp", f_params=r"params_{}.pt".format(id), f_optimizer=None,
-                                  f_criterion=None))
+        callbacks.append(BestStateCheckpoint(dirname=checkpoint_dir, f_params="params_{}.pt".format(id)))
     if not wandb_run is None:
         callbacks.append(WandbLogger(wandb_run, save_model=False))
         callbacks.append(LearningRateLogger())
@@ -60,6 +59,8 @@ def create_resnet_regressor_skorch(id, wandb_run=None, use_checkpoints=True,
         # Shuffle training data on each epoch
         optimizer=optimizer,
         batch_size=max(batch_size, 1), # if batch size is float, it will be reset during fit
+        iterator_train=TensorBatchIterator,
+        iterator_valid=TensorBatchIterator,
         iterator_train__shuffle=True,
         module__d_numerical=1,  # will be change when fitted
         module__categories=None, # will be change when fitted
@@ -72,7 +73,7 @@ def create_resnet_regressor_skorch(id, wandb_run=None, use_checkpoints=True,
 
     return model
 
-def create_rtdl_mlp_regressor_skorch(id, wandb_run=None, use_checkpoints=True,
+def create_rtdl_mlp_regressor_skorch(id, wandb_run=None, use_checkpoints=True, checkpoint_dir=None,
                                      categorical_indicator=None, **kwargs):
     if "lr_scheduler" not in kwargs:
         lr_scheduler = False
@@ -101,8 +102,7 @@ def create_rtdl_mlp_regressor_skorch(id, wandb_run=None, use_checkpoints=True,
     if lr_scheduler:
         callbacks.append(LRScheduler(policy=ReduceLROnPlateau, patience=lr_patience, min_lr=2e-5, factor=0.2)) #FIXME make customizable
     if use_checkpoints:
-        callbacks.append(Checkpoint(dirname="skorch_cp", f_params=r"params_{}.pt".format(id), f_optimizer=None,
-                                  f_criterion=None))
+        callbacks.append(BestStateCheckpoint(dirname=checkpoint_dir, f_params="params_{}.pt".format(id)))
     if not wandb_run is None:
         callbacks.append(WandbLogger(wandb_run, save_model=False))
         callbacks.append(LearningRateLogger())
@@ -116,6 +116,8 @@ def create_rtdl_mlp_regressor_skorch(id, wandb_run=None, use_checkpoints=True,
         # Shuffle training data on each epoch
         optimizer=optimizer,
         batch_size=max(batch_size, 1), # if batch size is float, it will be reset during fit
+        iterator_train=TensorBatchIterator,
+        iterator_valid=TensorBatchIterator,
         iterator_train__shuffle=True,
         module__d_in=1,  # will be change when fitted
         module__categories=None, # will be change when fitted
@@ -130,7 +132,7 @@ def create_rtdl_mlp_regressor_skorch(id, wandb_run=None, use_checkpoints=True,
     return mlp_skorch
 
 
-def create_ft_transformer_regressor_skorch(id, wandb_run=None, use_checkpoints=True,
+def create_ft_transformer_regressor_skorch(id, wandb_run=None, use_checkpoints=True, checkpoint_dir=None,
                                            categorical_indicator=None, **kwargs):
     if "lr_scheduler" not in kwargs:
         lr_scheduler = False
@@ -158,8 +160,7 @@ def create_ft_transformer_regressor_skorch(id, wandb_run=None, use_checkpoints=T
     if lr_scheduler:
         callbacks.append(LRScheduler(policy=ReduceLROnPlateau, patience=lr_patience, min_lr=2e-5, factor=0.2)) #FIXME make customizable
     if use_checkpoints:
-        callbacks.append(Checkpoint(dirname="skorch_cp", f_params=r"params_{}.pt".format(id), f_optimizer=None,
-                                  f_criterion=None))
+        callbacks.append(BestStateCheckpoint(dirname=checkpoint_dir, f_params="params_{}.pt".format(id)))
     if not wandb_run is None:
         callbacks.append(WandbLogger(wandb_run, save_model=False))
         callbacks.append(LearningRateLogger())
@@ -173,6 +174,8 @@ def create_ft_transformer_regressor_skorch(id, wandb_run=None, use_checkpoints=T
         # Shuffle training data on each epoch
         optimizer=optimizer,
         batch_size=max(batch_size, 1), # if batch size is float, it will be reset during fit
+        iterator_train=TensorBatchIterator,
+        iterator_valid=TensorBatchIterator,
         iterator_train__shuffle=True,
         module__d_numerical=1,  # will be change when fitted
         module__categories=None, # will be change when fitted
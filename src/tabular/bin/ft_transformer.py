@@ -1,5 +1,6 @@
 # %%
 import math
+import threading
 import typing as ty
 from pathlib import Path
 
@@ -15,6 +16,20 @@ import tabular.lib as lib
 
 
 # %%
+if hasattr(torch, 'compiler') and hasattr(torch.compiler, 'is_compiling'):
+    _is_compiling_impl = torch.compiler.is_compiling
+else:
+    # torch 2.0 only has the dynamo function
+    import torch._dynamo
+
+    _is_compiling_impl = torch._dynamo.is_compiling
+
+
+def _is_compiling() -> bool:
+    # the cached tensors of the inference path can't be traced by torch.compile
+    return _is_compiling_impl()
+
+
 class Tokenizer(nn.Module):
     category_offsets: ty.Optional[Tensor]
 
@@ -53,34 +68,102 @@ class Tokenizer(nn.Module):
             0 if self.category_offsets is None else len(self.category_offsets)
         )
 
-    def forward(self, x_num: Tensor, x_cat: ty.Optional[Tensor]) -> Tensor:
+    def _get_output(
+        self, batch_size: int, device: torch.device, reuse_output: bool
+    ) -> ty.Tuple[Tensor, Tensor, Tensor, Tensor]:
+        # Output tensor of the inference and its [CLS], numerical and categorical views.
+        # With reuse_output, it is reused between calls with the same batch size.
+        # The reused output is per thread, so that threads predicting with the same model don't share it.
+        key = (batch_size, device, self.weight.dtype, torch.is_inference_mode_enabled())
+        if reuse_output and getattr(self, '_output_cache', None) is None:
+            self._output_cache = threading.local()
+        cache = getattr(self._output_cache, 'value', None) if reuse_output else None
+        if cache is None or cache[0] != key:
+            n_numerical = len(self.weight)
+            x = torch.empty(batch_size, self.n_tokens, self.weight.shape[1], dtype=self.weight.dtype, device=device)
+            cache = (key, (x, x[:, 0], x[:, 1:n_numerical], x[:, n_numerical:]))
+            if reuse_output:
+                self._output_cache.value = cache
+        return cache[1]
+
+    def __getstate__(self):
+        # the inference caches aren't part of the model: they are rebuilt after unpickling or copying
+        # (nn.Module and object only have __getstate__ in recent torch and python)
+        state = super().__getstate__() if hasattr(super(), '__getstate__') else self.__dict__
+        return {name: value for name, value in state.items() if name not in ['_output_cache', '_inference_tables']}
+
+    def _get_inference_tables(self) -> ty.Tuple[Tensor, Tensor, ty.Optional[Tensor], ty.Optional[Tensor]]:
+        # [CLS] and numerical weights, bias of the numerical tokens, and category embeddings with the bias
+        # of their feature already added. Rebuilt when the parameters are modified in place (their _version
+        # changes) or replaced (.to(device), assignment of .data...: their storage or device changes).
+        parameters = (self.weight, self.bias, self.category_embeddings)
+        tensors = [None if p is None else p.weight if isinstance(p, nn.Module) else p for p in parameters]
+        key = tuple(None if t is None else (t._version, t.data_ptr(), t.device) for t in tensors)
+        cache = getattr(self, '_inference_tables', None)
+        if cache is None or cache[0] != key or any(a is not b for a, b in zip(cache[1], parameters)):
+            n_numerical = len(self.weight)
+            numerical_bias = category_table = None
+            if self.bias is not None:
+                numerical_bias = self.bias[: n_numerical - 1].detach().clone()
+            if self.category_embeddings is not None:
+                category_table = self.category_embeddings.weight.detach().clone()
+                if self.bias is not None:
+                    # feature of each row of the embedding table
+                    feature = torch.bucketize(
+                        torch.arange(len(category_table), device=category_table.device),
+                        self.category_offsets[1:],
+                        right=True,
+                    )
+                    category_table += self.bias[n_numerical - 1 :].detach()[feature]
+            weight = self.weight.detach()
+            tables = (weight[0], weight[None, 1:], numerical_bias, category_table)
+            cache = (key, parameters, tables)
+            self._inference_tables = cache
+        return cache[2]
+
+    def forward(
+        self,
+        x_num: Tensor,
+        x_cat: ty.Optional[Tensor],
+        add_category_offsets: bool = True,
+        reuse_output: bool = False,
+    ) -> Tensor:
+        # The tokens are written in a single (batch_size, n_tokens, d_token) tensor: [CLS], numerical, categorical,
+        # and the bias is added in place. The [CLS] token has no bias, so it's simply weight[0].
+        # With reuse_output, the output tensor of the inference is reused by the next calls, so the returned
+        # tokens are only valid until the next call (Transformer.forward consumes them right away).
         x_some = x_num if x_cat is None else x_cat
         assert x_some is not None
-        x_num = torch.cat(
-            [torch.ones(len(x_some), 1, device=x_some.device)]  # [CLS]
-            + ([] if x_num is None else [x_num]),
-            dim=1,
-        )
-        x = self.weight[None] * x_num[:, :, None]
+        n_numerical = len(self.weight)
+        if x_cat is not None and add_category_offsets:
+            x_cat = x_cat + self.category_offsets[None]
+        if torch.is_grad_enabled() or _is_compiling():
+            x = torch.empty(len(x_some), self.n_tokens, self.weight.shape[1], dtype=self.weight.dtype,
+                            device=x_some.device)
+            x[:, 0] = self.weight[0]
+            if x_num is not None:
+                x[:, 1:n_numerical] = self.weight[None, 1:] * x_num[:, :, None]
+            if x_cat is not None:
+                x[:, n_numerical:] = self.category_embeddings(x_cat)
+            if self.bias is not None:
+                x[:, 1:] += self.bias[None]
+            return x
+        # inference: the biases are added to the embeddings once
+        x, x_cls, x_numerical, x_categorical = self._get_output(len(x_some), x_some.device, reuse_output)
+        cls_weight, numerical_weight, numerical_bias, category_table = self._get_inference_tables()
+        x_cls.copy_(cls_weight)
+        if x_num is not None:
+            torch.mul(numerical_weight, x_num.unsqueeze(-1), out=x_numerical)
+            if numerical_bias is not None:
+                x_numerical += numerical_bias
         if x_cat is not None:
-            x = torch.cat(
-                [x, self.category_embeddings(x_cat + self.category_offsets[None])],
-                dim=1,
-            )
-        if self.bias is not None:
-            bias = torch.cat(
-                [
-                    torch.zeros(1, self.bias.shape[1], device=x.device),
-                    self.bias,
-                ]
-            )
-            x = x + bias[None]
+            x_categorical.copy_(F.embedding(x_cat, category_table))
         return x
 
 
 class MultiheadAttention(nn.Module):
     def __init__(
-        self, d: int, n_heads: int, dropout: float, initialization: str
+        self, d: int, n_heads: int, dropout: float, initialization: str, fast: bool = False
     ) -> None:
         if n_heads > 1:
             assert d % n_heads == 0
@@ -93,6 +176,8 @@ class MultiheadAttention(nn.Module):
         self.W_out = nn.Linear(d, d) if n_heads > 1 else None
         self.n_heads = n_heads
         self.dropout = nn.Dropout(dropout) if dropout else None
+        # fused projections and scaled_dot_product_attention, see _fast_forward
+        self.fast = fast
 
         for m in [self.W_q, self.W_k, self.W_v]:
             if initialization == 'xavier' and (n_heads > 1 or m is not self.W_v):
@@ -111,6 +196,53 @@ class MultiheadAttention(nn.Module):
             .reshape(batch_size * self.n_heads, n_tokens, d_head)
         )
 
+    def _split_heads(self, x: Tensor) -> Tensor:
+        # (batch_size, n_heads, n_tokens, d_head) view, without copy
+        batch_size, n_tokens, d = x.shape
+        return x.view(batch_size, n_tokens, self.n_heads, d // self.n_heads).transpose(1, 2)
+
+    def _fast_forward(
+        self,
+        x_q: Tensor,
+        x_kv: Tensor,
+        key_compression: ty.Optional[nn.Linear],
+        value_compression: ty.Optional[nn.Linear],
+    ) -> Tensor:
+        # Same computation as forward, with the q, k, v (or k, v) projections done in one matmul
+        # on the concatenated weights (so that the parameters and checkpoints are unchanged),
+        # and the attention computed by a fused kernel when available
+        if x_q is x_kv:
+            weight = torch.cat([self.W_q.weight, self.W_k.weight, self.W_v.weight])
+            bias = torch.cat([self.W_q.bias, self.W_k.bias, self.W_v.bias])
+            q, k, v = F.linear(x_kv, weight, bias).chunk(3, dim=-1)
+        else:
+            q = self.W_q(x_q)
+            weight = torch.cat([self.W_k.weight, self.W_v.weight])
+            bias = torch.cat([self.W_k.bias, self.W_v.bias])
+            k, v = F.linear(x_kv, weight, bias).chunk(2, dim=-1)
+        if key_compression is not None:
+            assert value_compression is not None
+            k = key_compression(k.transpose(1, 2)).transpose(1, 2)
+            v = value_compression(v.transpose(1, 2)).transpose(1, 2)
+        else:
+            assert value_compression is None
+
+        batch_size, n_q_tokens, d = q.shape
+        q, k, v = (self._split_heads(t) for t in [q, k, v])
+        use_dropout = self.dropout is not None and self.training
+        # with dropout, the fused kernel falls back to a slower path on cpu
+        if hasattr(F, 'scaled_dot_product_attention') and not (use_dropout and q.device.type == 'cpu'):
+            x = F.scaled_dot_product_attention(q, k, v, dropout_p=self.dropout.p if use_dropout else 0.0)
+        else:
+            attention = F.softmax(q @ k.transpose(-1, -2) / math.sqrt(q.shape[-1]), dim=-1)
+            if use_dropout:
+                attention = self.dropout(attention)
+            x = attention @ v
+        x = x.transpose(1, 2).reshape(batch_size, n_q_tokens, v.shape[1] * v.shape[-1])
+        if self.W_out is not None:
+            x = self.W_out(x)
+        return x
+
     def forward(
         self,
         x_q: Tensor,
@@ -118,6 +250,8 @@ class MultiheadAttention(nn.Module):
         key_compression: ty.Optional[nn.Linear],
         value_compression: ty.Optional[nn.Linear],
     ) -> Tensor:
+        if self.fast:
+            return self._fast_forward(x_q, x_kv, key_compression, value_compression)
         q, k, v = self.W_q(x_q), self.W_k(x_kv), self.W_v(x_kv)
         for tensor in [q, k, v]:
             assert tensor.shape[-1] % self.n_heads == 0
@@ -182,7 +316,8 @@ class Transformer(nn.Module):
         #
         d_out: int,
         regression: bool,
-        categorical_indicator
+        categorical_indicator,
+        fast_attention: bool = False,
     ) -> None:
         assert (kv_compression is None) ^ (kv_compression_sharing is not None)
         super().__init__()
@@ -217,7 +352,7 @@ class Transformer(nn.Module):
             layer = nn.ModuleDict(
                 {
                     'attention': MultiheadAttention(
-                        d_token, n_heads, attention_dropout, initialization
+                        d_token, n_heads, attention_dropout, initialization, fast_attention
                     ),
                     'linear0': nn.Linear(
                         d_token, d_hidden * (2 if activation.endswith('glu') else 1)
@@ -244,6 +379,10 @@ class Transformer(nn.Module):
         self.residual_dropout = residual_dropout
         self.head = nn.Linear(d_token, d_out)
 
+    @property
+    def category_offsets(self):
+        return self.tokenizer.category_offsets
+
     def _get_kv_compressions(self, layer):
         return (
             (self.shared_kv_compression, self.shared_kv_compression)
@@ -271,15 +410,20 @@ class Transformer(nn.Module):
             x = layer[f'norm{norm_idx}'](x)
         return x
 
-    def forward(self, x) -> Tensor:
-        if not self.categorical_indicator is None:
-            x_num = x[:, ~self.categorical_indicator].float()
-            x_cat = x[:, self.categorical_indicator].long() #TODO
+    def forward(self, x=None, x_num=None, x_cat=None) -> Tensor:
+        # Either x, the mixed numerical and categorical features, or x_num and x_cat already split by
+        # utils.skorch_utils.split_numerical_categorical (with the category offsets added to x_cat)
+        if x is not None:
+            if not self.categorical_indicator is None:
+                x_num = x[:, ~self.categorical_indicator].float()
+                x_cat = x[:, self.categorical_indicator].long() #TODO
+            else:
+                x_num = x
+                x_cat = None
+            #x_cat = None #FIXME
+            x = self.tokenizer(x_num, x_cat, reuse_output=True)
         else:
-            x_num = x
-            x_cat = None
-        #x_cat = None #FIXME
-        x = self.tokenizer(x_num, x_cat)
+            x = self.tokenizer(x_num, x_cat, add_category_offsets=False, reuse_output=True)
 
         for layer_idx, layer in enumerate(self.layers):
             is_last_layer = layer_idx + 1 == len(self.layers)
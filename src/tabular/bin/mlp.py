@@ -54,20 +54,22 @@ class MLP(nn.Module):
         self.dropout = dropout
         self.head = nn.Linear(d_layers[-1] if d_layers else d_in, d_out)
 
-    def forward(self, x):
-
-        if not self.categorical_indicator is None:
-            x_num = x[:, ~self.categorical_indicator].float()
-            x_cat = x[:, self.categorical_indicator].long() #TODO
-        else:
-            x_num = x
-            x_cat = None
+    def forward(self, x=None, x_num=None, x_cat=None):
+        # Either x, the mixed numerical and categorical features, or x_num and x_cat already split by
+        # utils.skorch_utils.split_numerical_categorical (with the category offsets added to x_cat)
+        if x is not None:
+            if not self.categorical_indicator is None:
+                x_num = x[:, ~self.categorical_indicator].float()
+                x_cat = x[:, self.categorical_indicator].long() + self.category_offsets[None] #TODO
+            else:
+                x_num = x
+                x_cat = None
         x = []
         if x_num is not None:
             x.append(x_num)
         if x_cat is not None:
             x.append(
-                self.category_embeddings(x_cat + self.category_offsets[None]).view(
+                self.category_embeddings(x_cat).reshape(
                     x_cat.size(0), -1
                 )
             )
@@ -401,6 +401,7 @@ def is_oom_exception(err: RuntimeError) -> bool:
             'CUDA out of memory',
             'CUBLAS_STATUS_ALLOC_FAILED',
             'CUDA error: out of memory',
+            "DefaultCPUAllocator: can't allocate memory",
         ]
     )
 
@@ -30,20 +30,18 @@ def generate_random_tree(x, n_classes, depth, split_distribution="uniform", spli
             leaf.set_prediction(prediction)
             return leaf
         else:
-            x_median = np.quantile(x, 0.5, axis=0)
-            x_25 = np.quantile(x, 0.25, axis=0)
-            x_75 = np.quantile(x, 0.75, axis=0)
             n_features = x.shape[1]
 
             tree = Tree(depth, parent)
             split_feature = rng.choice(range(n_features), 1)[0]
+            # only the quantiles of the split feature are needed
+            x_25, x_median, x_75 = np.quantile(x[:, split_feature], [0.25, 0.5, 0.75])
             # we want to sample a split threshold depending on the variance of this feature in our data
             if split_distribution == "uniform":
                 #TODO allow split_param
-                split_threshold = rng.uniform(x_25[split_feature],
-                                                    x_75[split_feature])
+                split_threshold = rng.uniform(x_25, x_75)
             if split_distribution == "gaussian":
-                split_threshold = rng.normal(loc=x_median[split_feature], scale=split_param * (x_75[split_feature] - x_25[split_feature]))
+                split_threshold = rng.normal(loc=x_median, scale=split_param * (x_75 - x_25))
 
             tree.set_split(split_feature, split_threshold)
             if depth == 2: #make sure two adjacent leaves have different predictions
@@ -188,45 +186,99 @@ def last_column_as_target(x):
     y = x[:,-1]
     return y > np.median(y)
 
-def periodic_sinus(x, period=None, offset=None, period_size=None, noise=True, rng=None):
-    #offset = offset * 2
+def _as_column(x):
+    # the periodic functions take a single feature, as a (n_samples,) or (n_samples, 1) array
+    x = np.asarray(x)
+    return x.reshape(x.shape[0], 1)
+
+
+def _as_variants(*params):
+    # parameters of the batched functions: None, or scalars / lists broadcast together, one value per variant
+    return [None if param is None else np.atleast_1d(np.asarray(param, dtype=np.float64)) for param in params]
+
+
+def _as_loop_dtype(x):
+    # the original loops computed x[i] op python float, which is float64 with numpy<2 (scalars are upcast)
+    # but stays in the dtype of x with numpy>=2
+    x = np.asarray(x)
+    return x.astype((x.dtype.type(1) * 1.).dtype, copy=False)
+
+
+def _like(param, x):
+    # the parameters used to be python scalars, which don't upcast x
+    return np.asarray(param).astype(x.dtype)
+
+
+def periodic_sinus_kernel(x, period, offset):
+    """
+    Noiseless periodic sinus, 0 outside of [-2 + offset, 2 - offset]
+    x, period and offset are broadcast together.
+    """
+    x = _as_loop_dtype(x)
+    res = np.sin(x * (2 * np.pi) / _like(4 - 2 * offset, x) * _like(period, x))
+    return np.where((x < _like(-2 + offset, x)) | (x > _like(2 - offset, x)), 0, res).astype(np.float64)
+
+
+def periodic_triangle_kernel(x, offset, period_size):
+    """
+    Noiseless periodic triangle, 0 outside of [-2 + offset, 2 - offset]
+    x, offset and period_size are broadcast together.
+    """
+    x = _as_loop_dtype(x)
+    abs_x = np.abs(x) / _like(period_size, x)
+    # abs_x >= 0, so floor is the same as the int() truncation of the original per-sample implementation
+    res = 2 * np.abs(abs_x - np.floor(abs_x + 1/2))
+    return np.where((x < _like(-2 + offset, x)) | (x > _like(2 - offset, x)), 0, res).astype(np.float64)
+
+
+def periodic_sinus_batch(x, period=None, offset=None, period_size=None, noise=True, rng=None):
+    """
+    Compute periodic_sinus for several (period, offset, period_size) variants in one call.
+    The parameters can be scalars or lists, broadcast together.
+    :return: array of shape (n_samples, n_variants), column j being what periodic_sinus returns for the j-th
+    variant (including the noise, if the variants are computed in order with the same rng)
+    """
+    x = _as_column(x)
+    period, offset, period_size = _as_variants(period, offset, period_size)
     if not period_size is None:
         if not period is None:
             offset = (4 - period_size * period) / 2
         elif not offset is None:
             period = (4 - offset * 2) / period_size
-    res = np.zeros(x.shape[0])
-    for i in range(x.shape[0]):
-        if x[i] < -2 + offset or x[i] > 2 - offset:
-            res[i] = 0
-        else:
-            res[i] = np.sin(x[i] * (2 * np.pi) / (4 - 2 * offset) * period)
-    #res = np.sin(x.reshape(-1) * np.pi / period).astype(np.float32)
+    period, offset = np.broadcast_arrays(period, offset)
+    res = periodic_sinus_kernel(x, period, offset)
     if noise:
-        res += rng.normal(0, 0.1, x.shape[0])
+        res += rng.normal(0, 0.1, (res.shape[1], res.shape[0])).T
     return res
 
-def periodic_triangle(x, n_periods=None, offset=None, period_size=None, noise=True, rng=None):
+
+def periodic_triangle_batch(x, n_periods=None, offset=None, period_size=None, noise=True, rng=None):
+    """
+    Compute periodic_triangle for several (n_periods, offset, period_size) variants in one call.
+    The parameters can be scalars or lists, broadcast together.
+    :return: array of shape (n_samples, n_variants), column j being what periodic_triangle returns for the j-th
+    variant (including the noise, if the variants are computed in order with the same rng)
+    """
     # TAKE INTO INPUT A UNIFORM(-2, 2) (I think)
+    x = _as_column(x)
     assert (x <= 2).all()
     assert (x >= -2).all()
-    #offset = offset * 2
-    if not period_size is None:
-        if not n_periods is None:
-            offset = (4 - period_size * n_periods) / 2
-        elif not offset is None:
-            period = (4 - offset * 2) / period_size
-    res = np.zeros(x.shape[0])
-    for i in range(x.shape[0]):
-        if x[i] < -2 + offset or x[i] > 2 - offset:
-            res[i] = 0
-        else:
-            res[i] = 2 * np.abs(np.abs(x[i]) / period_size - int(np.abs(x[i]) / period_size + 1/2))
-            #res[i] = np.sin(x[i] * (2 * np.pi) / (4 - 2 * offset) * period)
-    #res = np.sin(x.reshape(-1) * np.pi / period).astype(np.float32)
+    n_periods, offset, period_size = _as_variants(n_periods, offset, period_size)
+    if not period_size is None and not n_periods is None:
+        offset = (4 - period_size * n_periods) / 2
+    offset, period_size = np.broadcast_arrays(offset, period_size)
+    res = periodic_triangle_kernel(x, offset, period_size)
     if noise:
-        res += rng.normal(0, 0.1, x.shape[0])
-    return res.reshape(-1, 1)
+        res += rng.normal(0, 0.1, (res.shape[1], res.shape[0])).T
+    return res
+
+
+def periodic_sinus(x, period=None, offset=None, period_size=None, noise=True, rng=None):
+    return periodic_sinus_batch(x, period, offset, period_size, noise, rng)[:, 0]
+
+
+def periodic_triangle(x, n_periods=None, offset=None, period_size=None, noise=True, rng=None):
+    return periodic_triangle_batch(x, n_periods, offset, period_size, noise, rng)
 
 
 
@@ -1,120 +1,147 @@
+import contextlib
 import numpy as np
 from create_models import create_model
+from utils.preprocessing_cache import CachedTransformer, CachedTransformedTargetRegressor, get_cache_params
 import os
+import uuid
 from sklearn.compose import TransformedTargetRegressor
 from sklearn.preprocessing import QuantileTransformer, OneHotEncoder
-from sklearn.metrics import r2_score, mean_squared_error
+from sklearn.metrics import r2_score, mean_squared_error, log_loss, roc_auc_score
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
 
 
 
-def skorch_evaluation(model, x_train, x_val, x_test, y_train, y_val, y_test, config, model_id, return_r2):
+def get_skorch_net(model, config):
+    if "regression" in config.keys() and config["regression"] and config["transformed_target"]:
+        # TransformedTargetRegressor
+        return model.regressor_
+    return model
+
+
+def load_best_checkpoint(model, config):
     """
-    Evaluate the model
+    Load the weights of the best epoch kept by the BestStateCheckpoint callback
     """
-    y_hat_train = model.predict(x_train)
-    if x_val is not None:
-        y_hat_val = model.predict(x_val)
-    y_hat_test = model.predict(x_test)
+    from utils.skorch_utils import get_best_state_checkpoint  # only imported by skorch runs
+    net = get_skorch_net(model, config)
+    checkpoint = get_best_state_checkpoint(net)
+    if checkpoint is not None and checkpoint.load_best(net):
+        print("Using checkpoint (epoch {})".format(checkpoint.best_epoch_))
 
-    if "regression" in config.keys() and config["regression"]:
-        if return_r2:
-            print(np.any(np.isnan(y_hat_train)))
-            train_score = r2_score(y_train.reshape(-1), y_hat_train.reshape(-1))
-        else:
-            train_score = np.sqrt(np.mean((y_hat_train.reshape(-1) - y_train.reshape(-1)) ** 2))
-    else:
-        train_score = np.sum((y_hat_train == y_train)) / len(y_train)
 
-    if "model__use_checkpoints" in config.keys() and config["model__use_checkpoints"]:
-        if not config["regression"]:
-            print("Using checkpoint")
-            model.load_params(r"skorch_cp/params_{}.pt".format(model_id))
-        else:
-            #TransformedTargetRegressor
-            if config["transformed_target"]:
-                model.regressor_.load_params(r"skorch_cp/params_{}.pt".format(model_id))
-            else:
-                model.load_params(r"skorch_cp/params_{}.pt".format(model_id))
+def remove_best_checkpoint(model, config):
+    from utils.skorch_utils import get_best_state_checkpoint
+    checkpoint = get_best_state_checkpoint(get_skorch_net(model, config))
+    if checkpoint is not None:
+        checkpoint.cleanup()
 
-    if x_val is not None:
-        if "regression" in config.keys() and config["regression"]:
-            if return_r2:
-                val_score = r2_score(y_val.reshape(-1), y_hat_val.reshape(-1))
-            else:
-                val_score = np.sqrt(np.mean((y_hat_val.reshape(-1) - y_val.reshape(-1)) ** 2))
-        else:
-            val_score = np.sum((y_hat_val == y_val)) / len(y_val)
-    else:
-        val_score = None
 
+def predict_split(fitted_model, x, config):
+    """
+    Predict a split once
+    :return: (y_hat, probabilities), probabilities being None for regression
+    or if the model doesn't have a predict_proba method
+    """
     if "regression" in config.keys() and config["regression"]:
-        if return_r2:
-            test_score = r2_score(y_test.reshape(-1), y_hat_test.reshape(-1))
-        else:
-            test_score = np.sqrt(np.mean((y_hat_test.reshape(-1) - y_test.reshape(-1)) ** 2))
+        return fitted_model.predict(x), None
+    if not hasattr(fitted_model, "predict_proba"):
+        return fitted_model.predict(x), None
+    if config["model_type"] == "tab_survey":
+        # TabSurvey models keep the probabilities computed by predict (some of them preprocess x in predict only)
+        y_hat = fitted_model.predict(x)
+        return y_hat, fitted_model.prediction_probabilities
+    proba = fitted_model.predict_proba(x)
+    if config["model_type"] == "sklearn":
+        y_hat = fitted_model.classes_[np.argmax(proba, axis=1)]
     else:
-        test_score = np.sum((y_hat_test == y_test)) / len(y_test)
+        # skorch classifiers predict the argmax of the probabilities
+        y_hat = np.argmax(proba, axis=1)
+    return y_hat, proba
+
 
-    if "model__use_checkpoints" in config.keys() and config["model__use_checkpoints"] and not return_r2:
+def compute_metrics(y, y_hat, proba, regression):
+    """
+    Compute all the metrics of a split from its predictions
+    :return: dictionary with rmse and r2 for regression, accuracy, log_loss and auc for classification
+    """
+    if regression:
+        y, y_hat = y.reshape(-1), y_hat.reshape(-1)
+        metrics = {"rmse": np.sqrt(np.mean((y_hat - y) ** 2))}
         try:
-            os.remove(r"skorch_cp/params_{}.pt".format(model_id))
+            metrics["r2"] = r2_score(y, y_hat)
         except:
-            print("could not remove params file")
-            pass
-
-
+            print("R2 score cannot be computed")
+            metrics["r2"] = np.nan
+        return metrics
+    metrics = {"accuracy": np.sum((y_hat == y)) / len(y), "log_loss": np.nan, "auc": np.nan}
+    if proba is not None:
+        labels = np.arange(proba.shape[1])
+        try:
+            metrics["log_loss"] = log_loss(y, proba, labels=labels)
+        except:
+            print("Log loss cannot be computed")
+        try:
+            if proba.shape[1] == 2:
+                metrics["auc"] = roc_auc_score(y, proba[:, 1])
+            else:
+                metrics["auc"] = roc_auc_score(y, proba, multi_class="ovr", labels=labels)
+        except:
+            print("AUC cannot be computed")
+    return metrics
 
-    return train_score, val_score, test_score
 
-def sklearn_evaluation(fitted_model, x_train, x_val, x_test, y_train, y_val, y_test, config, return_r2):
+def evaluate_model_metrics(fitted_model, x_train, y_train, x_val, y_val, x_test, y_test, config,
+                           remove_checkpoint=True):
     """
-    Evaluate a fitted model from sklearn
+    Evaluate the model on each split. For skorch models using checkpoints, the best weights are loaded first.
+    Each split is predicted once and all the metrics are computed from these predictions.
+    :param remove_checkpoint: free the best state (and remove its file) once it has been loaded
+    :return: {"train": metrics, "val": metrics (None if x_val is None), "test": metrics}
     """
-    y_hat_train = fitted_model.predict(x_train)
-    y_hat_val = fitted_model.predict(x_val)
-    y_hat_test = fitted_model.predict(x_test)
+    regression = "regression" in config.keys() and config["regression"]
+    use_checkpoints = config["model_type"] == "skorch" and "model__use_checkpoints" in config.keys() \
+                      and config["model__use_checkpoints"]
+    if use_checkpoints:
+        load_best_checkpoint(fitted_model, config)
+        if remove_checkpoint:
+            remove_best_checkpoint(fitted_model, config)
 
-    if "regression" in config.keys() and config["regression"]:
-        if return_r2:
-            train_score = r2_score(y_train.reshape(-1), y_hat_train.reshape(-1))
-        else:
-            train_score = np.sqrt(np.mean((y_hat_train.reshape(-1) - y_train.reshape(-1)) ** 2))
-    else:
-        train_score = np.sum((y_hat_train == y_train)) / len(y_train)
-
-    if "regression" in config.keys() and config["regression"]:
-        if return_r2:
-            val_score = r2_score(y_val.reshape(-1), y_hat_val.reshape(-1))
-        else:
-            val_score = np.sqrt(np.mean((y_hat_val.reshape(-1) - y_val.reshape(-1)) ** 2))
+    if config["model_type"] == "sklearn":
+        inference_context = contextlib.nullcontext()
     else:
-        val_score = np.sum((y_hat_val == y_val)) / len(y_val)
-
+        import torch  # not imported by the sklearn runs
+        inference_context = torch.inference_mode()
+    metrics = {}
+    with inference_context:
+        for split, x, y in [("train", x_train, y_train), ("val", x_val, y_val), ("test", x_test, y_test)]:
+            if x is None:
+                metrics[split] = None
+                continue
+            y_hat, proba = predict_split(fitted_model, x, config)
+            metrics[split] = compute_metrics(y, y_hat, proba, regression)
+    return metrics
+
+
+def evaluate_model(fitted_model, x_train, y_train, x_val, y_val, x_test, y_test, config, return_r2=False):
+    """
+    Evaluate the model
+    :return: train, val and test scores (accuracy for classification, RMSE or R2 if return_r2 for regression)
+    """
+    metrics = evaluate_model_metrics(fitted_model, x_train, y_train, x_val, y_val, x_test, y_test, config)
     if "regression" in config.keys() and config["regression"]:
-        if return_r2:
-            test_score = r2_score(y_test.reshape(-1), y_hat_test.reshape(-1))
-        else:
-            test_score = np.sqrt(np.mean((y_hat_test.reshape(-1) - y_test.reshape(-1)) ** 2))
+        metric = "r2" if return_r2 else "rmse"
     else:
-        test_score = np.sum((y_hat_test == y_test)) / len(y_test)
-
-    return train_score, val_score, test_score
+        metric = "accuracy"
+    return tuple(metrics[split][metric] if metrics[split] is not None else None
+                 for split in ["train", "val", "test"])
 
-def evaluate_model(fitted_model, x_train, y_train, x_val, y_val, x_test, y_test, config, model_id=None, return_r2=False):
+def get_model_id(iter):
     """
-    Evaluate the model
+    Id of a trained model, unique across concurrent runs and processes (unlike a hash of the config keys)
     """
+    return "{}_{}".format(iter, uuid.uuid4().hex)
 
-    if config["model_type"] == "sklearn":
-        train_score, val_score, test_score = sklearn_evaluation(fitted_model, x_train, x_val, x_test, y_train, y_val, y_test, config, return_r2=return_r2)
-    elif config["model_type"] == "skorch":
-        train_score, val_score, test_score = skorch_evaluation(fitted_model, x_train, x_val, x_test, y_train, y_val, y_test, config, model_id, return_r2=return_r2)
-    elif config["model_type"] == "tab_survey":
-        train_score, val_score, test_score = sklearn_evaluation(fitted_model, x_train, x_val, x_test, y_train, y_val, y_test, config, return_r2=return_r2)
-
-    return train_score, val_score, test_score
 
 def train_model(iter, x_train, y_train, categorical_indicator, config):
     """
@@ -122,18 +149,26 @@ def train_model(iter, x_train, y_train, categorical_indicator, config):
     """
     print("Training")
     if config["model_type"] == "skorch":
-        id = hash(".".join(list(config.keys())) + "." + str(iter)) # uniquely identify the run (useful for checkpointing)
+        id = get_model_id(iter) # uniquely identify the run (useful for checkpointing)
         model_raw = create_model(config, categorical_indicator, id=id)  # TODO rng ??
     elif config["model_type"] == "sklearn":
         id = None
         model_raw = create_model(config, categorical_indicator)
     elif config["model_type"] == "tab_survey":
-        id = hash(".".join(list(config.keys())) + "." + str(iter)) # uniquely identify the run (useful for checkpointing)
+        id = get_model_id(iter) # uniquely identify the run (useful for checkpointing)
         model_raw = create_model(config, categorical_indicator, num_features=x_train.shape[1], id=id,
                                  cat_dims=list((x_train[:, categorical_indicator].max(0) + 1).astype(int)))
 
+    # If "preprocessing_cache_dir" is in the config, the fitted preprocessors and their outputs on the training
+    # data are cached on disk, so that the runs of a sweep on the same splits don't refit them
+    cache_dir, max_size = get_cache_params(config)
+
     if config["regression"] and config["transformed_target"]:
-        model = TransformedTargetRegressor(model_raw, transformer=QuantileTransformer(output_distribution="normal"))
+        if cache_dir is not None:
+            model = CachedTransformedTargetRegressor(model_raw, transformer=QuantileTransformer(output_distribution="normal"),
+                                                     cache_dir=cache_dir, max_size=max_size)
+        else:
+            model = TransformedTargetRegressor(model_raw, transformer=QuantileTransformer(output_distribution="normal"))
     else:
         model = model_raw
 
@@ -142,6 +177,8 @@ def train_model(iter, x_train, y_train, categorical_indicator, config):
                                            [i for i in range(x_train.shape[1]) if categorical_indicator[i]]),
                                           ("numerical", "passthrough",
                                            [i for i in range(x_train.shape[1]) if not categorical_indicator[i]])])
+        if cache_dir is not None:
+            preprocessor = CachedTransformer(preprocessor, cache_dir, max_size=max_size)
         model = Pipeline(steps=[("preprocessor", preprocessor), ("model", model)])
 
 
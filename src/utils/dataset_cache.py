@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+
+# On-disk cache for the outputs of generate_dataset_pipeline.generate_dataset.
+# Each entry is a directory named after a hash of everything that determines the dataset
+# (data__*, target__*, transform__* and split keys + the state of the rng when generation starts),
+# containing one .npy file per array (so it can be memory-mapped) and a meta.json sidecar.
+
+ARRAY_NAMES = ["x_train", "x_val", "x_test", "y_train", "y_val", "y_test"]
+SPLIT_KEYS = ["train_prop", "val_test_prop", "max_train_samples", "max_val_samples", "max_test_samples"]
+CACHE_VERSION = 1
+
+
+def get_cache_key(config, rng):
+    """
+    Hash the part of the config which determines the generated dataset, together with the rng state
+    :param config: run config (dict or wandb config)
+    :param rng: np.random.RandomState used for the generation, before it is used
+    :return: hex digest identifying the dataset
+    """
+    relevant_config = {"cache_version": CACHE_VERSION}
+    for key in config.keys():
+        if key.startswith("data__") or key.startswith("target__") or key.startswith("transform__") \
+                or key in SPLIT_KEYS:
+            relevant_config[key] = config[key]
+    h = hashlib.sha256()
+    h.update(json.dumps(relevant_config, sort_keys=True, default=str).encode())
+    _, keys, pos, has_gauss, cached_gaussian = rng.get_state()
+    h.update(keys.tobytes())
+    h.update(json.dumps([int(pos), int(has_gauss), float(cached_gaussian)]).encode())
+    return h.hexdigest()
+
+
+def load_from_cache(cache_dir, key, rng=None):
+    """
+    Load a cached dataset, memory-mapping the arrays
+    :param rng: if given, its state is set to the state it had after the original generation,
+    so that the rest of the run is identical with or without the cache
+    :return: (x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator) or None if not cached
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    meta_path = os.path.join(entry_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        # copy-on-write mapping: pages are shared between processes, and in-place
+        # modifications downstream never reach the file
+        arrays = [np.load(os.path.join(entry_dir, name + ".npy"), mmap_mode="c") for name in ARRAY_NAMES]
+        if meta["has_categorical_indicator"]:
+            categorical_indicator = np.load(os.path.join(entry_dir, "categorical_indicator.npy"))
+        else:
+            categorical_indicator = None
+        if rng is not None:
+            rng_keys = np.load(os.path.join(entry_dir, "rng_keys.npy"))
+            pos, has_gauss, cached_gaussian = meta["rng_state"]
+            rng.set_state(("MT19937", rng_keys, pos, has_gauss, cached_gaussian))
+    except (OSError, ValueError, KeyError):
+        # entry being evicted or corrupted, treat it as a miss
+        print("Could not read dataset cache entry {}".format(key))
+        return None
+    os.utime(entry_dir)  # used for LRU eviction
+    print("Loaded dataset from cache ({})".format(key))
+    return (*arrays, categorical_indicator)
+
+
+def save_to_cache(cache_dir, key, dataset, rng=None, max_size=None):
+    """
+    Save a generated dataset to the cache, then evict the least recently used entries
+    if the cache is bigger than max_size
+    :param dataset: (x_train, x_val, x_test, y_train, y_val, y_test, categorical_indicator)
+    :param rng: rng after the generation, its state is stored to be restored on cache hits
+    :param max_size: maximum size of the cache in bytes (None for no limit)
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.exists(entry_dir):
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    # write in a temporary directory then rename, so that concurrent runs never see partial entries
+    tmp_dir = os.path.join(cache_dir, ".tmp_{}_{}".format(key, uuid.uuid4().hex))
+    os.makedirs(tmp_dir)
+    *arrays, categorical_indicator = dataset
+    meta = {"has_categorical_indicator": categorical_indicator is not None,
+            "shapes": {},
+            "dtypes": {}}
+    for name, array in zip(ARRAY_NAMES, arrays):
+        array = np.ascontiguousarray(array)
+        np.save(os.path.join(tmp_dir, name + ".npy"), array)
+        meta["shapes"][name] = list(array.shape)
+        meta["dtypes"][name] = str(array.dtype)
+    if categorical_indicator is not None:
+        np.save(os.path.join(tmp_dir, "categorical_indicator.npy"), np.asarray(categorical_indicator))
+    if rng is not None:
+        _, rng_keys, pos, has_gauss, cached_gaussian = rng.get_state()
+        np.save(os.path.join(tmp_dir, "rng_keys.npy"), rng_keys)
+        meta["rng_state"] = [int(pos), int(has_gauss), float(cached_gaussian)]
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:  # another run saved the same dataset in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if max_size is not None:
+        evict(cache_dir, max_size, keep=key)
+
+
+def get_entry_size(entry_dir):
+    return sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+
+
+def evict(cache_dir, max_size, keep=None):
+    """
+    Remove the least recently used entries until the cache is smaller than max_size bytes
+    :param keep: key of an entry which should never be removed (e.g the one we just wrote)
+    """
+    clear_stale_tmp_dirs(cache_dir)
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, name)
+        if name.startswith(".tmp_") or not os.path.isdir(entry_dir):
+            continue
+        try:
+            entries.append((os.path.getmtime(entry_dir), get_entry_size(entry_dir), name))
+        except OSError:  # removed by another process
+            continue
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total_size <= max_size:
+            break
+        if name == keep:
+            continue
+        print("Evicting dataset {} from cache".format(name))
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        total_size -= size
+
+
+def clear_stale_tmp_dirs(cache_dir, max_age=3600):
+    """Remove temporary directories left by crashed runs"""
+    if not os.path.isdir(cache_dir):
+        return
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(".tmp_") and now - os.path.getmtime(path) > max_age:
+            shutil.rmtree(path, ignore_errors=True)
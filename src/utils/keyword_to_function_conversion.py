@@ -1,71 +1,45 @@
-from target_function_classif import *
-from generate_data import *
-from data_transforms import *
-from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor, GradientBoostingClassifier, GradientBoostingRegressor, HistGradientBoostingRegressor, HistGradientBoostingClassifier
-from xgboost import XGBClassifier, XGBRegressor
-from skorch_models import create_resnet_skorch, create_ft_transformer_skorch, create_rtdl_mlp_skorch#, create_NPT_skorch
-from skorch_models_regression import create_resnet_regressor_skorch, create_ft_transformer_regressor_skorch, create_rtdl_mlp_regressor_skorch
-from rotation_forest import RotationForestClassifier
-from TabSurvey.models.saint import SAINT
+import importlib
+
+# keyword -> (module, name) of the function or class it refers to.
+# The modules are only imported on first use (like TabSurvey.models.str2model), so that a run only pays
+# for the backends it needs (e.g a random forest run doesn't import torch, skorch or xgboost).
+KEYWORDS = {
+    # "npt": ("skorch_models", "create_NPT_skorch"),
+    "rotation_forest": ("rotation_forest", "RotationForestClassifier"),
+    "rtdl_mlp": ("skorch_models", "create_rtdl_mlp_skorch"),
+    "rtdl_mlp_regressor": ("skorch_models_regression", "create_rtdl_mlp_regressor_skorch"),
+    "ft_transformer": ("skorch_models", "create_ft_transformer_skorch"),
+    "ft_transformer_regressor": ("skorch_models_regression", "create_ft_transformer_regressor_skorch"),
+    "rtdl_resnet": ("skorch_models", "create_resnet_skorch"),
+    "rtdl_resnet_regressor": ("skorch_models_regression", "create_resnet_regressor_skorch"),
+    "rf_c": ("sklearn.ensemble", "RandomForestClassifier"),
+    "rf_r": ("sklearn.ensemble", "RandomForestRegressor"),
+    "gbt_c": ("sklearn.ensemble", "GradientBoostingClassifier"),
+    "gbt_r": ("sklearn.ensemble", "GradientBoostingRegressor"),
+    "hgbt_r": ("sklearn.ensemble", "HistGradientBoostingRegressor"),
+    "hgbt_c": ("sklearn.ensemble", "HistGradientBoostingClassifier"),
+    "xgb_c": ("xgboost", "XGBClassifier"),
+    "xgb_r": ("xgboost", "XGBRegressor"),
+    "saint": ("TabSurvey.models.saint", "SAINT"),
+    "uniform_data": ("generate_data", "generate_uniform_data"),
+    "periodic_triangle": ("target_function_classif", "periodic_triangle"),
+    "real_data": ("generate_data", "import_real_data"),
+    "gaussienize": ("data_transforms", "gaussienize"),
+    "select_features_rf": ("data_transforms", "select_features_rf"),
+    "remove_features_rf": ("data_transforms", "remove_features_rf"),
+    "remove_useless_features": ("data_transforms", "remove_useless_features"),
+    "add_uninformative_features": ("data_transforms", "add_uninformative_features"),
+    "random_rotation": ("data_transforms", "apply_random_rotation"),
+    "remove_high_frequency_from_train": ("data_transforms", "remove_high_frequency_from_train"),
+    "no_transform": None,
+}
 
 
 def convert_keyword_to_function(keyword):
     print(keyword)
-    #if keyword == "npt":
-    #    return create_NPT_skorch
-    if keyword == "rotation_forest":
-        return RotationForestClassifier
-    if keyword == "rtdl_mlp":
-        return create_rtdl_mlp_skorch
-    if keyword == 'rtdl_mlp_regressor':
-        return create_rtdl_mlp_regressor_skorch
-    if keyword == "ft_transformer":
-        return create_ft_transformer_skorch
-    if keyword == "ft_transformer_regressor":
-        return create_ft_transformer_regressor_skorch
-    if keyword == "rtdl_resnet":
-        return create_resnet_skorch
-    if keyword == "rtdl_resnet_regressor":
-        return create_resnet_regressor_skorch
-    if keyword == "rf_c":
-        return RandomForestClassifier
-    if keyword == "rf_r":
-        return RandomForestRegressor
-    if keyword == "gbt_c":
-        return GradientBoostingClassifier
-    if keyword == "gbt_r":
-        return GradientBoostingRegressor
-    if keyword == "hgbt_r":
-        return HistGradientBoostingRegressor
-    if keyword == "hgbt_c":
-        return HistGradientBoostingClassifier
-    if keyword == "xgb_c":
-        return XGBClassifier
-    if keyword == "xgb_r":
-        return XGBRegressor
-    if keyword == "saint":
-        return SAINT
-    elif keyword == "uniform_data":
-        return generate_uniform_data
-    elif keyword == "periodic_triangle":
-        return periodic_triangle
-    elif keyword == "real_data":
-        return import_real_data
-    elif keyword == "gaussienize":
-        return gaussienize
-    elif keyword == "select_features_rf":
-        return select_features_rf
-    elif keyword == "remove_features_rf":
-        return remove_features_rf
-    elif keyword == "remove_useless_features":
-        return remove_useless_features
-    elif keyword == "add_uninformative_features":
-        return add_uninformative_features
-    elif keyword == "random_rotation":
-        return apply_random_rotation
-    elif keyword == "remove_high_frequency_from_train":
-        return remove_high_frequency_from_train
-    elif keyword == "no_transform":
+    if keyword not in KEYWORDS.keys():
+        raise ValueError("Unknown keyword")
+    if KEYWORDS[keyword] is None:
         return None
-    else:
-        raise ValueError("Unknown keyword")
\ No newline at end of file
+    module_name, name = KEYWORDS[keyword]
+    return getattr(importlib.import_module(module_name), name)
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# On-disk format (".npystore" directories) for the benchmark datasets.
+# A dataset is a directory containing
+#   X.npy: float32 array stored in row-major (C) order, as its rows are gathered by
+#          generate_dataset_pipeline.take_rows: each gathered row is one contiguous read of the memory map
+#   y.npy: the target (int64 for classification, float32 for regression)
+#   meta.json: row count, number of features, categorical mask, dtypes and checksum of the arrays
+# Arrays are loaded with np.load(mmap_mode=...), so that concurrent runs on the same node share the page cache
+# instead of each unpickling its own copy.
+
+MMAP_STORE_SUFFIX = ".npystore"
+
+
+def get_mmap_store_path(pickle_path):
+    return pickle_path + MMAP_STORE_SUFFIX
+
+
+def _checksum(paths):
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 24), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def save_mmap_store(X, y, categorical_indicator, path, regression=False):
+    """
+    Save a dataset in the mmap store format
+    :param X: features, converted to float32
+    :param y: target
+    :param categorical_indicator: boolean mask of the categorical features, or None
+    :param path: directory where the dataset is saved
+    :param regression: if False, y is saved as int64, else as float32
+    """
+    os.makedirs(path, exist_ok=True)
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.ascontiguousarray(np.asarray(y), dtype=np.float32 if regression else np.int64)
+    x_path, y_path = os.path.join(path, "X.npy"), os.path.join(path, "y.npy")
+    np.save(x_path, X)
+    np.save(y_path, y)
+    meta = {"n_rows": int(X.shape[0]),
+            "n_features": int(X.shape[1]),
+            "categorical_indicator": None if categorical_indicator is None
+            else [bool(c) for c in categorical_indicator],
+            "dtypes": {"X": str(X.dtype), "y": str(y.dtype)},
+            "checksum": _checksum([x_path, y_path])}
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def load_mmap_store(path, mmap_mode="r", verify=False):
+    """
+    Load a dataset saved with save_mmap_store
+    :param mmap_mode: passed to np.load. With "r" the arrays are read-only views on the page cache.
+    :param verify: recompute the checksum of the arrays (reads the whole files)
+    :return: X, y, categorical_indicator (None if the dataset has no categorical information)
+    """
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        meta = json.load(f)
+    x_path, y_path = os.path.join(path, "X.npy"), os.path.join(path, "y.npy")
+    if verify and _checksum([x_path, y_path]) != meta["checksum"]:
+        raise ValueError("Checksum mismatch for dataset {}".format(path))
+    X = np.load(x_path, mmap_mode=mmap_mode)
+    y = np.load(y_path, mmap_mode=mmap_mode)
+    if X.shape != (meta["n_rows"], meta["n_features"]) or y.shape[0] != meta["n_rows"]:
+        raise ValueError("Shapes in {} don't match its metadata".format(path))
+    categorical_indicator = meta["categorical_indicator"]
+    if categorical_indicator is not None:
+        categorical_indicator = np.array(categorical_indicator, dtype=bool)
+    return X, y, categorical_indicator
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import warnings
+import joblib
+import numpy as np
+import scipy.sparse
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.compose import TransformedTargetRegressor
+from utils.dataset_cache import evict
+
+# On-disk store for the preprocessors fitted in train.train_model (the one-hot ColumnTransformer and the
+# QuantileTransformer of the target), which are otherwise refitted on the same training data by every run of a sweep.
+# Each entry is a directory named after a hash of the preprocessor parameters and of the data it is fitted on,
+# containing the pickled fitted preprocessor, its output on this data (.npy files, memory-mapped when loaded,
+# with the data / indices / indptr of sparse outputs) and a meta.json sidecar.
+
+CACHE_VERSION = 2
+
+
+def get_cache_params(config):
+    """
+    :return: ("preprocessing_cache_dir", maximum size in bytes) of the config, (None, None) if there is no cache
+    """
+    if "preprocessing_cache_dir" not in config.keys() or config["preprocessing_cache_dir"] is None:
+        return None, None
+    if "preprocessing_cache_max_size_gb" in config.keys() and config["preprocessing_cache_max_size_gb"] is not None:
+        return config["preprocessing_cache_dir"], int(config["preprocessing_cache_max_size_gb"] * 1e9)
+    return config["preprocessing_cache_dir"], None
+
+
+def get_fingerprint(preprocessor, X):
+    """
+    Hash the parameters of an unfitted preprocessor and the data it will be fitted on
+    :return: hex digest identifying the fitted preprocessor
+    """
+    X = np.ascontiguousarray(X)
+    h = hashlib.sha256()
+    # not repr(preprocessor), which sklearn abbreviates for long parameters (e.g lists of columns)
+    h.update(json.dumps({"cache_version": CACHE_VERSION,
+                         "preprocessor": type(preprocessor).__name__,
+                         "params": joblib.hash(preprocessor.get_params(deep=True)),
+                         "shape": list(X.shape),
+                         "dtype": str(X.dtype)}).encode())
+    h.update(X.data)
+    return h.hexdigest()
+
+
+def load_preprocessor(cache_dir, key):
+    """
+    :return: (fitted preprocessor, output on the data it was fitted on) or None if not cached
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    meta_path = os.path.join(entry_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        preprocessor = joblib.load(os.path.join(entry_dir, "preprocessor.joblib"))
+        if meta["sparse"]:
+            data, indices, indptr = (np.load(os.path.join(entry_dir, name + ".npy"), mmap_mode="c")
+                                     for name in ["data", "indices", "indptr"])
+            output = scipy.sparse.csr_matrix((data, indices, indptr), shape=tuple(meta["shape"]), copy=False)
+        else:
+            output = np.load(os.path.join(entry_dir, "output.npy"), mmap_mode="c")
+    except (OSError, ValueError, KeyError, EOFError):
+        # entry being evicted or corrupted, treat it as a miss
+        print("Could not read preprocessing cache entry {}".format(key))
+        return None
+    os.utime(entry_dir)  # used for LRU eviction
+    print("Loaded {} from cache ({})".format(type(preprocessor).__name__, key))
+    return preprocessor, output
+
+
+def save_preprocessor(cache_dir, key, preprocessor, output, max_size=None):
+    """
+    Save a fitted preprocessor and its output, then evict the least recently used entries
+    if the cache is bigger than max_size
+    :param max_size: maximum size of the cache in bytes (None for no limit)
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.exists(entry_dir):
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    # write in a temporary directory then rename, so that concurrent runs never see partial entries
+    tmp_dir = os.path.join(cache_dir, ".tmp_{}_{}".format(key, uuid.uuid4().hex))
+    os.makedirs(tmp_dir)
+    joblib.dump(preprocessor, os.path.join(tmp_dir, "preprocessor.joblib"))
+    meta = {"sparse": scipy.sparse.issparse(output), "shape": list(output.shape)}
+    if meta["sparse"]:
+        output = scipy.sparse.csr_matrix(output)
+        for name in ["data", "indices", "indptr"]:
+            np.save(os.path.join(tmp_dir, name + ".npy"), getattr(output, name))
+    else:
+        np.save(os.path.join(tmp_dir, "output.npy"), np.ascontiguousarray(output))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:  # another run saved the same preprocessor in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if max_size is not None:
+        evict(cache_dir, max_size, keep=key)
+
+
+def fit_transform_cached(preprocessor, X, cache_dir, max_size=None):
+    """
+    Fit the preprocessor on X and transform X, or load both from the cache
+    :return: (fitted clone of preprocessor, transformed X)
+    """
+    key = get_fingerprint(preprocessor, X)
+    cached = load_preprocessor(cache_dir, key)
+    if cached is not None:
+        return cached
+    fitted = clone(preprocessor)
+    output = fitted.fit_transform(X)
+    save_preprocessor(cache_dir, key, fitted, output, max_size=max_size)
+    return fitted, output
+
+
+class CachedTransformer(TransformerMixin, BaseEstimator):
+    """
+    Wrap a transformer (e.g the one-hot ColumnTransformer of train.train_model) so that fitting it
+    on data it has already been fitted on loads the fitted transformer and its output from the cache
+    """
+    def __init__(self, transformer, cache_dir, max_size=None):
+        self.transformer = transformer
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def fit(self, X, y=None):
+        self.fit_transform(X, y)
+        return self
+
+    def fit_transform(self, X, y=None):
+        self.transformer_, output = fit_transform_cached(self.transformer, X, self.cache_dir, self.max_size)
+        return output
+
+    def transform(self, X):
+        return self.transformer_.transform(X)
+
+
+class _TransformedTarget:
+    """
+    Fitted target transformer returning its cached output for the target it was fitted on, set as transformer_
+    during CachedTransformedTargetRegressor.fit
+    """
+    def __init__(self, transformer, y, output):
+        self.transformer = transformer
+        self.y = y
+        self.output = output
+
+    def transform(self, y):
+        if y is self.y:
+            return self.output
+        return self.transformer.transform(y)
+
+    def inverse_transform(self, y):
+        return self.transformer.inverse_transform(y)
+
+
+class CachedTransformedTargetRegressor(TransformedTargetRegressor):
+    """
+    TransformedTargetRegressor whose target transformer is loaded from the cache when it has already been fitted
+    on the same target
+    """
+    def __init__(self, regressor=None, *, transformer=None, func=None, inverse_func=None, check_inverse=True,
+                 cache_dir=None, max_size=None):
+        super().__init__(regressor=regressor, transformer=transformer, func=func, inverse_func=inverse_func,
+                         check_inverse=check_inverse)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _fit_transformer(self, y):
+        # called by TransformedTargetRegressor.fit after the target validation
+        if self.transformer is None or self.func is not None or self.inverse_func is not None \
+                or self.cache_dir is None:
+            super()._fit_transformer(y)
+            return
+        transformer, output = fit_transform_cached(self.transformer, y, self.cache_dir, self.max_size)
+        if self.check_inverse:
+            # as TransformedTargetRegressor._fit_transformer
+            y_sel = y[::max(1, y.shape[0] // 10)]
+            if not np.allclose(y_sel, transformer.inverse_transform(transformer.transform(y_sel))):
+                warnings.warn("The provided functions or transformer are not strictly inverse of each other. "
+                              "If you are sure you want to proceed regardless, set 'check_inverse=False'",
+                              UserWarning)
+        # the parent's fit then transforms y with transformer_, which gives the cached output
+        self.transformer_ = _TransformedTarget(transformer, y, output)
+
+    def fit(self, X, y, **fit_params):
+        # the target validation, its transformation and the fit of the regressor are done by the parent
+        try:
+            return super().fit(X, y, **fit_params)
+        finally:
+            if isinstance(getattr(self, "transformer_", None), _TransformedTarget):
+                self.transformer_ = self.transformer_.transformer
@@ -1,6 +1,14 @@
+import inspect
+import os
+import queue
+import threading
+import weakref
 import skorch
 from skorch.callbacks import WandbLogger
+from skorch.utils import to_numpy
 import numpy as np
+import torch
+from tabular.lib.deep import is_oom_exception
 
 
 class LearningRateLogger(skorch.callbacks.Callback):
@@ -11,3 +19,387 @@ class LearningRateLogger(skorch.callbacks.Callback):
             if isinstance(callback, WandbLogger):
                 callback.wandb_run.log({'log_lr': np.log10(net.optimizer_.param_groups[0]['lr'])})
 
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class BestStateCheckpoint(skorch.callbacks.Callback):
+    """
+    Replacement for the skorch Checkpoint callback, keeping a cpu copy of the module state_dict of the best epoch
+    in memory instead of writing it to disk at each improvement.
+    :param monitor: history key which is True when the epoch is the best one (as for Checkpoint)
+    :param dirname: if given, the best state is also saved (asynchronously) in this directory, for instance on
+    a local disk. The file is removed when the callback is garbage collected or cleaned up.
+    :param f_params: file name of the saved state
+    """
+    def __init__(self, monitor="valid_loss_best", dirname=None, f_params="params.pt", event_name="event_cp"):
+        self.monitor = monitor
+        self.dirname = dirname
+        self.f_params = f_params
+        self.event_name = event_name
+
+    def initialize(self):
+        self.best_state_ = None
+        self.best_epoch_ = None
+        self._spill_thread = None
+        self._finalizer = None
+        return self
+
+    @property
+    def spill_path(self):
+        if self.dirname is None:
+            return None
+        return os.path.join(self.dirname, self.f_params)
+
+    def on_epoch_end(self, net, **kwargs):
+        if not net.history[-1, self.monitor]:
+            if self.event_name is not None:
+                net.history.record(self.event_name, False)
+            return
+        self._wait_spill()
+        state = net.module_.state_dict()
+        if self.best_state_ is None:
+            self.best_state_ = {key: value.detach().to("cpu", copy=True) for key, value in state.items()}
+        else:
+            # reuse the buffers of the previous best state
+            for key, value in state.items():
+                self.best_state_[key].copy_(value.detach())
+        self.best_epoch_ = len(net.history)
+        if self.event_name is not None:
+            net.history.record(self.event_name, True)
+        if self.dirname is not None:
+            self._spill()
+
+    def on_train_end(self, net, **kwargs):
+        self._wait_spill()
+
+    def _spill(self):
+        os.makedirs(self.dirname, exist_ok=True)
+        path = self.spill_path
+        if self._finalizer is None:
+            self._finalizer = weakref.finalize(self, _remove_file, path)
+
+        def save(state):
+            tmp_path = path + ".tmp"
+            torch.save(state, tmp_path)
+            os.replace(tmp_path, path)
+
+        self._spill_thread = threading.Thread(target=save, args=(self.best_state_,), daemon=True)
+        self._spill_thread.start()
+
+    def _wait_spill(self):
+        if self._spill_thread is not None:
+            self._spill_thread.join()
+            self._spill_thread = None
+
+    def load_best(self, net):
+        """Load the best state in the module of net. Return False if no epoch has improved."""
+        if self.best_state_ is None:
+            return False
+        net.module_.load_state_dict(self.best_state_)
+        return True
+
+    def cleanup(self):
+        """Free the best state and remove its file"""
+        self._wait_spill()
+        self.best_state_ = None
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+
+
+def get_best_state_checkpoint(net):
+    """The BestStateCheckpoint of a (fitted) skorch net, or None"""
+    for _, callback in getattr(net, "callbacks_", []):
+        if isinstance(callback, BestStateCheckpoint):
+            return callback
+    return None
+
+
+def split_numerical_categorical(X, categorical_indicator, category_offsets=None):
+    """
+    Split the features once in a contiguous float32 array of numerical features and an int64 array
+    of categories, with the category offsets of the module already added
+    :param categorical_indicator: boolean mask of the categorical columns
+    :param category_offsets: offsets of each categorical column in the embedding table of the module
+    :return: a dict, whose values are passed by skorch as keyword arguments to the module forward
+    """
+    if isinstance(X, torch.Tensor):
+        X = to_numpy(X)
+    categorical_indicator = np.asarray(categorical_indicator, dtype=bool)
+    res = {"x_num": np.ascontiguousarray(X[:, ~categorical_indicator], dtype=np.float32)}
+    if categorical_indicator.any():
+        x_cat = X[:, categorical_indicator].astype(np.int64)
+        if category_offsets is not None:
+            x_cat += to_numpy(category_offsets).astype(np.int64)[None]
+        res["x_cat"] = x_cat
+    return res
+
+
+class SplitInputMixin:
+    """
+    Mixin for the skorch nets of modules with a categorical_indicator (ResNet, MLP, FT-Transformer).
+    The numerical and categorical features are split when the dataset is created, for training and
+    inference, instead of indexing each batch in the forward.
+    """
+    def get_dataset(self, X, y=None):
+        categorical_indicator = getattr(self.module_, "categorical_indicator", None)
+        if categorical_indicator is not None and isinstance(X, (np.ndarray, torch.Tensor)) and X.ndim == 2:
+            X = split_numerical_categorical(X, to_numpy(categorical_indicator),
+                                            getattr(self.module_, "category_offsets", None))
+        return super().get_dataset(X, y)
+
+
+def check_amp_compile_support(amp, compile):
+    """Raise a ValueError if amp (bfloat16 torch.autocast) or compile (torch.compile through skorch's compile
+    parameter) are requested but not supported by the installed versions"""
+    if amp and not hasattr(torch, "autocast"):
+        raise ValueError("model__amp needs torch>=1.10 (torch.autocast), found torch {}".format(torch.__version__))
+    if compile:
+        if not hasattr(torch, "compile"):
+            raise ValueError("model__compile needs torch>=2.0 (torch.compile), found torch {}".format(
+                torch.__version__))
+        if "compile" not in inspect.signature(skorch.NeuralNet.__init__).parameters:
+            raise ValueError("model__compile needs skorch>=0.15 (compile parameter), found skorch {}".format(
+                skorch.__version__))
+
+
+class AmpMixin:
+    """
+    Mixin for skorch nets adding an amp parameter: if True, the forward passes (training and inference) run
+    under torch.autocast in bfloat16, on cpu or gpu. bfloat16 has the range of float32, so no gradient scaling
+    is needed. The outputs are cast back to float32 before the loss and the predictions.
+    torch.compile is available with skorch's own compile parameter.
+    Both options raise a ValueError if the installed torch / skorch are too old.
+    """
+    def __init__(self, *args, amp=False, **kwargs):
+        check_amp_compile_support(amp, kwargs.get("compile", False))
+        super().__init__(*args, **kwargs)
+        self.amp = amp
+
+    def infer(self, x, **fit_params):
+        if not self.amp:
+            return super().infer(x, **fit_params)
+        device_type = torch.device(self.device).type if self.device is not None else "cpu"
+        with torch.autocast(device_type, dtype=torch.bfloat16):
+            y_pred = super().infer(x, **fit_params)
+        return _apply(y_pred, lambda t: t.float() if t.is_floating_point() else t)
+
+
+def _get_torch_random_state():
+    return torch.get_rng_state(), torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+
+
+def _set_torch_random_state(state):
+    torch.set_rng_state(state[0])
+    if state[1] is not None:
+        torch.cuda.set_rng_state_all(state[1])
+
+
+class VirtualBatchMixin:
+    """
+    Mixin for skorch nets catching out of memory errors in the training steps, as
+    tabular.lib.deep.train_with_auto_virtual_batch: the batch is then split in chunks of half the size
+    (until it fits), whose gradients are accumulated, so that the effective batch size is unchanged.
+    The chunk size is kept for the next batches, and recorded in the history as virtual_batch_size.
+    Modules with batch normalization compute their statistics on each chunk.
+    :param auto_virtual_batch: if False, out of memory errors are raised as usual
+    """
+    def __init__(self, *args, auto_virtual_batch=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.auto_virtual_batch = auto_virtual_batch
+
+    def initialize(self):
+        self.virtual_batch_size_ = None
+        return super().initialize()
+
+    def _train_chunks(self, Xi, yi, chunk_size, **fit_params):
+        batch_size = len(yi)
+        if chunk_size >= batch_size:
+            y_pred = self.infer(Xi, **fit_params)
+            loss = self.get_loss(y_pred, yi, X=Xi, training=True)
+            loss.backward()
+            return loss, y_pred
+        loss, y_preds = None, []
+        for start in range(0, batch_size, chunk_size):
+            indices = slice(start, start + chunk_size)
+            X_chunk, y_chunk = _index(Xi, indices), yi[indices]
+            y_pred = self.infer(X_chunk, **fit_params)
+            chunk_loss = self.get_loss(y_pred, y_chunk, X=X_chunk, training=True) * (len(y_chunk) / batch_size)
+            chunk_loss.backward()
+            loss = chunk_loss.detach() if loss is None else loss + chunk_loss.detach()
+            y_preds.append(y_pred.detach())
+        return loss, torch.cat(y_preds)
+
+    def train_step_single(self, batch, **fit_params):
+        if not self.auto_virtual_batch:
+            return super().train_step_single(batch, **fit_params)
+        self._set_training(True)
+        Xi, yi = skorch.dataset.unpack_data(batch)
+        yi = skorch.utils.to_tensor(yi, device=self.device)
+        chunk_size = self.virtual_batch_size_ or len(yi)
+        # the retries use the same random numbers (dropout...)
+        random_state = _get_torch_random_state()
+        while chunk_size:
+            try:
+                _set_torch_random_state(random_state)
+                loss, y_pred = self._train_chunks(Xi, yi, chunk_size, **fit_params)
+            except RuntimeError as err:
+                if not is_oom_exception(err):
+                    raise
+                # drop the gradients of the chunks which were done
+                self._zero_grad_optimizer()
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                chunk_size //= 2
+            else:
+                break
+        if not chunk_size:
+            raise RuntimeError('Not enough memory even for batch_size=1')
+        if chunk_size < len(yi) and chunk_size != self.virtual_batch_size_:
+            print("Out of memory with batches of {}, using chunks of {}".format(len(yi), chunk_size))
+            self.virtual_batch_size_ = chunk_size
+        if self.virtual_batch_size_ is not None:
+            self.history.record('virtual_batch_size', self.virtual_batch_size_)
+        return {'loss': loss, 'y_pred': y_pred}
+
+
+def _index(data, indices):
+    if data is None:
+        return None
+    if isinstance(data, dict):
+        return {key: _index(value, indices) for key, value in data.items()}
+    if isinstance(indices, slice):
+        return data[indices]
+    return data.index_select(0, indices)
+
+
+def _apply(data, function):
+    if data is None:
+        return None
+    if isinstance(data, dict):
+        return {key: _apply(value, function) for key, value in data.items()}
+    return function(data)
+
+
+def _dataset_to_tensors(dataset):
+    """X and y of a skorch Dataset (or a Subset of one, as created by the skorch train / valid split) as tensors"""
+    if isinstance(dataset, torch.utils.data.Subset):
+        X, y = _dataset_to_tensors(dataset.dataset)
+        indices = torch.as_tensor(np.asarray(dataset.indices), dtype=torch.int64)
+        return _index(X, indices), _index(y, indices)
+    return _apply(dataset.X, torch.as_tensor), _apply(dataset.y, torch.as_tensor)
+
+
+class TensorBatchIterator:
+    """
+    Replacement for the torch DataLoader used by skorch (iterator_train / iterator_valid), for datasets which fit
+    in memory: the whole dataset is converted to tensors once, and each batch is obtained by indexing them
+    with a slice of a permutation (as tabular.lib.deep.IndexLoader), instead of collating the samples one by one.
+    The random permutations are drawn exactly as with a DataLoader and a RandomSampler, so that training gives
+    the same results.
+    :param device: if given, the whole dataset is moved once to this device and the batches are indexed there
+    :param pin_memory: pin the batches (on the cpu) before moving them to device, for asynchronous copies
+    :param prefetch: number of batches prepared in advance in a background thread (0 to disable)
+    Other DataLoader arguments (num_workers...) are ignored.
+    """
+    def __init__(self, dataset, batch_size=1, shuffle=False, drop_last=False, device=None, pin_memory=False,
+                 prefetch=0, **kwargs):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.device = device
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.prefetch = prefetch
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def _get_tensors(self):
+        # cached on the dataset, which skorch keeps for the whole training
+        cache = getattr(self.dataset, "_batch_iterator_tensors", None)
+        if cache is None or cache[0] != self.device:
+            X, y = _dataset_to_tensors(self.dataset)
+            if self.device is not None:
+                X, y = _apply(X, lambda t: t.to(self.device)), _apply(y, lambda t: t.to(self.device))
+            cache = (self.device, X, y)
+            self.dataset._batch_iterator_tensors = cache
+        return cache[1], cache[2]
+
+    def _batches(self, X, y, order):
+        n = len(self.dataset)
+        for start in range(0, n, self.batch_size):
+            end = min(start + self.batch_size, n)
+            if self.drop_last and end - start < self.batch_size:
+                break
+            # without shuffling, the batches are views of the dataset
+            indices = slice(start, end) if order is None else order[start:end]
+            X_batch = _index(X, indices)
+            # the DataLoader uses a dummy target when there is no y
+            y_batch = torch.zeros(end - start, 1) if y is None else _index(y, indices)
+            if self.pin_memory and self.device is None:
+                X_batch, y_batch = _apply(X_batch, lambda t: t.pin_memory()), _apply(y_batch, lambda t: t.pin_memory())
+            yield X_batch, y_batch
+
+    def __iter__(self):
+        X, y = self._get_tensors()
+        # same draws from the global torch rng as DataLoader (base seed) and RandomSampler (permutation)
+        torch.empty((), dtype=torch.int64).random_()
+        order = None
+        if self.shuffle:
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+            generator = torch.Generator()
+            generator.manual_seed(seed)
+            order = torch.randperm(len(self.dataset), generator=generator)
+            if self.device is not None:
+                order = order.to(self.device)
+        batches = self._batches(X, y, order)
+        if self.prefetch:
+            return _prefetch(batches, self.prefetch)
+        return batches
+
+
+def _prefetch(iterator, n):
+    """Iterate over iterator in a background thread, keeping up to n items ready"""
+    items = queue.Queue(maxsize=n)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        # don't block forever if the consumer stopped iterating
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        put(end)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
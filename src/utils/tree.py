@@ -29,25 +29,74 @@ class Tree:
                 return self.left.predict(x)
 
 
+class ArrayTree:
+    """
+    Array representation of a Tree, to predict all the samples at once.
+    Node i splits on feature[i] at threshold[i] and has children left[i] and right[i] (-1 for leaves),
+    leaves have their prediction in value[i].
+    """
+    def __init__(self, tree):
+        features, thresholds, lefts, rights, values = [], [], [], [], []
+
+        def add_node(node):
+            node_id = len(features)
+            features.append(0)
+            thresholds.append(0.)
+            lefts.append(-1)
+            rights.append(-1)
+            values.append(0)
+            if node.predicion is not None:
+                values[node_id] = node.predicion
+            else:
+                features[node_id] = node.root_feature
+                thresholds[node_id] = node.root_threshold
+                lefts[node_id] = add_node(node.left)
+                rights[node_id] = add_node(node.right)
+            return node_id
+
+        add_node(tree)
+        self.feature = np.array(features, dtype=np.int64)
+        self.threshold = np.array(thresholds, dtype=np.float64)
+        self.left = np.array(lefts, dtype=np.int64)
+        self.right = np.array(rights, dtype=np.int64)
+        self.value = np.array(values)
+        self.is_leaf = self.left == -1
+
+    def predict(self, x):
+        #x shape (n_samples, n_features)
+        # all the samples go down the tree together, one level per iteration
+        nodes = np.zeros(x.shape[0], dtype=np.int64)
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while len(active) > 0:
+            active_nodes = nodes[active]
+            go_right = x[active, self.feature[active_nodes]] > self.threshold[active_nodes]
+            nodes[active] = np.where(go_right, self.right[active_nodes], self.left[active_nodes])
+            active = active[~self.is_leaf[nodes[active]]]
+        return self.value[nodes]
+
+
 class Forest:
     def __init__(self, tree_list, rng):
         self.tree_list = tree_list
+        self.array_trees = [ArrayTree(tree) for tree in tree_list]
         self.rng = rng
+
     def predict(self, x):
         #x shape (n_samples, n_features)
-
-        # for tree in self.tree_list:
-        #     print("depth: {}".format(tree.depth))
-        #     print("split {}".format(tree.root_threshold))#
-        #
-        #     sum = 0
-        #     for sample in x:
-        #         sum += tree.predict(sample)
-        #     print(sum)
-        predictions = []
-        for sample in x: #TODO vectorize ?
-            values, counts = np.unique([tree.predict(sample) for tree in self.tree_list], return_counts=True)
-            indices_max = np.argwhere(counts == np.amax(counts)).flatten()
-            prediction = self.rng.choice(values[indices_max], 1)[0]
-            predictions.append(prediction)
-        return np.array(predictions)
\ No newline at end of file
+        x = np.asarray(x)
+        tree_predictions = np.stack([tree.predict(x) for tree in self.array_trees])  # (n_trees, n_samples)
+        values = np.unique(tree_predictions)
+        counts = np.stack([(tree_predictions == value).sum(axis=0) for value in values], axis=1)  # (n_samples, n_values)
+        is_max = counts == counts.max(axis=1, keepdims=True)
+        # Ties are broken at random among the most common values. This draws exactly what
+        # rng.choice(values[indices_max], 1) drew for each sample in the previous per-sample loop
+        # (one randint per sample, in order, and no draw when there is no tie), so the labels don't depend
+        # on which implementation generated them.
+        n_max = is_max.sum(axis=1)
+        choice = np.zeros(x.shape[0], dtype=np.int64)
+        ties = np.flatnonzero(n_max > 1)
+        if len(ties) > 0:
+            choice[ties] = self.rng.randint(0, n_max[ties])
+        # index of the (choice + 1)-th most common value of each sample
+        chosen = np.argmax(np.cumsum(is_max, axis=1) > choice.reshape(-1, 1), axis=1)
+        return values[chosen]
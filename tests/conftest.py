@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules of src import each other as top-level modules (e.g "from train import ..."),
+# as when the scripts are run from the src folder
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, os.path.abspath(SRC_DIR))
+os.environ.setdefault("PROJECT_DIR", os.path.abspath(os.path.join(SRC_DIR, "..")))
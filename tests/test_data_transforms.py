@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from scipy.stats import multivariate_normal
+from sklearn.covariance import EmpiricalCovariance
+from data_transforms import add_uninformative_features, remove_high_frequency_from_train, remove_useless_features
+
+
+def legacy_smoothing(x_train, y_train, cov_mult):
+    # per-row loop of remove_high_frequency_from_train before its vectorization (classic covariance)
+    empirical_cov = cov_mult * EmpiricalCovariance().fit(x_train).covariance_
+    y_train_new = np.zeros(y_train.shape)
+    for i in range(x_train.shape[0]):
+        gaussian_densities = multivariate_normal(mean=x_train[i], cov=empirical_cov).pdf(x_train)
+        y_train_new[i] = np.dot(y_train, gaussian_densities) / np.sum(gaussian_densities)
+    return y_train_new
+
+
+def get_smoothing_data(n=300):
+    rng = np.random.RandomState(0)
+    # correlated features, so that the whitening matters
+    x = rng.randn(n, 3) @ np.array([[1., 0.5, 0.], [0., 1., 0.3], [0., 0., 2.]])
+    return x, np.sin(3 * x[:, 0]) + x[:, 1] > 0
+
+
+@pytest.mark.parametrize("approximate,block_size", [(False, None), (False, 7), (True, None)])
+@pytest.mark.parametrize("cov_mult", [0.01, 0.1])
+def test_gaussian_smoothing_matches_loop(approximate, block_size, cov_mult):
+    x, y = get_smoothing_data()
+    expected = legacy_smoothing(x, y.astype(np.float64), cov_mult)
+    _, _, _, y_smooth, _, _ = remove_high_frequency_from_train(x, x, x, y.astype(np.float64), y, y,
+                                                                cov_mult=cov_mult, classif=False,
+                                                                approximate=approximate, block_size=block_size)
+    # the neighbors which are left out have a kernel below kernel_tol (1e-8) and the kernels sum to at least 1,
+    # so the error is at most 1e-8 * n * max|y|
+    np.testing.assert_allclose(y_smooth, expected, rtol=1e-10, atol=1e-8 * len(x) if approximate else 1e-12)
+    _, _, _, labels, _, _ = remove_high_frequency_from_train(x, x, x, y, y, y, cov_mult=cov_mult,
+                                                              approximate=approximate, block_size=block_size)
+    np.testing.assert_array_equal(labels, (expected > 0.5).astype(int))
+
+
+@pytest.mark.parametrize("search,n_jobs", [("binary", 1), ("galloping", 1), ("binary", 2), ("galloping", 2)])
+def test_search_removes_the_same_features_as_linear(search, n_jobs):
+    # monotone case: the target only depends on 2 of the 6 features, so removing the noise features (the least
+    # important ones) keeps the accuracy, and removing any informative feature decreases it a lot
+    rng = np.random.RandomState(0)
+    x = rng.randn(400, 6)
+    informative = [1, 4]
+    y = (x[:, 1] + x[:, 4] > 0).astype(int)
+    splits = [x[:200], x[200:300], x[300:]]
+    ys = [y[:200], y[200:300], y[300:]]
+    expected = remove_useless_features(*splits, *ys, max_rel_decrease=0.05, rng=np.random.RandomState(0))
+    assert expected[0].shape[1] == len(informative)
+    np.testing.assert_array_equal(expected[0], splits[0][:, informative])
+    output = remove_useless_features(*splits, *ys, max_rel_decrease=0.05, rng=np.random.RandomState(0),
+                                     search=search, n_jobs=n_jobs)
+    for array, expected_array in zip(output, expected):
+        np.testing.assert_array_equal(array, expected_array)
+
+
+def legacy_add_uninformative_features(x_train, x_val, x_test, multiplier, rng):
+    # add_uninformative_features before the statistics were computed once
+    num_uninformatives = int((multiplier - 1) * x_train.shape[1])
+    num_samples_train, num_features = x_train.shape
+    cols_to_imitate = rng.choice(range(num_features), num_uninformatives)
+    outputs = []
+    for x in [x_train, x_val, x_test]:
+        new_features = rng.multivariate_normal(mean=np.mean(x_train, axis=0)[cols_to_imitate],
+                                               cov=np.diag(((np.quantile(x_train, 0.75, axis=0) -
+                                                             np.quantile(x_train, 0.25, axis=0))[
+                                                                cols_to_imitate] / 1.349) ** 2),
+                                               size=x.shape[0])
+        outputs.append(np.concatenate((x, new_features), axis=1))
+    return outputs
+
+
+def get_uninformative_data(dtype, n=200):
+    rng = np.random.RandomState(0)
+    x = (rng.randn(n, 5) * [1, 2, 0.5, 3, 1] + [0, 1, -2, 5, 10]).astype(dtype)
+    return x[:n // 2], x[n // 2:3 * n // 4], x[3 * n // 4:]
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("multiplier", [2, 2.6])
+def test_uninformative_features_match_legacy(dtype, multiplier):
+    xs = get_uninformative_data(dtype)
+    ys = [np.zeros(len(x)) for x in xs]
+    rng = np.random.RandomState(0)
+    outputs = add_uninformative_features(*xs, *ys, multiplier=multiplier, rng=rng, legacy_rng=True)
+    next_draws = rng.random_sample(3)
+    rng = np.random.RandomState(0)
+    expected = legacy_add_uninformative_features(*xs, multiplier=multiplier, rng=rng)
+    np.testing.assert_array_equal(rng.random_sample(3), next_draws)
+    for output, expected_output in zip(outputs[:3], expected):
+        np.testing.assert_array_equal(output, expected_output)
+        assert output.dtype == expected_output.dtype
+    for y, expected_y in zip(outputs[3:], ys):
+        assert y is expected_y
+
+
+def test_uninformative_features_without_legacy_rng():
+    xs = get_uninformative_data(np.float64, n=40000)
+    rng = np.random.RandomState(0)
+    outputs = add_uninformative_features(*xs, *[np.zeros(len(x)) for x in xs], rng=rng, legacy_rng=False)
+    cols_to_imitate = np.random.RandomState(0).choice(range(5), 5)
+    for x, output in zip(xs, outputs[:3]):
+        assert output.dtype == np.float32 and output.shape == (len(x), 10)
+        np.testing.assert_array_equal(output[:, :5], x.astype(np.float32))
+    # same mean and interquartile range as the imitated columns
+    x_train, new_features = xs[0][:, cols_to_imitate], outputs[0][:, 5:]
+    np.testing.assert_allclose(new_features.mean(axis=0), x_train.mean(axis=0), atol=0.1)
+    iqr = lambda x: np.quantile(x, 0.75, axis=0) - np.quantile(x, 0.25, axis=0)
+    np.testing.assert_allclose(iqr(new_features), iqr(x_train), rtol=0.05)
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pytest
+from utils import dataset_cache
+from utils.dataset_cache import get_cache_key, load_from_cache, save_to_cache
+
+CONFIG = {"data__method_name": "uniform_data", "data__num_samples": 100, "train_prop": 0.7}
+
+
+def generate(rng):
+    x = rng.rand(20, 3).astype(np.float32)
+    y = rng.randint(0, 2, 20)
+    return x[:10], x[10:15], x[15:], y[:10], y[10:15], y[15:], np.array([True, False, False])
+
+
+def test_cache_hit_restores_rng_state(tmp_path):
+    rng = np.random.RandomState(0)
+    key = get_cache_key(CONFIG, rng)
+    dataset = generate(rng)
+    save_to_cache(str(tmp_path), key, dataset, rng)
+    expected_next = rng.rand(5)
+
+    rng = np.random.RandomState(0)
+    assert get_cache_key(CONFIG, rng) == key
+    cached = load_from_cache(str(tmp_path), key, rng)
+    for array, cached_array in zip(dataset, cached):
+        np.testing.assert_array_equal(array, cached_array)
+    # the rng is where it would be after generating the dataset
+    np.testing.assert_array_equal(rng.rand(5), expected_next)
+
+
+def test_key_depends_on_rng_state_and_config():
+    rng = np.random.RandomState(0)
+    key = get_cache_key(CONFIG, rng)
+    assert get_cache_key(dict(CONFIG, train_prop=0.8), np.random.RandomState(0)) != key
+    assert get_cache_key(dict(CONFIG, model__lr=0.1), np.random.RandomState(0)) == key
+    rng.randn(1)
+    assert get_cache_key(CONFIG, rng) != key
+
+
+def test_interrupted_write_leaves_no_entry(tmp_path, monkeypatch):
+    rng = np.random.RandomState(0)
+    key = get_cache_key(CONFIG, rng)
+    dataset = generate(rng)
+    original_save = np.save
+    n_saved = []
+
+    def failing_save(*args, **kwargs):
+        if n_saved:
+            raise OSError("disk full")
+        n_saved.append(1)
+        original_save(*args, **kwargs)
+
+    monkeypatch.setattr(dataset_cache.np, "save", failing_save)
+    with pytest.raises(OSError):
+        save_to_cache(str(tmp_path), key, dataset, rng)
+    monkeypatch.setattr(dataset_cache.np, "save", original_save)
+
+    # the partial write is only in a temporary directory, which is not an entry
+    assert not os.path.exists(os.path.join(str(tmp_path), key))
+    assert load_from_cache(str(tmp_path), key) is None
+    save_to_cache(str(tmp_path), key, dataset, rng)
+    assert load_from_cache(str(tmp_path), key) is not None
+
+
+def test_eviction_keeps_new_entry(tmp_path):
+    keys = []
+    for seed in range(3):
+        rng = np.random.RandomState(seed)
+        key = get_cache_key(CONFIG, rng)
+        save_to_cache(str(tmp_path), key, generate(rng), rng, max_size=1)
+        keys.append(key)
+    assert os.listdir(str(tmp_path)) == [keys[-1]]
@@ -0,0 +1,72 @@
+import importlib.util
+import os
+import sys
+import time
+import numpy as np
+import pytest
+from sklearn.model_selection import KFold, StratifiedKFold
+
+TABSURVEY_UTILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "TabSurvey", "utils")
+
+
+class Args:
+    model_name = "LinearModel"
+    dataset = "test"
+    num_splits = 4
+    shuffle = True
+    seed = 123
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def load_module(name, monkeypatch):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(TABSURVEY_UTILS_DIR, name.split(".")[-1] + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, name, module)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def fold_cache(tmp_path, monkeypatch):
+    # TabSurvey/utils is imported as utils when running TabSurvey, which is src/utils in the tests
+    load_module("utils.io_utils", monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    return load_module("utils.fold_cache", monkeypatch)
+
+
+def get_data(n=103):
+    rng = np.random.RandomState(0)
+    return rng.randn(n, 5).astype(np.float32), rng.randint(0, 3, n)
+
+
+@pytest.mark.parametrize("objective,splitter", [("regression", KFold), ("classification", StratifiedKFold)])
+def test_materialized_folds_equal_splits(fold_cache, objective, splitter):
+    X, y = get_data()
+    args = Args(objective=objective)
+    expected = [(X[train], X[test], y[train], y[test])
+                for train, test in splitter(n_splits=4, shuffle=True, random_state=123).split(X, y)]
+    for _ in range(2):  # saved, then loaded
+        folds = fold_cache.materialize_folds(X, y, args)
+        assert len(folds) == len(expected)
+        for fold, expected_fold in zip(folds, expected):
+            for array, expected_array in zip(fold, expected_fold):
+                assert isinstance(array, np.memmap)
+                np.testing.assert_array_equal(array, expected_array)
+                assert array.dtype == expected_array.dtype
+
+
+def test_old_folds_are_evicted(fold_cache):
+    X, y = get_data()
+    folds_dir = os.path.join("output", "LinearModel", "test", "folds")
+    keys = []
+    for seed in [0, 1, 2, 3, 2, 4]:
+        args = Args(objective="regression", seed=seed, max_cached_folds=2)
+        fold_cache.materialize_folds(X, y, args)
+        keys.append(fold_cache.get_folds_key(X, y, args))
+        if seed == 3:
+            assert sorted(os.listdir(folds_dir)) == sorted(keys[2:4])
+        time.sleep(0.05)  # the directory times are coarser than the clock
+    # loading the folds of seed 2 again made them more recently used than those of seed 3
+    assert sorted(os.listdir(folds_dir)) == sorted([keys[2], keys[5]])
@@ -0,0 +1,163 @@
+import copy
+import pickle
+import threading
+import pytest
+import torch
+from tabular.bin.ft_transformer import MultiheadAttention, Tokenizer, Transformer
+
+CATEGORIES = [3, 4, 5]
+
+
+def get_inputs(batch_size=8, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    x_num = torch.randn(batch_size, 6, generator=generator)
+    x_cat = torch.stack([torch.randint(0, c, (batch_size,), generator=generator) for c in CATEGORIES], dim=1)
+    return x_num, x_cat
+
+
+def reference_tokens(tokenizer, x_num, x_cat):
+    # autograd path, which never reuses its output or the inference tables
+    with torch.enable_grad():
+        return tokenizer(x_num, x_cat).detach()
+
+
+def test_tokenizer_outputs_can_be_kept():
+    torch.manual_seed(0)
+    tokenizer = Tokenizer(6, CATEGORIES, 16, True)
+    inputs = [get_inputs(seed=seed) for seed in range(3)]
+    with torch.inference_mode():
+        outputs = [tokenizer(*x) for x in inputs]
+    for x, output in zip(inputs, outputs):
+        torch.testing.assert_close(output, reference_tokens(tokenizer, *x))
+
+
+def test_tokenizer_reused_output_is_overwritten():
+    # with reuse_output, the tokens are only valid until the next call
+    torch.manual_seed(0)
+    tokenizer = Tokenizer(6, CATEGORIES, 16, True)
+    with torch.inference_mode():
+        first = tokenizer(*get_inputs(seed=0), reuse_output=True)
+        first_values = first.clone()
+        second = tokenizer(*get_inputs(seed=1), reuse_output=True)
+    assert second.data_ptr() == first.data_ptr()
+    torch.testing.assert_close(first_values, reference_tokens(tokenizer, *get_inputs(seed=0)))
+    torch.testing.assert_close(first, reference_tokens(tokenizer, *get_inputs(seed=1)))
+
+
+def test_tokenizer_caches_are_not_pickled():
+    torch.manual_seed(0)
+    tokenizer = Tokenizer(6, CATEGORIES, 16, True)
+    size = len(pickle.dumps(tokenizer))
+    x = get_inputs(batch_size=4096)
+    with torch.inference_mode():
+        expected = tokenizer(*x, reuse_output=True).clone()
+    assert len(pickle.dumps(tokenizer)) == size
+    for other in [pickle.loads(pickle.dumps(tokenizer)), copy.deepcopy(tokenizer)]:
+        with torch.inference_mode():
+            torch.testing.assert_close(other(*x, reuse_output=True), expected)
+
+
+def test_tokenizer_reused_output_is_per_thread():
+    torch.manual_seed(0)
+    tokenizer = Tokenizer(6, CATEGORIES, 16, True)
+    outputs = []
+
+    def tokenize(seed):
+        with torch.inference_mode():
+            outputs.append(tokenizer(*get_inputs(seed=seed), reuse_output=True))
+
+    tokenize(0)
+    thread = threading.Thread(target=tokenize, args=(1,))
+    thread.start()
+    thread.join()
+    assert outputs[0].data_ptr() != outputs[1].data_ptr()
+    torch.testing.assert_close(outputs[0], reference_tokens(tokenizer, *get_inputs(seed=0)))
+    torch.testing.assert_close(outputs[1], reference_tokens(tokenizer, *get_inputs(seed=1)))
+
+
+def test_tokenizer_tables_follow_parameters():
+    torch.manual_seed(0)
+    tokenizer = Tokenizer(6, CATEGORIES, 16, True)
+    other = Tokenizer(6, CATEGORIES, 16, True)
+    x = get_inputs()
+    with torch.inference_mode():
+        tokenizer(*x, reuse_output=True)
+    # in place copy
+    tokenizer.load_state_dict(other.state_dict())
+    with torch.inference_mode():
+        torch.testing.assert_close(tokenizer(*x, reuse_output=True), reference_tokens(other, *x))
+    # new storages, without in place modification
+    for name, parameter in other.named_parameters():
+        tokenizer.get_parameter(name).data = parameter.data * 2
+    with torch.inference_mode():
+        torch.testing.assert_close(tokenizer(*x, reuse_output=True), reference_tokens(tokenizer, *x))
+
+
+def get_transformer(**kwargs):
+    params = dict(d_numerical=6, categories=CATEGORIES, token_bias=True, n_layers=2, d_token=16, n_heads=2,
+                  d_ffn_factor=2., attention_dropout=0., ffn_dropout=0., residual_dropout=0., activation="reglu",
+                  prenormalization=True, initialization="kaiming", kv_compression=None, kv_compression_sharing=None,
+                  d_out=2, regression=False, categorical_indicator=None)
+    params.update(kwargs)
+    return Transformer(**params)
+
+
+def test_transformer_predictions_can_be_concatenated():
+    torch.manual_seed(0)
+    model = get_transformer().eval()
+    inputs = [get_inputs(seed=seed) for seed in range(3)]
+    with torch.inference_mode():
+        predictions = torch.cat([model(x_num=x_num, x_cat=x_cat) for x_num, x_cat in inputs])
+    with torch.no_grad():
+        expected = torch.cat([model(x_num=x_num, x_cat=x_cat) for x_num, x_cat in inputs])
+    torch.testing.assert_close(predictions, expected)
+
+
+def test_compiled_tokenizer_matches_eager():
+    torch.manual_seed(0)
+    tokenizer = Tokenizer(6, CATEGORIES, 16, True)
+    x = get_inputs()
+    compiled = torch.compile(tokenizer, backend="eager")
+    with torch.no_grad():
+        torch.testing.assert_close(compiled(*x, reuse_output=True), reference_tokens(tokenizer, *x))
+
+
+@pytest.mark.parametrize("training", [False, True])
+@pytest.mark.parametrize("kv_compression", [False, True])
+@pytest.mark.parametrize("n_heads", [1, 2])
+@pytest.mark.parametrize("query", ["all", "cls"])
+def test_fast_attention_matches_attention(training, kv_compression, n_heads, query):
+    torch.manual_seed(0)
+    # dropout is random, so it's only active in the eval mode, where it's skipped
+    attention = MultiheadAttention(16, n_heads, 0. if training else 0.2, "kaiming").train(training)
+    compressions = [torch.nn.Linear(10, 5, bias=False), torch.nn.Linear(10, 5, bias=False)] if kv_compression \
+        else [None, None]
+    x = torch.randn(8, 10, 16, requires_grad=True)
+    outputs, gradients = [], []
+    for fast in [False, True]:
+        attention.fast = fast
+        x_q = x if query == "all" else x[:, :1]
+        output = attention(x_q, x, *compressions)
+        output.sum().backward()
+        outputs.append(output.detach())
+        gradients.append([p.grad.clone() for p in [x, *attention.parameters()]])
+        x.grad = None
+        attention.zero_grad()
+    torch.testing.assert_close(outputs[1], outputs[0], rtol=1e-5, atol=1e-5)
+    for gradient, expected in zip(gradients[1], gradients[0]):
+        torch.testing.assert_close(gradient, expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("training", [False, True])
+@pytest.mark.parametrize("kv_compression_sharing", [None, "headwise", "key-value", "layerwise"])
+def test_fast_attention_transformer(training, kv_compression_sharing):
+    x_num, x_cat = get_inputs()
+    kv_compression = None if kv_compression_sharing is None else 0.5
+    outputs = []
+    for fast_attention in [False, True]:
+        torch.manual_seed(0)
+        model = get_transformer(kv_compression=kv_compression, kv_compression_sharing=kv_compression_sharing,
+                                fast_attention=fast_attention).train(training)
+        with torch.no_grad():
+            outputs.append(model(x_num=x_num, x_cat=x_cat))
+    torch.testing.assert_close(outputs[1], outputs[0], rtol=1e-5, atol=1e-5)
@@ -0,0 +1,62 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+# Heavy backends, which a run should only import if its model needs them
+BACKENDS = ["torch", "skorch", "xgboost", "einops", "matplotlib", "openml", "wandb", "rotation_forest"]
+SKLEARN_ONLY = ["torch", "skorch", "xgboost", "einops", "matplotlib", "openml", "wandb"]
+# keyword -> backends which shouldn't be imported to get its model
+MODEL_TYPES = {"rf_c": SKLEARN_ONLY,
+               "gbt_r": SKLEARN_ONLY,
+               "hgbt_c": SKLEARN_ONLY,
+               "xgb_c": ["torch", "skorch", "einops", "matplotlib", "openml", "wandb"],
+               "rotation_forest": SKLEARN_ONLY,
+               "rtdl_resnet": ["xgboost", "einops", "openml", "wandb"],
+               "ft_transformer_regressor": ["xgboost", "einops", "openml", "wandb"],
+               "saint": ["xgboost", "skorch", "openml", "wandb"]}
+
+
+def get_imports(code):
+    """
+    Run code in a new interpreter with -X importtime
+    :return: (top-level packages imported, total import time in seconds)
+    """
+    code += "\nimport sys, json\nprint(json.dumps(sorted({name.split('.')[0] for name in sys.modules})))"
+    env = dict(os.environ, PYTHONPATH=SRC_DIR, PROJECT_DIR=os.path.join(SRC_DIR, ".."))
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=SRC_DIR, env=env,
+                             capture_output=True, text=True, check=True)
+    total_time = sum(int(line.split("|")[0].split(":")[1]) for line in process.stderr.splitlines()
+                     if line.startswith("import time:") and "self [us]" not in line) / 1e6
+    return json.loads(process.stdout.splitlines()[-1]), total_time
+
+
+def test_registry_import():
+    imported, total_time = get_imports("import utils.keyword_to_function_conversion")
+    print("keyword_to_function_conversion: {:.2f}s".format(total_time))
+    assert not set(BACKENDS) & set(imported)
+
+
+@pytest.mark.parametrize("keyword", list(MODEL_TYPES.keys()))
+def test_model_import(keyword):
+    imported, total_time = get_imports("from utils.keyword_to_function_conversion import convert_keyword_to_function\n"
+                                       "convert_keyword_to_function('{}')".format(keyword))
+    print("{}: {:.2f}s".format(keyword, total_time))
+    assert not set(MODEL_TYPES[keyword]) & set(imported)
+
+
+def test_run_experiment_import():
+    # what a run of an sklearn config imports, up to training and evaluating its model
+    imported, total_time = get_imports(
+        "import numpy as np\n"
+        "from run_experiment import CONFIG_DEFAULT, prepare_config\n"
+        "from train import train_model, evaluate_model_metrics\n"
+        "config = prepare_config(dict(CONFIG_DEFAULT, model_name='rf_c', model_type='sklearn', regression=False,\n"
+        "                             data__categorical=False, model__n_estimators=2))\n"
+        "x, y = np.random.rand(20, 3), np.arange(20) % 2\n"
+        "model, _ = train_model(0, x, y, None, config)\n"
+        "evaluate_model_metrics(model, x, y, None, None, x, y, config)")
+    print("run_experiment (rf_c): {:.2f}s".format(total_time))
+    assert not set(SKLEARN_ONLY) & set(imported)
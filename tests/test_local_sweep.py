@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from local_sweep import get_configs, get_done_runs, grid_configs, open_db, sample_parameter
+
+N_SAMPLES = 5000
+
+
+def sample(spec, n=N_SAMPLES):
+    rng = np.random.RandomState(0)
+    return np.array([sample_parameter(spec, rng) for _ in range(n)])
+
+
+def test_value_and_values():
+    assert set(sample({"value": 3}, 10)) == {3}
+    samples = sample({"values": ["a", "b", "c"], "probabilities": [0.8, 0.2, 0.]})
+    assert set(samples) == {"a", "b"}
+    assert abs(np.mean(samples == "a") - 0.8) < 0.03
+
+
+def test_uniform():
+    samples = sample({"distribution": "uniform", "min": -2, "max": 4})
+    assert samples.min() >= -2 and samples.max() <= 4
+    assert abs(samples.mean() - 1) < 0.1
+
+
+@pytest.mark.parametrize("spec", [{"distribution": "q_uniform", "min": 16, "max": 1024},
+                                  {"distribution": "int_uniform", "min": 16, "max": 1024}])
+def test_integer_distributions(spec):
+    samples = sample(spec)
+    assert all(isinstance(x, int) for x in samples.tolist())
+    assert samples.min() >= 16 and samples.max() <= 1024
+    assert abs(samples.mean() - 520) < 15
+
+
+def test_q_uniform_float_q():
+    samples = sample({"distribution": "q_uniform", "min": 0, "max": 1, "q": 0.25})
+    assert set(samples) <= {0., 0.25, 0.5, 0.75, 1.}
+
+
+def test_log_uniform_values():
+    samples = sample({"distribution": "log_uniform_values", "min": 1e-5, "max": 1e-2})
+    assert samples.min() >= 1e-5 and samples.max() <= 1e-2
+    # uniform in log space
+    assert abs(np.mean(np.log10(samples)) + 3.5) < 0.05
+    assert abs(np.mean(samples < 1e-4) - 1 / 3) < 0.03
+
+
+def test_q_log_uniform_values():
+    samples = sample({"distribution": "q_log_uniform_values", "min": 1, "max": 1000, "q": 1})
+    assert all(isinstance(x, int) for x in samples.tolist())
+    assert samples.min() >= 1 and samples.max() <= 1000
+    assert abs(np.median(samples) - np.sqrt(1000)) < 3
+
+
+def test_normal_distributions():
+    samples = sample({"distribution": "normal", "mu": 2, "sigma": 0.5})
+    assert abs(samples.mean() - 2) < 0.05 and abs(samples.std() - 0.5) < 0.05
+    samples = sample({"distribution": "q_normal", "mu": 10, "sigma": 3, "q": 2})
+    assert np.all(samples % 2 == 0)
+    samples = sample({"distribution": "log_normal", "mu": 0, "sigma": 1})
+    assert abs(np.log(samples).mean()) < 0.05 and abs(np.log(samples).std() - 1) < 0.05
+
+
+def test_unknown_distribution():
+    with pytest.raises(ValueError):
+        sample_parameter({"distribution": "beta"}, np.random.RandomState(0))
+
+
+def test_grid_configs():
+    configs = list(grid_configs({"a": {"values": [1, 2]}, "b": {"value": "x"}, "c": {"values": [True, False]}}))
+    assert configs == [{"a": 1, "b": "x", "c": True}, {"a": 1, "b": "x", "c": False},
+                       {"a": 2, "b": "x", "c": True}, {"a": 2, "b": "x", "c": False}]
+    with pytest.raises(ValueError):
+        list(grid_configs({"a": {"distribution": "uniform", "min": 0, "max": 1}}))
+
+
+def test_random_search_resume():
+    sweep_config = {"method": "random", "parameters": {"lr": {"distribution": "log_uniform_values",
+                                                              "min": 1e-5, "max": 1e-2}}}
+    configs = list(get_configs(sweep_config, n_runs=10, seed=1))
+    # a resumed sweep samples the same configs for the remaining runs
+    assert list(get_configs(sweep_config, n_runs=10, seed=1, start=6)) == configs[6:]
+    assert list(get_configs(sweep_config, n_runs=10, seed=2)) != configs
+
+
+def test_crashed_runs_can_be_retried(tmp_path):
+    db = open_db(str(tmp_path / "sweeps.db"))
+    for sweep, i, state in [("a", 0, "finished"), ("a", 1, "crashed"), ("a", 2, "finished"), ("b", 3, "crashed")]:
+        db.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?)", (sweep, i, state, "{}", "{}"))
+    db.commit()
+    assert get_done_runs(db, "a") == {0, 1, 2}
+    assert get_done_runs(db, "a", retry_crashed=True) == {0, 2}
+    assert get_done_runs(db, "b", retry_crashed=True) == set()
+    db.close()
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from utils.mmap_store import get_mmap_store_path, load_mmap_store, save_mmap_store
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.RandomState(0)
+    X = rng.rand(50, 4)
+    X[3, 1] = np.nan
+    y = rng.randint(0, 3, 50)
+    path = get_mmap_store_path(str(tmp_path / "data_test"))
+    save_mmap_store(X, y, [True, False, False, True], path)
+    X_new, y_new, categorical_indicator = load_mmap_store(path, verify=True)
+    np.testing.assert_array_equal(X_new, X.astype(np.float32))
+    np.testing.assert_array_equal(y_new, y)
+    np.testing.assert_array_equal(categorical_indicator, [True, False, False, True])
+    assert X_new.dtype == np.float32 and y_new.dtype == np.int64
+    assert X_new.flags.c_contiguous
+    assert isinstance(X_new, np.memmap) and not X_new.flags.writeable
+
+
+def test_regression_target_without_categorical(tmp_path):
+    path = str(tmp_path / "data_test.npystore")
+    save_mmap_store(np.ones((5, 2)), np.arange(5) / 2, None, path, regression=True)
+    _, y, categorical_indicator = load_mmap_store(path)
+    assert categorical_indicator is None
+    assert y.dtype == np.float32
+    np.testing.assert_array_equal(y, np.arange(5) / 2)
+
+
+def test_checksum_verified(tmp_path):
+    path = str(tmp_path / "data_test.npystore")
+    save_mmap_store(np.zeros((10, 3)), np.zeros(10), None, path)
+    X = np.load(str(tmp_path / "data_test.npystore" / "X.npy"), mmap_mode="r+")
+    X[0, 0] = 1
+    X.flush()
+    del X
+    load_mmap_store(path)  # not verified by default
+    with pytest.raises(ValueError, match="Checksum"):
+        load_mmap_store(path, verify=True)
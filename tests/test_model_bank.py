@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+from model_bank import ModelBank, get_padding_ratio, group_configs
+
+CATEGORICAL_INDICATOR = np.array([False, False, False, True, True])
+
+
+def get_data(n=64):
+    rng = np.random.RandomState(0)
+    X = np.concatenate([rng.randn(n, 3), rng.randint(0, 4, (n, 2))], axis=1).astype(np.float32)
+    return X, (X[:, 0] > 0).astype(int)
+
+
+def get_config(model_name, **module_params):
+    config = {"model_type": "skorch", "model_name": model_name, "regression": False, "transformed_target": False,
+              "model__batch_size": 32, "model__max_epochs": 20, "model__optimizer": "adamw"}
+    config.update({"model__module__" + name: value for name, value in module_params.items()})
+    return config
+
+
+def get_configs(model_name, normalization="layernorm", dropout=0.):
+    # models of different depths, widths and embedding sizes, the widest model not being the deepest
+    if model_name == "rtdl_mlp":
+        return [get_config(model_name, n_layers=n_layers, d_layers=d, dropout=dropout, d_embedding=d_embedding)
+                for n_layers, d, d_embedding in [(1, 16, 4), (3, 8, 8), (2, 12, 3)]]
+    return [get_config(model_name, n_layers=n_layers, d=d, d_hidden_factor=d_hidden_factor, hidden_dropout=dropout,
+                       residual_dropout=dropout, d_embedding=d_embedding, activation="reglu",
+                       normalization=normalization)
+            for n_layers, d, d_hidden_factor, d_embedding in [(1, 16, 2., 4), (3, 8, 1., 8), (2, 12, 1.5, 3)]]
+
+
+def get_bank_and_modules(configs, X):
+    bank = ModelBank(configs, CATEGORICAL_INDICATOR)
+    torch.manual_seed(0)
+    modules = bank._create_modules(X)
+    torch.manual_seed(0)
+    bank._init_modules(X)
+    return bank, modules
+
+
+@pytest.mark.parametrize("model_name,normalization", [("rtdl_mlp", None), ("rtdl_resnet", "layernorm"),
+                                                      ("rtdl_resnet", "batchnorm")])
+@pytest.mark.parametrize("training", [False, True])
+def test_padded_models_compute_the_modules(model_name, normalization, training):
+    X, _ = get_data()
+    bank, modules = get_bank_and_modules(get_configs(model_name, normalization), X)
+    X_tensors = bank._to_tensors(X)
+    bank.training = training
+    outputs, new_buffers = bank._forward(bank.params, bank.buffers, X_tensors, slice(None))
+    for k, module in enumerate(modules):
+        module.train(training)
+        expected = module(x_num=X_tensors["x_num"], x_cat=X_tensors["x_cat"])
+        torch.testing.assert_close(outputs[k], expected, rtol=1e-5, atol=1e-5)
+        if training and normalization == "batchnorm":
+            expected_mean = module.layers[0]["norm"].running_mean
+            torch.testing.assert_close(new_buffers["blocks.0.norm.running_mean"][k, :len(expected_mean)],
+                                       expected_mean)
+
+
+@pytest.mark.parametrize("model_name", ["rtdl_mlp", "rtdl_resnet"])
+def test_optimizer_step_matches_adamw(model_name):
+    X, y = get_data()
+    configs = get_configs(model_name)
+    for k, config in enumerate(configs):
+        config["model__lr"] = 10 ** -(k + 2)
+        config["model__optimizer__weight_decay"] = 10 ** -k
+    bank, modules = get_bank_and_modules(configs, X)
+    X_tensors, y_tensor = bank._to_tensors(X, y)
+    bank.training = True
+    for step in range(2):
+        outputs, _ = bank._forward(bank.params, bank.buffers, X_tensors, slice(None))
+        for p in bank.params.values():
+            p.grad = None
+        bank._losses(outputs, y_tensor).sum().backward()
+        bank._optimizer_step(torch.ones(len(configs), dtype=torch.bool))
+    bank.training = False
+    outputs, _ = bank._forward(bank.params, bank.buffers, X_tensors, slice(None))
+    for k, (config, module) in enumerate(zip(configs, modules)):
+        optimizer = torch.optim.AdamW(module.parameters(), lr=config["model__lr"],
+                                      weight_decay=config["model__optimizer__weight_decay"])
+        module.train()
+        for step in range(2):
+            optimizer.zero_grad()
+            F.cross_entropy(module(x_num=X_tensors["x_num"], x_cat=X_tensors["x_cat"]), y_tensor).backward()
+            optimizer.step()
+        module.eval()
+        torch.testing.assert_close(outputs[k], module(x_num=X_tensors["x_num"], x_cat=X_tensors["x_cat"]),
+                                   rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("regression", [False, True])
+def test_history_log_matches_run_iteration(regression):
+    X, y = get_data(200)
+    configs = get_configs("rtdl_resnet", dropout=0.2)
+    for config in configs:
+        config["regression"] = regression
+    if regression:
+        y = X[:, 0] + X[:, 1]
+    torch.manual_seed(0)
+    bank = ModelBank(configs, CATEGORICAL_INDICATOR).fit(X, y)
+    history_log = bank.get_history_log(1)
+    valid_key = "valid_loss_vector" if regression else "valid_accuracy_vector"
+    assert set(history_log.keys()) == {"num_epochs", "train_accuracy_vector", valid_key}
+    assert history_log["num_epochs"] == 20
+    assert len(history_log["train_accuracy_vector"]) == len(history_log[valid_key]) == 2
+    if not regression:
+        assert all(0 <= accuracy <= 1 for accuracy in history_log["train_accuracy_vector"])
+
+
+def test_group_configs():
+    configs = [get_config("rtdl_mlp", n_layers=n_layers, d_layers=d, dropout=dropout, d_embedding=64)
+               for n_layers, d, dropout in [(8, 1024, 0.), (1, 16, 0.5), (2, 16, 0.), (8, 1000, 0.1), (1, 20, 0.)]]
+    configs.append(dict(configs[0], model__batch_size=512))
+    groups = group_configs(configs)
+    assert sorted(map(sorted, groups)) == [[0, 1, 2, 3, 4], [5]]
+    # sorted by cost, and the large models aren't padded with the small ones
+    groups = group_configs(configs, max_padding=2.5)
+    assert sorted(map(sorted, groups)) == [[0, 3], [1, 2, 4], [5]]
+    assert all(get_padding_ratio([configs[i] for i in group]) <= 2.5 for group in groups)
+    assert sorted(map(len, group_configs(configs, max_size=2))) == [1, 1, 2, 2]
@@ -1,10 +1,21 @@
 from launch_config.model_configs import config_dic
 from run_experiment import train_model_on_config
+from utils.mmap_store import get_mmap_store_path
 import os
+import pytest
 os.environ["WANDB_MODE"]="offline"
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
 
 
-def test_models():
+def dataset_exists(benchmark, dataset):
+    # as generate_data.import_real_data, run from the src folder
+    path = "../data/{}/{}/data_{}".format("num_and_cat" if benchmark["categorical"] else "numerical_only",
+                                          "regression" if benchmark["task"] == "regression" else "balanced",
+                                          dataset)
+    return os.path.exists(path) or os.path.isdir(get_mmap_store_path(path))
+
+
+def test_models(monkeypatch):
     # Run all models on one dataset per benchmark for a few epochs
     # to check that everything is working
     test_benchmarks = [
@@ -65,6 +76,13 @@ def test_models():
     models = ["gbt", "rf", "xgb", "hgbt",
               "ft_transformer", "resnet", "mlp", "saint"]
 
+    # the datasets are read relative to the src folder (see data/download_data.py to get them)
+    monkeypatch.chdir(SRC_DIR)
+    test_benchmarks = [benchmark for benchmark in test_benchmarks
+                       if all(dataset_exists(benchmark, dataset) for dataset in benchmark["datasets"])]
+    if len(test_benchmarks) == 0:
+        pytest.skip("The benchmark datasets have not been downloaded")
+
     for benchmark in test_benchmarks:
         for model_name in models:
             print(model_name)
@@ -122,4 +140,4 @@ def test_models():
 
 
 if __name__ == "__main__":
-    test_models()
\ No newline at end of file
+    test_models(pytest.MonkeyPatch())
\ No newline at end of file
@@ -0,0 +1,116 @@
+import os
+import numpy as np
+import pytest
+import scipy.sparse
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer, TransformedTargetRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder, QuantileTransformer
+from utils.preprocessing_cache import CachedTransformer, CachedTransformedTargetRegressor, fit_transform_cached, \
+    get_fingerprint
+
+
+def get_one_hot_encoder(n_columns, sparse=True):
+    return ColumnTransformer([("one_hot", OneHotEncoder(handle_unknown="ignore"), list(range(n_columns))),
+                              ("numerical", "passthrough", [n_columns])],
+                             sparse_threshold=1. if sparse else 0.)
+
+
+def get_data(n_columns=3):
+    rng = np.random.RandomState(0)
+    X = np.concatenate([rng.randint(0, 5, (100, n_columns)), rng.randn(100, 1)], axis=1)
+    return X, X[:, -1] * 2 + X[:, 0] + rng.randn(100) * 0.1
+
+
+def test_cache_hit_and_miss(tmp_path):
+    X, y = get_data()
+    transformer = QuantileTransformer(n_quantiles=50)
+    fitted, output = fit_transform_cached(transformer, X, str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    cached_fitted, cached_output = fit_transform_cached(transformer, X, str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    np.testing.assert_array_equal(cached_output, output)
+    np.testing.assert_array_equal(cached_fitted.quantiles_, fitted.quantiles_)
+    # other parameters or other data are misses
+    fit_transform_cached(QuantileTransformer(n_quantiles=20), X, str(tmp_path))
+    fit_transform_cached(transformer, X[:50], str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_fingerprint_sees_parameters_hidden_by_repr():
+    X, _ = get_data(300)
+    # sklearn abbreviates the middle of long reprs, here the only column which differs
+    columns = list(range(300))
+    preprocessors = [ColumnTransformer([("one_hot", OneHotEncoder(), columns[:150] + [i] + columns[151:])])
+                     for i in [150, 299]]
+    assert repr(preprocessors[0]) == repr(preprocessors[1])
+    assert get_fingerprint(preprocessors[0], X) != get_fingerprint(preprocessors[1], X)
+    assert get_fingerprint(preprocessors[0], X) == get_fingerprint(clone(preprocessors[0]), X)
+
+
+@pytest.mark.parametrize("sparse", [True, False])
+def test_cached_transformer_round_trip(tmp_path, sparse):
+    X, _ = get_data()
+    expected = get_one_hot_encoder(3, sparse).fit_transform(X)
+    assert scipy.sparse.issparse(expected) == sparse
+    for _ in range(2):  # miss then hit
+        transformer = CachedTransformer(get_one_hot_encoder(3, sparse), str(tmp_path))
+        output = transformer.fit_transform(X)
+        assert scipy.sparse.issparse(output) == sparse
+        if sparse:
+            output, expected_dense = output.toarray(), expected.toarray()
+        else:
+            expected_dense = expected
+        np.testing.assert_array_equal(output, expected_dense)
+        transformed = transformer.transform(X[:10])
+        np.testing.assert_array_equal(transformed.toarray() if sparse else transformed, expected_dense[:10])
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_cached_target_regressor_predicts_as_uncached(tmp_path):
+    X, y = get_data()
+    expected = TransformedTargetRegressor(LinearRegression(), transformer=QuantileTransformer(n_quantiles=50)) \
+        .fit(X, y).predict(X)
+    for _ in range(2):  # miss then hit
+        model = CachedTransformedTargetRegressor(LinearRegression(), transformer=QuantileTransformer(n_quantiles=50),
+                                                 cache_dir=str(tmp_path))
+        np.testing.assert_allclose(model.fit(X, y).predict(X), expected)
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_cached_target_regressor_checks_the_target(tmp_path):
+    X, y = get_data()
+    model = CachedTransformedTargetRegressor(LinearRegression(), transformer=QuantileTransformer(n_quantiles=50),
+                                             cache_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        model.fit(X, np.where(np.arange(len(y)) == 3, np.nan, y))
+    with pytest.warns(UserWarning, match="not strictly inverse"):
+        CachedTransformedTargetRegressor(LinearRegression(), transformer=FunctionTransformer(np.exp, np.exp),
+                                         cache_dir=str(tmp_path)).fit(X, y)
+    # the parameters of TransformedTargetRegressor are kept by clone
+    assert not clone(model.set_params(check_inverse=False)).check_inverse
+
+
+class CountingQuantileTransformer(QuantileTransformer):
+    n_transforms = 0
+
+    def transform(self, X):
+        CountingQuantileTransformer.n_transforms += 1
+        return super().transform(X)
+
+
+@pytest.mark.parametrize("y_2d", [False, True])
+def test_cached_target_regressor_uses_the_cached_target(tmp_path, y_2d):
+    X, y = get_data()
+    if y_2d:
+        y = y.reshape(-1, 1)
+    expected = TransformedTargetRegressor(LinearRegression(), transformer=QuantileTransformer(n_quantiles=50)).fit(X, y)
+    for hit in [False, True]:
+        CountingQuantileTransformer.n_transforms = 0
+        model = CachedTransformedTargetRegressor(LinearRegression(), transformer=CountingQuantileTransformer(
+            n_quantiles=50), check_inverse=False, cache_dir=str(tmp_path)).fit(X, y)
+        # the training target is only transformed by fit_transform on a miss, never again by fit
+        assert CountingQuantileTransformer.n_transforms == (0 if hit else 1)
+        assert type(model.transformer_) is CountingQuantileTransformer
+        np.testing.assert_allclose(model.regressor_.coef_, expected.regressor_.coef_)
+        assert model.predict(X).shape == y.shape
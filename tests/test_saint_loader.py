@@ -0,0 +1,56 @@
+import importlib.util
+import os
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+SAINT_LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "TabSurvey", "models", "saint_lib")
+
+
+@pytest.fixture
+def data_openml():
+    spec = importlib.util.spec_from_file_location("data_openml", os.path.join(SAINT_LIB_DIR, "data_openml.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_dataset(data_openml, task, n=103):
+    rng = np.random.RandomState(0)
+    X = np.concatenate([rng.randint(0, 4, (n, 2)), rng.randn(n, 3)], axis=1)
+    X[:, 2] = np.arange(n)  # identifies the rows
+    mask = (rng.rand(n, 5) > 0.1).astype(int)
+    y = rng.randn(n, 1) if task == "regression" else rng.randint(0, 3, (n, 1))
+    mean, std = np.array([1., 0., -1.], dtype=np.float32), np.array([2., 1., 0.5], dtype=np.float32)
+    return data_openml.DataSetCatCon({"data": X, "mask": mask}, {"data": y}, [0, 1], task, (mean, std))
+
+
+@pytest.mark.parametrize("task", ["regression", "classification"])
+def test_batches_match_dataloader(data_openml, task):
+    dataset = get_dataset(data_openml, task)
+    loader = data_openml.CatConBatchLoader(dataset, batch_size=16)
+    expected_batches = list(DataLoader(dataset, batch_size=16))
+    assert len(loader) == len(expected_batches)
+    batches = list(loader)
+    assert len(batches) == len(expected_batches)
+    for batch, expected_batch in zip(batches, expected_batches):
+        assert len(batch) == len(expected_batch) == 5
+        for tensor, expected_tensor in zip(batch, expected_batch):
+            assert tensor.dtype == expected_tensor.dtype
+            assert tensor.shape == expected_tensor.shape
+            torch.testing.assert_close(tensor, expected_tensor, rtol=0, atol=0)
+
+
+def test_shuffled_batches_are_a_permutation(data_openml):
+    dataset = get_dataset(data_openml, "classification")
+    tensors = [torch.cat(tensors) for tensors in zip(*data_openml.CatConBatchLoader(dataset, batch_size=200))]
+    torch.manual_seed(0)
+    batches = list(data_openml.CatConBatchLoader(dataset, batch_size=16, shuffle=True))
+    assert [len(batch[0]) for batch in batches] == [16] * 6 + [7]
+    shuffled = [torch.cat(tensors) for tensors in zip(*batches)]
+    assert not torch.equal(shuffled[1], tensors[1])
+    # the rows of the five tensors are permuted together: sorting the rows by their identifier gives back the data
+    order = torch.argsort(shuffled[1][:, 0])
+    for tensor, shuffled_tensor in zip(tensors, shuffled):
+        torch.testing.assert_close(shuffled_tensor[order], tensor, rtol=0, atol=0)
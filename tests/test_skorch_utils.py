@@ -0,0 +1,177 @@
+import copy
+import os
+import numpy as np
+import pytest
+import skorch
+import torch
+from skorch import NeuralNetRegressor
+from skorch.dataset import Dataset
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.preprocessing import QuantileTransformer
+from torch.utils.data import DataLoader
+from skorch_models_regression import create_resnet_regressor_skorch
+from utils.skorch_utils import BestStateCheckpoint, TensorBatchIterator, VirtualBatchMixin, get_best_state_checkpoint
+
+
+def get_dataset(with_y=True):
+    rng = np.random.RandomState(0)
+    X = {"x_num": rng.rand(103, 4).astype(np.float32), "x_cat": rng.randint(0, 5, (103, 2))}
+    return Dataset(X, rng.rand(103).astype(np.float32) if with_y else None)
+
+
+def assert_same_batches(batches, expected_batches):
+    batches, expected_batches = list(batches), list(expected_batches)
+    assert len(batches) == len(expected_batches)
+    for (X, y), (X_expected, y_expected) in zip(batches, expected_batches):
+        assert X.keys() == X_expected.keys()
+        for key in X.keys():
+            torch.testing.assert_close(X[key], X_expected[key], rtol=0, atol=0)
+        torch.testing.assert_close(y, y_expected, rtol=0, atol=0)
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+@pytest.mark.parametrize("drop_last", [False, True])
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_tensor_batch_iterator_matches_dataloader(shuffle, drop_last, prefetch):
+    dataset = get_dataset()
+    iterator = TensorBatchIterator(dataset, batch_size=16, shuffle=shuffle, drop_last=drop_last, prefetch=prefetch)
+    assert len(iterator) == len(DataLoader(dataset, batch_size=16, drop_last=drop_last))
+    for epoch in range(2):
+        torch.manual_seed(epoch)
+        expected_batches = DataLoader(dataset, batch_size=16, shuffle=shuffle, drop_last=drop_last)
+        expected_batches = list(expected_batches)
+        expected_next = torch.rand(3)
+        torch.manual_seed(epoch)
+        assert_same_batches(iterator, expected_batches)
+        # the global rng is left in the same state, so the rest of the training is unchanged
+        torch.testing.assert_close(torch.rand(3), expected_next)
+
+
+def test_tensor_batch_iterator_without_y():
+    dataset = get_dataset(with_y=False)
+    assert_same_batches(TensorBatchIterator(dataset, batch_size=50), DataLoader(dataset, batch_size=50))
+
+
+class StateRecorder(skorch.callbacks.Callback):
+    """Keep a copy of the module state at the end of each epoch"""
+    def initialize(self):
+        self.states_ = []
+        return self
+
+    def on_epoch_end(self, net, **kwargs):
+        self.states_.append(copy.deepcopy(net.module_.state_dict()))
+
+
+def get_regression_data():
+    rng = np.random.RandomState(0)
+    X = rng.rand(200, 5).astype(np.float32)
+    y = (X @ rng.rand(5, 1) + 0.5 * rng.randn(200, 1)).astype(np.float32)
+    return X, y
+
+
+@pytest.mark.parametrize("spill", [False, True])
+def test_best_state_checkpoint_restores_best_epoch(tmp_path, spill):
+    torch.manual_seed(0)
+    recorder = StateRecorder()
+    dirname = str(tmp_path) if spill else None
+    # a large learning rate, so that the validation loss doesn't always decrease
+    net = NeuralNetRegressor(torch.nn.Sequential(torch.nn.Linear(5, 16), torch.nn.ReLU(), torch.nn.Linear(16, 1)),
+                             max_epochs=15, lr=0.5, optimizer=torch.optim.SGD,
+                             callbacks=[BestStateCheckpoint(dirname=dirname), recorder])
+    net.fit(*get_regression_data())
+    valid_losses = net.history[:, "valid_loss"]
+    best_epoch = int(np.argmin(valid_losses))
+    assert best_epoch != len(valid_losses) - 1
+
+    checkpoint = get_best_state_checkpoint(net)
+    assert checkpoint.best_epoch_ == best_epoch + 1
+    assert net.history[:, "event_cp"] == net.history[:, "valid_loss_best"]
+    if spill:
+        assert os.path.exists(checkpoint.spill_path)
+        for key, value in torch.load(checkpoint.spill_path).items():
+            torch.testing.assert_close(value, recorder.states_[best_epoch][key])
+    assert checkpoint.load_best(net)
+    for key, value in net.module_.state_dict().items():
+        torch.testing.assert_close(value, recorder.states_[best_epoch][key])
+
+    checkpoint.cleanup()
+    assert checkpoint.best_state_ is None
+    assert not os.listdir(str(tmp_path))
+    assert not checkpoint.load_best(net)
+
+
+class VirtualBatchRegressor(VirtualBatchMixin, NeuralNetRegressor):
+    pass
+
+
+class OutOfMemoryModule(torch.nn.Module):
+    """MLP which runs out of memory on batches larger than max_batch_size"""
+    def __init__(self, max_batch_size=None):
+        super().__init__()
+        self.max_batch_size = max_batch_size
+        self.layers = torch.nn.Sequential(torch.nn.Linear(5, 16), torch.nn.ReLU(), torch.nn.Linear(16, 1))
+
+    def forward(self, X):
+        if self.max_batch_size is not None and len(X) > self.max_batch_size:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return self.layers(X)
+
+
+def get_gradients_after_step(max_batch_size=None, virtual_batch_size=None):
+    X, y = get_regression_data()
+    torch.manual_seed(0)
+    net = VirtualBatchRegressor(OutOfMemoryModule, module__max_batch_size=max_batch_size, batch_size=64,
+                                optimizer=torch.optim.SGD, lr=0.)
+    net.initialize()
+    net.virtual_batch_size_ = virtual_batch_size
+    net.history.new_epoch()
+    net.history.new_batch()
+    torch.manual_seed(1)
+    step = net.train_step_single((torch.as_tensor(X[:64]), torch.as_tensor(y[:64])))
+    return net, step["loss"], {name: p.grad.clone() for name, p in net.module_.named_parameters()}
+
+
+@pytest.mark.parametrize("max_batch_size, virtual_batch_size", [(None, 16), (20, None)])
+def test_virtual_batch_same_gradients(max_batch_size, virtual_batch_size):
+    _, expected_loss, expected_gradients = get_gradients_after_step()
+    net, loss, gradients = get_gradients_after_step(max_batch_size, virtual_batch_size)
+    # chunks of 16 (given or after halving 64 on out of memory errors)
+    assert net.virtual_batch_size_ == 16
+    torch.testing.assert_close(loss, expected_loss)
+    for name in expected_gradients.keys():
+        torch.testing.assert_close(gradients[name], expected_gradients[name])
+
+
+def test_virtual_batch_disabled():
+    X, y = get_regression_data()
+    net = VirtualBatchRegressor(OutOfMemoryModule, module__max_batch_size=20, batch_size=64, auto_virtual_batch=False)
+    with pytest.raises(RuntimeError, match="out of memory"):
+        net.fit(X, y)
+
+
+@pytest.mark.parametrize("amp,compile", [(True, False), (False, True), (True, True)])
+def test_amp_compile_through_transformed_target(amp, compile):
+    X, y = get_regression_data()
+    torch.manual_seed(0)
+    # TransformedTargetRegressor fits a clone of the net, which must keep amp and compile
+    net = create_resnet_regressor_skorch(0, use_checkpoints=False, categorical_indicator=np.zeros(5, dtype=bool),
+                                         optimizer="adamw", batch_size=32, max_epochs=2, device="cpu",
+                                         module__n_layers=2, module__d=16, module__d_hidden_factor=1.,
+                                         module__hidden_dropout=0., module__residual_dropout=0.,
+                                         module__d_embedding=4, module__activation="reglu",
+                                         module__normalization="batchnorm", amp=amp, compile=compile,
+                                         compile__backend="eager")
+    model = TransformedTargetRegressor(net, transformer=QuantileTransformer(n_quantiles=50,
+                                                                            output_distribution="normal"))
+    model.fit(X, y)
+    assert model.regressor_.amp == amp and model.regressor_.compile == compile
+    assert hasattr(model.regressor_.module_, "_orig_mod") == compile
+    predictions = model.predict(X)
+    assert predictions.shape == y.shape and np.isfinite(predictions).all()
+    # bfloat16 forward passes, with float32 outputs
+    output = model.regressor_.infer(torch.as_tensor(X[:8]))
+    assert output.dtype == torch.float32
+    model.regressor_.set_params(amp=not amp)
+    other_output = model.regressor_.infer(torch.as_tensor(X[:8]))
+    torch.testing.assert_close(output, other_output, rtol=0.05, atol=0.05)
+    assert not torch.equal(output, other_output)
@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+from generate_data import generate_periodic_triangles_uniform
+from target_function_classif import generate_random_forest, periodic_sinus, periodic_sinus_batch, periodic_triangle, \
+    periodic_triangle_batch
+
+
+def legacy_forest_predict(forest, x):
+    # per-sample loop of Forest.predict before its vectorization
+    predictions = []
+    for sample in x:
+        values, counts = np.unique([tree.predict(sample) for tree in forest.tree_list], return_counts=True)
+        indices_max = np.argwhere(counts == np.amax(counts)).flatten()
+        prediction = forest.rng.choice(values[indices_max], 1)[0]
+        predictions.append(prediction)
+    return np.array(predictions)
+
+
+@pytest.mark.parametrize("n_classes,n_trees", [(2, 5), (2, 4), (3, 6)])
+@pytest.mark.parametrize("depth_distribution", ["constant", "uniform"])
+def test_forest_predict_matches_loop(n_classes, n_trees, depth_distribution):
+    x = np.random.RandomState(0).randn(500, 4)
+    labels, next_draws = [], []
+    for predict in [lambda forest, x: forest.predict(x), legacy_forest_predict]:
+        rng = np.random.RandomState(1)
+        forest = generate_random_forest(x, n_classes, n_trees, max_depth=5, depth_distribution=depth_distribution,
+                                        rng=rng)
+        labels.append(predict(forest, x))
+        # the ties are broken with the same draws, so the rest of the generation is unchanged
+        next_draws.append(rng.random_sample(5))
+    np.testing.assert_array_equal(labels[0], labels[1])
+    assert labels[0].dtype == labels[1].dtype
+    np.testing.assert_array_equal(next_draws[0], next_draws[1])
+
+
+def legacy_periodic_sinus(x, period=None, offset=None, period_size=None, noise=True, rng=None):
+    # per-sample loop of periodic_sinus before its vectorization
+    if not period_size is None:
+        if not period is None:
+            offset = (4 - period_size * period) / 2
+        elif not offset is None:
+            period = (4 - offset * 2) / period_size
+    res = np.zeros(x.shape[0])
+    for i in range(x.shape[0]):
+        if x[i] < -2 + offset or x[i] > 2 - offset:
+            res[i] = 0
+        else:
+            res[i] = np.sin(x[i] * (2 * np.pi) / (4 - 2 * offset) * period)
+    if noise:
+        res += rng.normal(0, 0.1, x.shape[0])
+    return res
+
+
+def legacy_periodic_triangle(x, n_periods=None, offset=None, period_size=None, noise=True, rng=None):
+    # per-sample loop of periodic_triangle before its vectorization
+    if not period_size is None:
+        if not n_periods is None:
+            offset = (4 - period_size * n_periods) / 2
+    res = np.zeros(x.shape[0])
+    for i in range(x.shape[0]):
+        if x[i] < -2 + offset or x[i] > 2 - offset:
+            res[i] = 0
+        else:
+            res[i] = 2 * np.abs(np.abs(x[i]) / period_size - int(np.abs(x[i]) / period_size + 1/2))
+    if noise:
+        res += rng.normal(0, 0.1, x.shape[0])
+    return res.reshape(-1, 1)
+
+
+def legacy_generate_periodic_triangles_uniform(num_samples, period=None, offset=None, period_size=None, noise=True,
+                                               rng=None):
+    # generate_periodic_triangles_uniform before its vectorization
+    if not period_size is None:
+        if not period is None:
+            offset = (4 - period_size * period) / 2
+    x = np.zeros((num_samples))
+    num_samples_in_offset_zone = int(num_samples * (offset * 2 / 4))
+    x[:num_samples_in_offset_zone // 2] = rng.uniform(low=-2, high=-2 + offset, size=num_samples_in_offset_zone // 2)
+    x[num_samples_in_offset_zone // 2:num_samples_in_offset_zone] = rng.uniform(
+        low=2 - offset, high=2, size=num_samples_in_offset_zone - num_samples_in_offset_zone // 2)
+    num_samples_per_period = int((num_samples - num_samples_in_offset_zone) / period)
+    for i in range(period):
+        x[num_samples_in_offset_zone + i * num_samples_per_period:num_samples_in_offset_zone + (
+                i + 1) * num_samples_per_period] = rng.uniform(low=-2 + offset + i * period_size,
+                                                               high=-2 + offset + (i + 1) * period_size,
+                                                               size=num_samples_per_period)
+    res = np.zeros(x.shape[0])
+    for i in range(x.shape[0]):
+        if x[i] < -2 + offset or x[i] > 2 - offset:
+            res[i] = 0
+        else:
+            res[i] = 2 * np.abs(np.abs(x[i]) / period_size - int(np.abs(x[i]) / period_size + 1 / 2))
+    if noise:
+        res += rng.normal(0, 0.1, x.shape[0])
+    return x.reshape(-1, 1), res
+
+
+def get_periodic_inputs(dtype):
+    # includes the boundaries of the periodic zone and the middles of the triangles
+    x = np.concatenate([np.random.RandomState(0).uniform(-2, 2, 300), [-2, -1.5, -0.25, 0, 0.25, 1.5, 2]])
+    return x.astype(dtype)
+
+
+def assert_same_outputs(function, legacy_function, x, **params):
+    outputs, next_draws = [], []
+    for f in [function, legacy_function]:
+        rng = np.random.RandomState(0)
+        outputs.append(f(x, rng=rng, **params))
+        next_draws.append(rng.random_sample(3))
+    np.testing.assert_array_equal(outputs[0], outputs[1])
+    assert outputs[0].shape == outputs[1].shape and outputs[0].dtype == outputs[1].dtype
+    np.testing.assert_array_equal(next_draws[0], next_draws[1])
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("noise", [False, True])
+@pytest.mark.parametrize("params", [dict(period=3, offset=0.5), dict(period=4, period_size=0.75),
+                                    dict(offset=0.25, period_size=0.5)])
+def test_periodic_sinus_matches_loop(dtype, noise, params):
+    assert_same_outputs(periodic_sinus, legacy_periodic_sinus, get_periodic_inputs(dtype), noise=noise, **params)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("noise", [False, True])
+@pytest.mark.parametrize("params", [dict(n_periods=4, period_size=0.75), dict(offset=0.25, period_size=0.5),
+                                    dict(offset=0.1, period_size=0.3)])
+def test_periodic_triangle_matches_loop(dtype, noise, params):
+    assert_same_outputs(periodic_triangle, legacy_periodic_triangle, get_periodic_inputs(dtype), noise=noise,
+                        **params)
+
+
+@pytest.mark.parametrize("noise", [False, True])
+def test_periodic_triangles_uniform_matches_loop(noise):
+    outputs, next_draws = [], []
+    for f in [generate_periodic_triangles_uniform, legacy_generate_periodic_triangles_uniform]:
+        rng = np.random.RandomState(0)
+        outputs.append(f(1000, period=3, period_size=0.8, noise=noise, rng=rng))
+        next_draws.append(rng.random_sample(3))
+    for output, expected in zip(*outputs):
+        np.testing.assert_array_equal(output, expected)
+    np.testing.assert_array_equal(next_draws[0], next_draws[1])
+
+
+@pytest.mark.parametrize("noise", [False, True])
+def test_periodic_batches_match_single_variants(noise):
+    x = get_periodic_inputs(np.float64)
+    for batch_function, function, params in [
+            (periodic_sinus_batch, periodic_sinus, dict(period=[2, 3, 4], offset=[0.5, 0.25, 0.])),
+            (periodic_triangle_batch, periodic_triangle, dict(n_periods=[2, 3, 4], period_size=[1., 0.8, 0.5]))]:
+        rng = np.random.RandomState(0)
+        expected = np.stack([function(x, noise=noise, rng=rng,
+                                      **{name: values[j] for name, values in params.items()}).reshape(-1)
+                             for j in range(3)], axis=1)
+        expected_next = rng.random_sample(3)
+        rng = np.random.RandomState(0)
+        # (n_samples, 1) inputs are accepted too
+        np.testing.assert_array_equal(batch_function(x.reshape(-1, 1), noise=noise, rng=rng, **params), expected)
+        np.testing.assert_array_equal(rng.random_sample(3), expected_next)
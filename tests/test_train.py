@@ -0,0 +1,40 @@
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from train import evaluate_model_metrics, predict_split
+
+
+class TabSurveyLikeModel:
+    """predict_proba on raw inputs differs from predict, which preprocesses x (as TabSurvey's CatBoost)"""
+    def __init__(self, model):
+        self.model = model
+
+    def predict_proba(self, X):
+        self.prediction_probabilities = self.model.predict_proba(X)
+        return self.prediction_probabilities
+
+    def predict(self, X):
+        self.predict_proba(-X)
+        self.predictions = np.argmax(self.prediction_probabilities, axis=1)
+        return self.predictions
+
+
+def get_data():
+    rng = np.random.RandomState(0)
+    x = rng.randn(100, 3)
+    return x, (x[:, 0] + 0.3 * rng.randn(100) > 0).astype(int)
+
+
+def test_predict_split_uses_the_predictions_of_the_model():
+    x, y = get_data()
+    model = LogisticRegression().fit(x, y)
+    y_hat, proba = predict_split(model, x, {"model_type": "sklearn", "regression": False})
+    np.testing.assert_array_equal(y_hat, model.predict(x))
+    np.testing.assert_allclose(proba, model.predict_proba(x))
+    tab_survey_model = TabSurveyLikeModel(model)
+    y_hat, proba = predict_split(tab_survey_model, x, {"model_type": "tab_survey", "regression": False})
+    np.testing.assert_array_equal(y_hat, model.predict(-x))
+    np.testing.assert_allclose(proba, model.predict_proba(-x))
+    metrics = evaluate_model_metrics(tab_survey_model, x, y, None, None, x, y,
+                                     {"model_type": "tab_survey", "regression": False})
+    assert metrics["val"] is None
+    assert metrics["test"]["accuracy"] == np.mean(model.predict(-x) == y)